@@ -2,29 +2,132 @@ import streamlit as st
 import cv2
 import numpy as np
 import time
+import datetime
+import tempfile
 import pandas as pd
 from PIL import Image
 from database.db import *
 from vision.face_recog import *
-from vision.liveness import check_liveness, reset_liveness
+from vision.gallery import GalleryCache
+from vision.embedding_codec import encode_embedding, decode_embedding
+from vision.ann_index import IVFIndex
+from vision.models import get_model_manager
+from vision.inference import get_inference_pool, InferenceBusy, ModelUnavailable
+from vision.verify_cache import VerificationCache, image_key
+from database.results_cache import ResultsCache
+from database.export import export_attendance, export_employees, parquet_available
+from database.vote_writer import get_vote_writer, VOTE_BUSY
+from metrics import capture, profile_next, profiles, snapshot, render_prometheus, register_collector, start_exporter
+from config import FACE_ANN_ENABLED, FACE_ANN_NLIST, FACE_ANN_NPROBE, FACE_ANN_MIN_TRAIN, FACE_ANN_SNAPSHOT_PATH, FACE_ANN_SNAPSHOT_INTERVAL
+from config import GALLERY_SYNC_INTERVAL, GALLERY_SYNC_OVERLAP, VERIFY_IMPOSTOR_K, EMBEDDING_DTYPE
+from config import FACE_MODEL_NAME, FACE_MODEL_WARMUP
+from config import RESULTS_CACHE_TTL, LIVE_RESULTS_REFRESH, VOTE_WRITER_ENABLED, INFERENCE_WORKERS_ENABLED
 
-# Initialize database
-try:
-    init_db()
-except Exception as e:
-    st.error(f"❌ Database Error: {e}")
+# Initialize database (schema migrations run once per process; later reruns are a no-op)
+if not init_db():
+    st.error(f"❌ Database Error: could not initialize the schema ({connection_diagnostics()['init_error']}).")
+
+# Shared face gallery: loaded once per process, then synced incrementally from DB
+@st.cache_resource
+def get_gallery():
+    if FACE_ANN_ENABLED:
+        # Approximate index for large galleries (duplicate checks at registration)
+        return GalleryCache(get_voter_embeddings_since, decode=decode_embedding,
+                            sync_interval=GALLERY_SYNC_INTERVAL, overlap=GALLERY_SYNC_OVERLAP,
+                            index_factory=lambda: IVFIndex(nlist=FACE_ANN_NLIST, nprobe=FACE_ANN_NPROBE, min_train=FACE_ANN_MIN_TRAIN),
+                            track_orgs=VERIFY_IMPOSTOR_K > 0,
+                            snapshot_path=FACE_ANN_SNAPSHOT_PATH, snapshot_interval=FACE_ANN_SNAPSHOT_INTERVAL,
+                            model_name=FACE_MODEL_NAME)
+    return GalleryCache(get_voter_embeddings_since, decode=decode_embedding,
+                        sync_interval=GALLERY_SYNC_INTERVAL, overlap=GALLERY_SYNC_OVERLAP,
+                        track_orgs=VERIFY_IMPOSTOR_K > 0)
 
-# Validates and reloads embeddings from DB
 def get_known_faces():
-    voters = get_all_voters_with_embeddings()
-    known_faces = {}
-    for v in voters:
-        if v['face_embedding']:
-            try:
-                known_faces[v['username']] = pickle.loads(v['face_embedding'])
-            except:
-                pass
-    return known_faces
+    return get_gallery().get()
+
+# Shared results snapshots: all admin sessions viewing an election share one query per refresh
+@st.cache_resource
+def get_results_cache():
+    return ResultsCache(get_election_results, ttl=RESULTS_CACHE_TTL, version_of=get_vote_version)
+
+def render_results(election_id):
+    results, age = get_results_cache().get(election_id)
+    if results:
+        df = pd.DataFrame(results)
+        st.bar_chart(df.set_index('candidate_name')['count'])
+        st.table(df)
+        st.caption(f"Total votes: {int(df['count'].sum())} · updated {age:.0f}s ago")
+    else:
+        st.info("No votes cast yet.")
+
+# Same view, re-run on its own every few seconds without rerunning the whole page
+render_live_results = st.fragment(run_every=LIVE_RESULTS_REFRESH)(render_results)
+
+# Keyset-paged table: fetch_page(after) -> (rows, next_cursor). The cursor stack
+# lives in session_state so Prev/Next never re-read earlier pages.
+def paged_table(key, fetch_page, filters, total=None):
+    pager = st.session_state.setdefault(f"{key}_pager", {"filters": None, "cursors": [None]})
+    if pager["filters"] != filters:
+        pager.update(filters=filters, cursors=[None])
+
+    rows, next_cursor = fetch_page(pager["cursors"][-1])
+    if rows:
+        st.dataframe(pd.DataFrame(rows), hide_index=True)
+    else:
+        st.info("No matching records.")
+
+    col1, col2, col3 = st.columns([1, 1, 3])
+    if col1.button("⬅️ Prev", key=f"{key}_prev", disabled=len(pager["cursors"]) == 1):
+        pager["cursors"].pop()
+        st.rerun()
+    if col2.button("Next ➡️", key=f"{key}_next", disabled=next_cursor is None):
+        pager["cursors"].append(next_cursor)
+        st.rerun()
+    page_info = f"Page {len(pager['cursors'])}"
+    if total is not None:
+        page_info += f" · {total} records"
+    col3.caption(page_info)
+
+# Export is generated only when the button is clicked, streamed into a temp file
+def export_button(label, export, file_stem, key):
+    formats = ["csv", "parquet"] if parquet_available() else ["csv"]
+    fmt = st.radio("Format", formats, horizontal=True, key=f"{key}_fmt", label_visibility="collapsed")
+
+    def build():
+        out = tempfile.TemporaryFile()
+        export(out, fmt)
+        out.seek(0)
+        return out
+
+    st.download_button(f"⬇️ {label}", data=build, file_name=f"{file_stem}.{fmt}",
+                       mime="text/csv" if fmt == "csv" else "application/octet-stream", key=key)
+
+# Load the face model once per process, in the background, at first page load
+# (or start the worker processes that hold it, when inference runs out of process)
+@st.cache_resource
+def start_face_models():
+    if INFERENCE_WORKERS_ENABLED:
+        return get_inference_pool()
+    manager = get_model_manager()
+    manager.load_in_background(warm_up=FACE_MODEL_WARMUP)
+    return manager
+
+start_face_models()
+
+# Metrics exporters (HTTP /metrics and/or file, see config.py) and the gauges they sample
+@st.cache_resource
+def start_metrics():
+    pool, gallery = get_pool(), get_gallery()
+    register_collector("db_pool", pool.stats)
+    register_collector("gallery", gallery.stats)
+    if VOTE_WRITER_ENABLED:
+        register_collector("vote_writer", get_vote_writer().stats)
+    if INFERENCE_WORKERS_ENABLED:
+        register_collector("inference", get_inference_pool().stats)
+    start_exporter()
+    return True
+
+start_metrics()
 
 st.set_page_config(page_title="Advanced AI Voting System", layout="centered")
 
@@ -43,27 +146,53 @@ else:
     # Public Menu
     menu = st.sidebar.selectbox("Menu", ["Login", "Register User", "Register Organization"])
 
-# --- DEBUGGER (Remove before final production) ---
-with st.sidebar.expander("🛠️ Debug Info"):
-    st.write(f"**Target Host:** `{DB_HOST}`")
-    
-    if DB_HOST == "localhost":
-        st.error("⚠️ Falling back to localhost! Cloud DB not connected.")
-        st.write("Reason: `st.secrets` missing or keys don't match `config.py`.")
-    else:
-        st.success("✅ targeted Cloud DB")
-
-    # Show available top-level keys (safely)
-    try:
-        if st.secrets:
-            st.write("**Available Secret Sections:**", list(st.secrets.keys()))
-            if "mysql" in st.secrets:
-                 st.write("**Keys in [mysql]:**", list(st.secrets["mysql"].keys()))
+# --- PERFORMANCE PANEL (Admins only) ---
+if st.session_state.user and st.session_state.user['role'] == "Admin":
+    with st.sidebar.expander("📈 Performance"):
+        diag = connection_diagnostics()
+        if diag['backend'] == "sqlite":
+            st.write(f"💾 **Database:** embedded SQLite `{diag['host']}` ({diag['file_bytes'] / 1e6:.1f} MB)")
+        else:
+            st.write(f"🔌 **Database:** `{diag['host']}:{diag['port']}` as `{diag['user']}`")
+            st.write(f"🔒 **SSL CA:** {'Found at ' + diag['ssl_ca'] if diag['ssl_ca'] else 'Not Found'}")
+            if DB_HOST == "localhost":
+                st.warning("⚠️ Using localhost: `st.secrets` missing or keys don't match `config.py`.")
+        if diag['init_error']:
+            st.error(f"❌ Schema initialization failed: {diag['init_error']}")
+        if diag['last_error']:
+            st.error(f"❌ Last connection error: {diag['last_error']}")
+            # Hint for Aiven users
+            if "aiven" in diag['host']:
+                st.info("💡 **Aiven Tip:** if you edited 'Allowed IP Addresses', add `0.0.0.0/0` to allow Streamlit Cloud, and update your secrets after a password reset.")
+
+        st.write("**Connection Pool:**", diag['pool'])
+        if INFERENCE_WORKERS_ENABLED:
+            st.write("**Face Workers:**", get_inference_pool().stats())
+        else:
+            st.write("**Face Models:**", get_model_manager().status())
+        st.write("**Gallery:**", get_gallery().stats())
+        if VOTE_WRITER_ENABLED:
+            st.write("**Vote Writer:**", get_vote_writer().stats())
+
+        # Per-function latency / rows / bytes since process start (slowest total first)
+        rows = snapshot()
+        if rows:
+            st.dataframe(pd.DataFrame(rows), hide_index=True)
         else:
-             st.warning("No secrets found at all.")
-    except Exception as e:
-        st.write(f"Error reading secrets: {e}")
-# -------------------------------------------------
+            st.info("No calls recorded yet.")
+        st.download_button("⬇️ Prometheus metrics", data=render_prometheus, file_name="metrics.txt",
+                           mime="text/plain", key="metrics_download")
+
+        # Opt-in cProfile + tracemalloc of the next face verifications / votes / registrations
+        count = st.number_input("Profile next N requests", min_value=1, max_value=10, value=1, key="profile_count")
+        if st.button("🔬 Arm profiler", key="profile_arm"):
+            profile_next(int(count))
+            st.success(f"Profiling the next {int(count)} request(s).")
+        for report in list(profiles):
+            with st.popover(f"{report['at']} · {report['label']} · {report['seconds']}s"):
+                st.write(f"Peak traced memory: {report['peak_bytes'] / 1e6:.1f} MB")
+                st.code(report['cprofile'], language="text")
+                st.code("\n".join(report['allocations']), language="text")
 
 # ==========================
 # PUBLIC ROUTES
@@ -129,28 +258,36 @@ elif menu == "Register User":
                     img = Image.open(img_file)
                     img_np = np.array(img)
                     
-                    with st.spinner("Processing..."):
+                    with st.spinner("Processing..."), capture("register"):
                         # Load current DB faces
                         known_faces = get_known_faces()
                         
-                        # 0. Check if Face Already Exists
-                        existing_user = check_face_exists(img_np, known_faces)
-                        if existing_user:
-                            st.error(f"Face already registered as user: {existing_user}. Please login.")
+                        # Detect + embed once, and check for an existing face in the same pass
+                        unavailable = None
+                        try:
+                            face = analyze(img_np, known_faces)
+                        except InferenceBusy:
+                            face = False
+                        except ModelUnavailable as e:
+                            face, unavailable = None, e
+                        if unavailable:
+                            st.error(f"⚠️ Face recognition is unavailable: {unavailable}")
+                        elif face is False:
+                            st.warning("⏳ Face recognition is busy right now. Please try again in a moment.")
+                        elif face is None:
+                            st.error("Face detection failed. Please try again with better lighting.")
+                        elif face['match']:
+                            st.error(f"Face already registered as user: {face['match']}. Please login.")
                         else:
-                            # 1. Register Face 
-                            embedding = register(img_np)
-                            if embedding is not None:
-                                # Serialize embedding
-                                embedding_blob = pickle.dumps(embedding)
-                                
-                                # 2. Save to DB
-                                if add_voter(name, email, password, username, role, selected_org_id, embedding_blob):
-                                    st.success("Account Created Successfully! Please Login.")
-                                else:
-                                    st.error("Registration failed. Email or Username might already exist.")
+                            # Serialize embedding
+                            embedding_blob = encode_embedding(face['embedding'], model_name=FACE_MODEL_NAME, dtype=EMBEDDING_DTYPE)
+                            
+                            # Save to DB
+                            if add_voter(name, email, password, username, role, selected_org_id, embedding_blob):
+                                get_gallery().invalidate()
+                                st.success("Account Created Successfully! Please Login.")
                             else:
-                                st.error("Face detection failed. Please try again with better lighting.")
+                                st.error("Registration failed. Email or Username might already exist.")
 
 # ...
 
@@ -187,6 +324,10 @@ elif menu == "Login":
 
 elif menu == "Logout":
     st.session_state.user = None
+    st.session_state.pop("verify_cache", None)
+    liveness = st.session_state.pop("liveness_session", None)
+    if liveness is not None:
+        liveness.close()
     st.rerun()
 
 elif menu == "Dashboard":
@@ -254,27 +395,43 @@ elif menu == "Dashboard":
                 res_elec_name = st.selectbox("View Results For", list(elec_options.keys()), key="res_select")
                 res_elec_id = elec_options[res_elec_name]
                 
-                results = get_election_results(res_elec_id)
-                if results:
-                    import pandas as pd
-                    df = pd.DataFrame(results)
-                    st.bar_chart(df.set_index('candidate_name')['count'])
-                    st.table(df)
+                if st.toggle("🔴 Live results", key="live_results", help=f"Auto-refresh every {LIVE_RESULTS_REFRESH}s"):
+                    render_live_results(res_elec_id)
                 else:
-                    st.info("No votes cast yet.")
+                    render_results(res_elec_id)
                     
                 st.subheader("Attendance Log")
-                att = get_election_attendance(res_elec_id)
-                if att:
-                    st.table(pd.DataFrame(att))
-                else:
-                    st.info("No attendance records.")
+                f1, f2, f3 = st.columns([2, 1, 1])
+                att_search = f1.text_input("Search email / name", key="att_search").strip() or None
+                att_from = f2.date_input("From", value=None, key="att_from")
+                att_to = f3.date_input("To", value=None, key="att_to")
+                att_filters = {
+                    "search": att_search,
+                    "since": datetime.datetime.combine(att_from, datetime.time.min) if att_from else None,
+                    "until": datetime.datetime.combine(att_to + datetime.timedelta(days=1), datetime.time.min) if att_to else None,
+                }
+                paged_table(
+                    "attendance",
+                    lambda after: get_election_attendance_page(res_elec_id, after=after, **att_filters),
+                    filters=(res_elec_id, tuple(att_filters.values())),
+                    total=count_election_attendance(res_elec_id, **att_filters),
+                )
+                export_button("Export attendance",
+                              lambda out, fmt: export_attendance(res_elec_id, out, fmt, **att_filters),
+                              file_stem=f"attendance_{res_elec_id}", key="att_export")
 
         with tab4:
             st.subheader("Employees List")
-            emps = get_org_employees(user['org_id'])
-            if emps:
-                st.table(pd.DataFrame(emps))
+            emp_search = st.text_input("Search email / name / username", key="emp_search").strip() or None
+            paged_table(
+                "employees",
+                lambda after: get_org_employees_page(user['org_id'], after=after, search=emp_search),
+                filters=(user['org_id'], emp_search),
+                total=count_org_employees(user['org_id'], search=emp_search),
+            )
+            export_button("Export employees",
+                          lambda out, fmt: export_employees(user['org_id'], out, fmt, search=emp_search),
+                          file_stem=f"employees_{user['org_id']}", key="emp_export")
 
     # --- EMPLOYEE DASHBOARD (VOTING) ---
     else:
@@ -304,14 +461,45 @@ elif menu == "Dashboard":
                     img_file_verify = st.camera_input("Verify Identity", key="verify_cam")
                     
                     if img_file_verify is not None:
-                        img = Image.open(img_file_verify)
-                        img_np = np.array(img)
-                        
-                        # Check Face Match
-                        known_faces = get_known_faces()
-                        recognized_user = recognize(img_np, known_faces)
+                        # Reruns (picking a candidate, Submit Vote) return the same capture:
+                        # reuse its verification result instead of running inference again
+                        # Keyed on the voter's stored embedding, so re-registering invalidates it
+                        # (the gallery version only matters to the impostor check)
+                        verify_cache = st.session_state.setdefault("verify_cache", VerificationCache())
+                        verified, verify_failed = None, False
+                        try:
+                            voter_row = get_voter_embedding(user['username'])
+                        except DBError:
+                            voter_row, verify_failed = None, True
+                        if not verify_failed:
+                            cache_key = image_key(img_file_verify.getvalue(), user['username'],
+                                                  (voter_row or {}).get('face_embedding') or b"",
+                                                  get_gallery().version if VERIFY_IMPOSTOR_K else None,
+                                                  MATCH_THRESHOLD, VERIFY_IMPOSTOR_K)
+                            verified = verify_cache.get(cache_key)
+                        if verified is None and not verify_failed:
+                            img = Image.open(img_file_verify)
+                            img_np = np.array(img)
+
+                            # Check Face Match (1:1 against the logged-in voter only)
+                            org_index = get_gallery().org_index(user['org_id']) if VERIFY_IMPOSTOR_K else None
+                            with capture("vote_verify"):
+                                try:
+                                    verified = verify(img_np, user['username'], org_index=org_index,
+                                                      impostor_k=VERIFY_IMPOSTOR_K, voter_row=voter_row)
+                                    # Only real match / no-match results are cached
+                                    verify_cache.put(cache_key, verified)
+                                except InferenceBusy:
+                                    verified = None
+                                except VerificationError as e:
+                                    print(f"Face verification failed: {e}")
+                                    verified, verify_failed = None, True
                         
-                        if recognized_user == user['username']:
+                        if verify_failed:
+                            st.error("⚠️ Face verification could not be completed. Please try again in a moment.")
+                        elif verified is None:
+                            st.warning("⏳ Face verification is busy right now. Please retake the photo in a moment.")
+                        elif verified:
                             st.success("Identity Verified!")
                             
                             with st.form("vote_form"):
@@ -319,13 +507,21 @@ elif menu == "Dashboard":
                                 choice = st.radio("Choose Candidate", list(cand_options.keys()))
                                 
                                 if st.form_submit_button("Submit Vote"):
-                                    if save_vote(user['email'], cand_options[choice], user['org_id'], vote_elec_id):
-                                        mark_attendance(user['email'], user['org_id'], vote_elec_id)
+                                    # Vote + attendance in one transaction; duplicates rejected by the DB
+                                    # (group-committed with other sessions' votes when the vote writer is on)
+                                    submit = get_vote_writer().cast if VOTE_WRITER_ENABLED else cast_vote
+                                    with capture("vote_submit"):
+                                        result = submit(user['email'], cand_options[choice], user['org_id'], vote_elec_id)
+                                    if result == VOTE_ACCEPTED:
                                         st.balloons()
                                         st.success("Vote Cast Successfully!")
                                         time.sleep(2)
                                         st.rerun()
+                                    elif result == VOTE_ALREADY_CAST:
+                                        st.warning("✅ You have already voted in this election.")
+                                    elif result == VOTE_BUSY:
+                                        st.warning("⏳ Voting is very busy right now. Please submit again in a moment.")
                                     else:
                                         st.error("Failed to save vote. Please try again.")
                         else:
-                            st.error(f"Face recognized as {recognized_user}, but you are logged in as {user['username']}.") if recognized_user else st.warning("Face not recognized. Please move closer or try better lighting.")
+                            st.warning(f"Face does not match the registered face of {user['username']}. Please move closer or try better lighting.")
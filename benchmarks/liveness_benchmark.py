@@ -0,0 +1,127 @@
+"""
+Liveness backend benchmark on recorded clips.
+
+    python -m benchmarks.liveness_benchmark clips.csv [--backends haar landmarks] [--json out.json]
+
+clips.csv lists one recorded clip per line with its hand-counted blinks:
+
+    path,blinks
+    clips/alice_3_blinks.mp4,3
+    clips/photo_attack.mp4,0
+
+Every frame of every clip is fed to a fresh session of each backend (at the
+clip's own timestamps). Reports per-frame cost (mean / p50 / p95 ms, frames per
+second on one core) and accuracy: detected vs expected blinks per clip, plus
+totals counting over-detections as false positives and misses as false negatives.
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+from vision.liveness import LIVENESS_BACKENDS
+
+
+def read_manifest(path):
+    root = os.path.dirname(os.path.abspath(path))
+    with open(path, newline="", encoding="utf-8") as f:
+        return [(os.path.join(root, row["path"]), int(row["blinks"])) for row in csv.DictReader(f)]
+
+
+def read_frames(path):
+    """Returns (frames, fps). Clips are short, so they are decoded once up front
+    and decoding stays out of the timings."""
+    cap = cv2.VideoCapture(path)
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+    frames = []
+    while True:
+        ok, frame = cap.read()
+        if not ok:
+            break
+        frames.append(frame)
+    cap.release()
+    return frames, fps
+
+
+def run_clip(backend, frames, fps):
+    session = LIVENESS_BACKENDS[backend]()
+    timings = np.empty(len(frames))
+    blinks = 0
+    for i, frame in enumerate(frames):
+        start = time.perf_counter()
+        blinks += bool(session.process(frame, timestamp=i / fps))
+        timings[i] = time.perf_counter() - start
+    if hasattr(session, "close"):
+        session.close()
+    return blinks, timings
+
+
+def benchmark(clips, backends):
+    report = {}
+    decoded = [(path, expected) + read_frames(path) for path, expected in clips]
+    for backend in backends:
+        try:
+            probe = LIVENESS_BACKENDS[backend]()
+        except ImportError as e:
+            print(f"{backend}: unavailable ({e}), skipped")
+            continue
+        if hasattr(probe, "close"):
+            probe.close()
+        all_timings, per_clip = [], []
+        tp = fp = fn = 0
+        for path, expected, frames, fps in decoded:
+            if not frames:
+                print(f"{path}: no frames decoded, skipped")
+                continue
+            detected, timings = run_clip(backend, frames, fps)
+            all_timings.append(timings)
+            tp += min(detected, expected)
+            fp += max(0, detected - expected)
+            fn += max(0, expected - detected)
+            per_clip.append({"clip": os.path.basename(path), "expected": expected, "detected": detected,
+                             "ms_per_frame": round(1000 * float(timings.mean()), 2)})
+        if not all_timings:
+            continue
+        timings = np.concatenate(all_timings)
+        report[backend] = {
+            "frames": int(timings.size),
+            "ms_mean": round(1000 * float(timings.mean()), 2),
+            "ms_p50": round(1000 * float(np.percentile(timings, 50)), 2),
+            "ms_p95": round(1000 * float(np.percentile(timings, 95)), 2),
+            "fps": round(float(timings.size / timings.sum()), 1),
+            "precision": round(tp / (tp + fp), 3) if tp + fp else None,
+            "recall": round(tp / (tp + fn), 3) if tp + fn else None,
+            "clips": per_clip,
+        }
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare liveness backends on recorded clips.")
+    parser.add_argument("manifest", help="CSV with columns path,blinks")
+    parser.add_argument("--backends", nargs="+", default=list(LIVENESS_BACKENDS), choices=list(LIVENESS_BACKENDS))
+    parser.add_argument("--json", help="also write the full report here")
+    args = parser.parse_args(argv)
+
+    report = benchmark(read_manifest(args.manifest), args.backends)
+    print(f"{'backend':<10} {'frames':>7} {'mean ms':>8} {'p50 ms':>7} {'p95 ms':>7} {'fps':>7} {'prec':>6} {'recall':>6}")
+    for backend, r in report.items():
+        print(f"{backend:<10} {r['frames']:>7} {r['ms_mean']:>8} {r['ms_p50']:>7} {r['ms_p95']:>7} {r['fps']:>7} "
+              f"{r['precision'] if r['precision'] is not None else '-':>6} {r['recall'] if r['recall'] is not None else '-':>6}")
+        for clip in r["clips"]:
+            if clip["detected"] != clip["expected"]:
+                print(f"    {clip['clip']}: detected {clip['detected']}, expected {clip['expected']}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,394 @@
+"""
+Offline benchmark suite for the vision / matching hot paths.
+
+    python -m benchmarks.vision_benchmarks [--quick] [--only matching codec ...] [--out results.json]
+    python -m benchmarks.vision_benchmarks --compare before.json after.json
+
+No camera, database or network: galleries, frames and blobs are synthetic
+(seeded, so runs are reproducible); --clip replays a recorded video for the
+liveness timings instead. Each result records the per-call time (median of
+repeats) and the JSON report carries the environment, so runs from before and
+after a change can be compared with --compare.
+
+Suites:
+  matching  - recognize()/check_face_exists() matching stage (gallery best_match)
+              at 1k..100k embeddings, plus the IVF index and legacy dict/loop paths
+  liveness  - check_liveness()-style frames per second per backend
+  ear       - eye_aspect_ratio() scalar vs vectorized throughput
+  codec     - embedding serialize / deserialize: legacy pickle vs binary codec
+  gallery   - get_known_faces()-style full gallery load and incremental sync
+
+VGG-Face embeddings are 4096-d float32 (~16 KB each): 1M of them need ~16 GB,
+so run large sizes with a smaller --dim, e.g. --sizes 1000000 --dim 128. The
+gallery suite holds every blob and the decoded matrix at once and skips (and
+reports) sizes that would not fit in this machine's memory.
+"""
+import argparse
+import json
+import os
+import pickle
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+SUITES = ("matching", "liveness", "ear", "codec", "gallery")
+DEFAULT_SIZES = (1000, 10000, 100000)
+QUICK_SIZES = (1000, 10000)
+VGG_FACE_DIM = 4096
+
+
+# --- Timing ---
+
+def measure(fn, repeat=5, min_time=0.1):
+    """
+    Calls fn() in loops long enough to time reliably (>= min_time per repeat).
+    Returns {ms (median per call), best_ms, calls_per_sec, calls}.
+    """
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time or number >= 1 << 20:
+            break
+        number *= 2 if elapsed == 0 else max(2, int(min_time / elapsed) + 1)
+    runs = [elapsed / number]
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        runs.append((time.perf_counter() - start) / number)
+    median = float(np.median(runs))
+    return {
+        "ms": round(median * 1000, 4),
+        "best_ms": round(min(runs) * 1000, 4),
+        "calls_per_sec": round(1.0 / median, 1) if median else None,
+        "calls": number * repeat,
+    }
+
+
+def _result(suite, name, params, timing, **extra):
+    row = {"suite": suite, "name": name, "params": params}
+    row.update(timing)
+    row.update(extra)
+    return row
+
+
+def _embeddings(rng, n, dim):
+    return rng.standard_normal((n, dim), dtype=np.float32)
+
+
+def _physical_memory():
+    """Bytes of RAM on this machine, or None where the OS doesn't say."""
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+# --- Suites ---
+
+def bench_matching(sizes, dim, repeat, rng):
+    from vision.face_index import FaceIndex
+    from vision.face_recog import _as_index
+    from vision.ann_index import IVFIndex
+    from scipy.spatial.distance import cosine
+
+    results = []
+    for n in sizes:
+        index = FaceIndex(dim=dim, capacity=n)
+        # Filled in chunks so the synthetic data is never held twice
+        for start in range(0, n, 10000):
+            for i, vec in enumerate(_embeddings(rng, min(10000, n - start), dim), start):
+                index.add(f"voter{i}", vec)
+        probe = index.matrix[n // 2] + 0.05 * _embeddings(rng, 1, dim)[0]
+        params = {"gallery": n, "dim": dim}
+
+        # recognize() / check_face_exists(): everything after the embedding is computed
+        results.append(_result("matching", "recognize_best_match", params,
+                               measure(lambda: _as_index(index).best_match(probe), repeat)))
+        results.append(_result("matching", "search_top5", params,
+                               measure(lambda: index.search(probe, k=5), repeat)))
+
+        if n <= 10000:
+            # Legacy inputs: a {username: embedding} dict (index rebuilt per call) and the
+            # original per-row scipy cosine loop
+            as_dict = dict(zip(index.ids, index.matrix))
+            results.append(_result("matching", "recognize_from_dict", params,
+                                   measure(lambda: _as_index(as_dict).best_match(probe), repeat)))
+            results.append(_result("matching", "scipy_cosine_loop", params,
+                                   measure(lambda: min(cosine(probe, e) for e in as_dict.values()), max(1, repeat // 2))))
+
+        if n >= 10000:
+            # Trained inline on the last add, so build_s includes k-means
+            ivf = IVFIndex(nlist=max(16, int(np.sqrt(n))), nprobe=16, min_train=n, background=False)
+            start = time.perf_counter()
+            for face_id, vec in zip(index.ids, index.matrix):
+                ivf.add(face_id, vec)
+            build_s = time.perf_counter() - start
+            results.append(_result("matching", "ivf_best_match", dict(params, nlist=ivf.nlist, nprobe=16),
+                                   measure(lambda: ivf.best_match(probe), repeat),
+                                   build_s=round(build_s, 3)))
+        del index
+    return results
+
+
+def _synthetic_frames(count, width=1280, height=720, seed=0):
+    """Gray background with a face-like ellipse and two eye blobs that 'blink' every 30 frames."""
+    import cv2
+    rng = np.random.default_rng(seed)
+    frames = []
+    for i in range(count):
+        frame = np.full((height, width, 3), 90, np.uint8)
+        frame += rng.integers(0, 20, frame.shape, dtype=np.uint8)
+        cx, cy = width // 2 + int(10 * np.sin(i / 10)), height // 2
+        cv2.ellipse(frame, (cx, cy), (130, 170), 0, 0, 360, (150, 170, 200), -1)
+        if i % 30 not in (14, 15, 16):
+            for dx in (-50, 50):
+                cv2.ellipse(frame, (cx + dx, cy - 40), (22, 12), 0, 0, 360, (40, 40, 40), -1)
+        frames.append(frame)
+    return frames
+
+
+def bench_liveness(clip, frames_count, repeat):
+    from vision.liveness import LIVENESS_BACKENDS
+
+    if clip:
+        from benchmarks.liveness_benchmark import read_frames
+        frames, _ = read_frames(clip)
+        source = os.path.basename(clip)
+    else:
+        frames = _synthetic_frames(frames_count)
+        source = "synthetic"
+    params = {"frames": len(frames), "source": source,
+              "resolution": f"{frames[0].shape[1]}x{frames[0].shape[0]}" if frames else None}
+
+    results = []
+    for backend, session_cls in LIVENESS_BACKENDS.items():
+        try:
+            session = session_cls()
+            session.process(frames[0], timestamp=0.0)
+        except Exception as e:
+            # e.g. mediapipe not installed: recorded, the other backends still run
+            results.append({"suite": "liveness", "name": backend, "params": params, "error": str(e).strip()})
+            continue
+
+        state = {"i": 0}
+        def step():
+            i = state["i"]
+            session.process(frames[i % len(frames)], timestamp=i / 30.0)
+            state["i"] = i + 1
+        timing = measure(step, repeat)
+        timing["fps"] = timing.pop("calls_per_sec")
+        results.append(_result("liveness", backend, params, timing))
+        if hasattr(session, "close"):
+            session.close()
+    return results
+
+
+def bench_ear(repeat, rng):
+    from scipy.spatial import distance
+    from vision.blink import eye_aspect_ratio, eye_aspect_ratios
+
+    eye = rng.random((6, 2)) * 40
+    window = rng.random((900, 2, 6, 2)) * 40    # 30 s of frames at 30 fps, both eyes
+
+    def scipy_ear():
+        # The original scalar implementation
+        A = distance.euclidean(eye[1], eye[5])
+        B = distance.euclidean(eye[2], eye[4])
+        C = distance.euclidean(eye[0], eye[3])
+        return (A + B) / (2.0 * C)
+
+    results = [
+        _result("ear", "scipy_scalar", {"eyes": 1}, measure(scipy_ear, repeat)),
+        _result("ear", "eye_aspect_ratio", {"eyes": 1}, measure(lambda: eye_aspect_ratio(eye), repeat)),
+    ]
+    timing = measure(lambda: eye_aspect_ratios(window), repeat)
+    timing["eyes_per_sec"] = round(window.shape[0] * 2 * 1000.0 / timing["ms"], 1)
+    results.append(_result("ear", "eye_aspect_ratios_window", {"eyes": window.shape[0] * 2}, timing))
+    return results
+
+
+def bench_codec(dim, repeat, rng):
+    from vision.embedding_codec import encode_embedding, decode_embedding
+
+    embedding = _embeddings(rng, 1, dim)[0]
+    as_list = embedding.tolist()
+    results = []
+
+    # Legacy format: pickled Python list of floats
+    legacy_blob = pickle.dumps(as_list)
+    results.append(_result("codec", "pickle_encode", {"dim": dim}, measure(lambda: pickle.dumps(as_list), repeat),
+                           bytes=len(legacy_blob)))
+    results.append(_result("codec", "pickle_decode", {"dim": dim}, measure(lambda: decode_embedding(legacy_blob), repeat),
+                           bytes=len(legacy_blob)))
+
+    for dtype in ("float32", "float16"):
+        blob = encode_embedding(embedding, dtype=dtype)
+        params = {"dim": dim, "dtype": dtype}
+        results.append(_result("codec", "codec_encode", params,
+                               measure(lambda: encode_embedding(embedding, dtype=dtype), repeat), bytes=len(blob)))
+        results.append(_result("codec", "codec_decode", params,
+                               measure(lambda: decode_embedding(blob), repeat), bytes=len(blob)))
+    return results
+
+
+def bench_gallery(sizes, dim, repeat, rng):
+    from vision.embedding_codec import encode_embedding, decode_embedding
+    from vision.gallery import GalleryCache
+
+    results = []
+    base_time = datetime(2024, 1, 1)
+    memory = _physical_memory()
+    for n in sizes:
+        # Encoded blobs + decoded matrix (float32 each) + ~600 bytes of row dict per voter
+        needed = n * (2 * dim * 4 + 600)
+        if memory and needed > memory // 2:
+            reason = (f"needs ~{needed / 2**30:.1f} GB for blobs + decoded matrix, "
+                      f"machine has {memory / 2**30:.1f} GB; rerun with a smaller --dim")
+            print(f"  Skipping gallery n={n}: {reason}", flush=True)
+            results.append({"suite": "gallery", "name": "full_load", "params": {"gallery": n, "dim": dim},
+                            "skipped": reason})
+            continue
+        vectors = _embeddings(rng, n, dim)
+        rows = [{"username": f"voter{i}", "org_id": i % 10, "face_embedding": encode_embedding(v),
+                 "updated_at": base_time + timedelta(microseconds=i)} for i, v in enumerate(vectors)]
+        del vectors
+        delta_time = base_time + timedelta(days=1)
+        delta = [dict(row, face_embedding=encode_embedding(_embeddings(rng, 1, dim)[0]), updated_at=delta_time)
+                 for row in rows[:10]]
+        params = {"gallery": n, "dim": dim}
+
+        for track_orgs in (False, True):
+            def full_load():
+                cache = GalleryCache(lambda since: rows, decode=decode_embedding, track_orgs=track_orgs)
+                cache.get()
+            timing = measure(full_load, max(1, repeat // 2), min_time=0)
+            results.append(_result("gallery", "full_load", dict(params, track_orgs=track_orgs), timing))
+
+        cache = GalleryCache(lambda since: rows if since is None else delta, decode=decode_embedding, track_orgs=True)
+        cache.get()
+        def incremental_sync():
+            cache._seen.clear()      # make the same 10-row delta count as new every time
+            cache.invalidate()
+            cache.get()
+        results.append(_result("gallery", "incremental_sync", dict(params, changed=len(delta)),
+                               measure(incremental_sync, repeat)))
+        del rows, cache
+    return results
+
+
+# --- Report ---
+
+def _environment():
+    env = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "processor": platform.processor() or platform.machine(),
+        "cpus": os.cpu_count(),
+    }
+    try:
+        env["git_commit"] = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                                           text=True, check=True).stdout.strip()
+    except Exception:
+        env["git_commit"] = None
+    return env
+
+
+def run(suites, sizes, dim, repeat, clip=None, frames=120, seed=0):
+    rng = np.random.default_rng(seed)
+    results = []
+    for suite in suites:
+        print(f"Running {suite}...", flush=True)
+        try:
+            if suite == "matching":
+                results += bench_matching(sizes, dim, repeat, rng)
+            elif suite == "liveness":
+                results += bench_liveness(clip, frames, repeat)
+            elif suite == "ear":
+                results += bench_ear(repeat, rng)
+            elif suite == "codec":
+                results += bench_codec(dim, repeat, rng)
+            elif suite == "gallery":
+                results += bench_gallery(sizes, dim, repeat, rng)
+        except Exception as e:
+            results.append({"suite": suite, "name": "suite", "params": {}, "error": f"{type(e).__name__}: {e}"})
+    return results
+
+
+def _label(row):
+    params = ",".join(f"{k}={v}" for k, v in row["params"].items())
+    return f"{row['suite']}/{row['name']}" + (f"[{params}]" if params else "")
+
+
+def print_results(results):
+    for row in results:
+        if "error" in row:
+            print(f"  {_label(row):<70} ERROR {row['error']}")
+        elif "skipped" in row:
+            print(f"  {_label(row):<70} SKIPPED {row['skipped']}")
+        else:
+            print(f"  {_label(row):<70} {row['ms']:>12.4f} ms")
+
+
+def compare(before_path, after_path):
+    with open(before_path, encoding="utf-8") as f:
+        before = {_label(r): r for r in json.load(f)["results"] if "ms" in r}
+    with open(after_path, encoding="utf-8") as f:
+        after = json.load(f)["results"]
+    print(f"  {'benchmark':<70} {'before ms':>12} {'after ms':>12} {'speedup':>8}")
+    for row in after:
+        old = before.get(_label(row))
+        if "ms" not in row or old is None:
+            continue
+        speedup = old["ms"] / row["ms"] if row["ms"] else float("inf")
+        print(f"  {_label(row):<70} {old['ms']:>12.4f} {row['ms']:>12.4f} {speedup:>7.2f}x")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline benchmarks for the vision / matching hot paths.")
+    parser.add_argument("--only", nargs="+", choices=SUITES, help="run only these suites")
+    parser.add_argument("--sizes", nargs="+", type=int, help=f"gallery sizes (default {list(DEFAULT_SIZES)})")
+    parser.add_argument("--dim", type=int, default=VGG_FACE_DIM, help="embedding dimension (VGG-Face: 4096)")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--clip", help="recorded video for the liveness suite (default: synthetic frames)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--quick", action="store_true", help="small sizes and fewer repeats")
+    parser.add_argument("--out", help="write the JSON report here")
+    parser.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"), help="compare two JSON reports")
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        compare(*args.compare)
+        return 0
+
+    sizes = args.sizes or (QUICK_SIZES if args.quick else DEFAULT_SIZES)
+    repeat = 3 if args.quick else args.repeat
+    suites = args.only or SUITES
+
+    results = run(suites, sizes, args.dim, repeat, clip=args.clip, frames=60 if args.quick else 120, seed=args.seed)
+    print_results(results)
+
+    report = {
+        "environment": _environment(),
+        "config": {"suites": list(suites), "sizes": list(sizes), "dim": args.dim, "repeat": repeat,
+                   "clip": args.clip, "seed": args.seed},
+        "results": results,
+    }
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Wrote {args.out}")
+    return 1 if any(r["name"] == "suite" and "error" in r for r in results) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,438 @@
+"""
+Concurrent voter load test through the real data-access functions.
+
+    python -m benchmarks.voter_load_test --voters 2000 --concurrency 10 50 100 200
+                                         [--path cast_vote] [--double-submit 0.05]
+                                         [--inference-ms 0] [--slo-ms 2000] [--out load.json]
+
+Runs against the database configured in config.py / st.secrets. Point it at a
+local MySQL container, never at production:
+
+    docker run -d --name vote-db -e MYSQL_ROOT_PASSWORD=root -e MYSQL_DATABASE=voting_system -p 3306:3306 mysql:8
+
+or, with no server at all, at the embedded SQLite backend (DB_BACKEND = "sqlite").
+
+Setup creates a throw-away organization with --voters voters, storing random
+precomputed embeddings in face_embedding so the blobs have their real size.
+Every stage (one per --concurrency value) gets a fresh election with
+--candidates candidates. Then all voters arrive at once, like an election
+opening, and N concurrent sessions take them through the Streamlit voting flow:
+
+    authenticate_voter -> get_org_elections -> get_election_candidates -> has_voted
+    -> face check -> vote
+
+The face check is a stub: get_voter_embedding() plus a cosine check against a
+precomputed probe embedding. --inference-ms adds simulated DeepFace time.
+
+--path picks how the vote is written:
+  legacy    - the flow before cast_vote(): the vote in one transaction, then
+              mark_attendance() in a second one on another pooled connection
+              (the vote also bumps its tally, which results now read)
+  cast_vote - cast_vote(): vote + attendance + tally in one transaction (app.py default)
+  writer    - VoteWriter.cast(): group commit (VOTE_WRITER_ENABLED)
+
+Per stage it reports:
+  - throughput (accepted votes/s) and p50/p99 per step and per voter session
+  - connection-pool waits
+  - InnoDB row lock waits and deadlocks (MySQL only). These are server-wide
+    deltas, so keep the server otherwise idle.
+  - failed votes
+  - anomalies found in the database afterwards:
+      - voters with more than one vote
+      - votes without attendance
+      - accepted votes missing from the table
+      - double submissions that were both accepted
+      - tally drift
+The first stage with errors, anomalies or a session p99 above --slo-ms is
+reported as the breaking point.
+"""
+import argparse
+import json
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import metrics
+from config import DB_BACKEND, DB_HOST, DB_NAME, DB_POOL_SIZE, SQLITE_PATH, FACE_MODEL_NAME, EMBEDDING_DTYPE
+from database.db import (DBError, init_db, get_pool, db_cursor, connection_diagnostics, create_org, add_voters_batch,
+                         create_election, add_candidate, authenticate_voter, get_org_elections,
+                         get_election_candidates, has_voted, mark_attendance, cast_vote, _increment_tally,
+                         get_voter_embedding, check_tallies, VOTE_ACCEPTED, VOTE_FAILED)
+from database.vote_writer import VoteWriter
+from vision.embedding_codec import encode_embedding, decode_embedding
+from vision.face_index import MATCH_THRESHOLD
+from benchmarks.vision_benchmarks import _environment, VGG_FACE_DIM
+
+PATHS = ("legacy", "cast_vote", "writer")
+STEPS = ("authenticate", "elections", "candidates", "has_voted", "verify", "vote", "attendance")
+PASSWORD = "loadtest"
+SETUP_BATCH = 500
+
+
+# --- Setup / teardown ---
+
+def create_load_org():
+    """Returns (org_id, tag); tag prefixes every voter email / username."""
+    tag = f"lt{int(time.time())}"
+    org_id = create_org(f"loadtest-{tag}", "Other")
+    if not org_id:
+        raise RuntimeError("could not create the load-test organization")
+    return org_id, tag
+
+
+def setup(org_id, tag, voters, dim, seed):
+    """Creates the voters. Returns people: [{email, username, probe}]."""
+    rng = np.random.default_rng(seed)
+    gallery = rng.standard_normal((voters, dim)).astype(np.float32)
+    # The "camera" embedding of the same person: the enrolled one plus noise
+    probes = gallery + 0.1 * rng.standard_normal((voters, dim)).astype(np.float32)
+
+    people = []
+    for start in range(0, voters, SETUP_BATCH):
+        batch = []
+        for i in range(start, min(start + SETUP_BATCH, voters)):
+            person = {"email": f"{tag}_{i}@loadtest.invalid", "username": f"{tag}_{i}", "probe": probes[i]}
+            people.append(person)
+            batch.append({"name": f"Load Voter {i}", "email": person["email"], "password": PASSWORD,
+                          "username": person["username"], "role": "Employee",
+                          "face_embedding": encode_embedding(gallery[i], model_name=FACE_MODEL_NAME, dtype=EMBEDDING_DTYPE)})
+        failed = [status for status in add_voters_batch(batch, org_id) if status[0] != "added"]
+        if failed:
+            raise RuntimeError(f"voter setup failed: {failed[0]}")
+    return people
+
+
+def create_stage_election(org_id, name, candidates):
+    """Returns (election_id, candidate_ids)."""
+    if not create_election(name, org_id):
+        raise RuntimeError(f"could not create election {name!r}")
+    election_id = max(e['id'] for e in get_org_elections(org_id) if e['name'] == name)
+    for c in range(candidates):
+        add_candidate(f"Candidate {c + 1}", org_id, election_id)
+    return election_id, [c['id'] for c in get_election_candidates(election_id)]
+
+
+def cleanup(org_id):
+    """Deletes everything the load test created (children first, foreign keys)."""
+    elections = "SELECT id FROM elections WHERE org_id=%s"
+    statements = [
+        f"DELETE FROM vote_tallies WHERE election_id IN ({elections})",
+        "DELETE FROM votes WHERE org_id=%s",
+        "DELETE FROM attendance WHERE org_id=%s",
+        "DELETE FROM candidates WHERE org_id=%s",
+        "DELETE FROM elections WHERE org_id=%s",
+        "DELETE FROM voters WHERE org_id=%s",
+        "DELETE FROM organizations WHERE id=%s",
+    ]
+    try:
+        with db_cursor(commit=True) as cursor:
+            for statement in statements:
+                cursor.execute(statement, (org_id,))
+    except DBError as err:
+        print(f"Error cleaning up load-test data (org {org_id}): {err}")
+
+
+# --- Server counters ---
+
+def lock_counters():
+    """InnoDB row lock waits / time (ms) and deadlocks so far; {} if unavailable."""
+    counters = {}
+    if DB_BACKEND != "mysql":
+        return counters
+    try:
+        with db_cursor() as cursor:
+            cursor.execute("SHOW GLOBAL STATUS WHERE Variable_name IN ('Innodb_row_lock_waits', 'Innodb_row_lock_time')")
+            counters.update({name.lower(): int(value) for name, value in cursor.fetchall()})
+            cursor.execute("SELECT COUNT FROM information_schema.INNODB_METRICS WHERE NAME='lock_deadlocks'")
+            row = cursor.fetchone()
+            if row:
+                counters["deadlocks"] = int(row[0])
+    except DBError as err:
+        print(f"Lock counters unavailable: {err}")
+    return counters
+
+
+def find_anomalies(election_id):
+    """Integrity checks on one election after a stage."""
+    try:
+        with db_cursor() as cursor:
+            cursor.execute("""
+                SELECT COUNT(*) FROM (
+                    SELECT voter_email FROM votes WHERE election_id=%s GROUP BY voter_email HAVING COUNT(*) > 1
+                ) d
+            """, (election_id,))
+            multi_votes = cursor.fetchone()[0]
+            cursor.execute("""
+                SELECT COUNT(*) FROM votes v
+                LEFT JOIN attendance a ON a.election_id = v.election_id AND a.voter_email = v.voter_email
+                WHERE v.election_id=%s AND a.id IS NULL
+            """, (election_id,))
+            without_attendance = cursor.fetchone()[0]
+            cursor.execute("SELECT COUNT(*) FROM votes WHERE election_id=%s", (election_id,))
+            stored = cursor.fetchone()[0]
+    except DBError as err:
+        print(f"Error checking anomalies: {err}")
+        return None
+    anomalies = {"voters_with_multiple_votes": multi_votes, "votes_without_attendance": without_attendance,
+                 "stored_votes": stored}
+    drift = check_tallies(election_id)
+    anomalies["tally_drift"] = len(drift) if drift is not None else None
+    return anomalies
+
+
+# --- Simulated voter ---
+
+class Recorder:
+    """Thread-safe per-step latency samples and failure counts."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples = {step: [] for step in STEPS}
+        self.failures = {step: 0 for step in STEPS}
+        self.sessions = []
+
+    def call(self, step, fn, *args, ok=bool):
+        start = time.perf_counter()
+        result = fn(*args)
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self.samples[step].append(elapsed)
+            self.failures[step] += not ok(result)
+        return result
+
+    def session(self, seconds):
+        with self._lock:
+            self.sessions.append(seconds)
+
+
+def verify_stub(person, inference_s):
+    """Face check minus DeepFace: stored embedding vs the precomputed probe."""
+    if inference_s:
+        time.sleep(inference_s)
+    try:
+        row = get_voter_embedding(person['username'])
+    except DBError:
+        return False
+    if not row or not row['face_embedding']:
+        return False
+    stored = decode_embedding(row['face_embedding'])
+    probe = person['probe']
+    distance = 1.0 - float(np.dot(stored, probe) / (np.linalg.norm(stored) * np.linalg.norm(probe)))
+    return distance <= MATCH_THRESHOLD
+
+
+def legacy_save_vote(email, candidate_id, org_id, election_id):
+    """save_vote() as it was before cast_vote(): the vote alone in its own transaction."""
+    try:
+        with db_cursor(commit=True) as cursor:
+            cursor.execute("INSERT INTO votes(voter_email, candidate_id, org_id, election_id) VALUES(%s, %s, %s, %s)",
+                           (email, candidate_id, org_id, election_id))
+            _increment_tally(cursor, election_id, candidate_id)
+        return True
+    except DBError:
+        return False
+
+
+def vote_once(path, recorder, person, candidate_id, org_id, election_id, writer):
+    """One Submit Vote click. Returns True if this submission was accepted."""
+    email = person['email']
+    if path == "legacy":
+        # As the app used to: the vote, then attendance in a second transaction
+        if not recorder.call("vote", legacy_save_vote, email, candidate_id, org_id, election_id):
+            return False
+        recorder.call("attendance", mark_attendance, email, org_id, election_id, ok=lambda _: True)
+        return True
+    submit = writer.cast if path == "writer" else cast_vote
+    status = recorder.call("vote", submit, email, candidate_id, org_id, election_id,
+                           ok=lambda s: s != VOTE_FAILED)
+    return status == VOTE_ACCEPTED
+
+
+def run_voter(path, recorder, person, org_id, double, inference_s, rng, writer):
+    """
+    One voter through the voting page. Returns the number of accepted
+    submissions (0, 1 or - the anomaly - 2 for a double submit).
+    """
+    start = time.perf_counter()
+    try:
+        if not recorder.call("authenticate", authenticate_voter, person['email'], PASSWORD, org_id):
+            return 0
+        elections = recorder.call("elections", get_org_elections, org_id)
+        if not elections:
+            return 0
+        election_id = max(e['id'] for e in elections)
+        candidates = recorder.call("candidates", get_election_candidates, election_id)
+        if not candidates:
+            return 0
+        if recorder.call("has_voted", has_voted, person['email'], org_id, election_id, ok=lambda v: v is False):
+            return 0
+        if not recorder.call("verify", verify_stub, person, inference_s):
+            return 0
+
+        candidate_id = candidates[rng.integers(len(candidates))]['id']
+        if not double:
+            return int(vote_once(path, recorder, person, candidate_id, org_id, election_id, writer))
+        # Double click / second tab: two submissions racing each other
+        other = []
+        thread = threading.Thread(target=lambda: other.append(
+            vote_once(path, recorder, person, candidate_id, org_id, election_id, writer)))
+        thread.start()
+        accepted = vote_once(path, recorder, person, candidate_id, org_id, election_id, writer)
+        thread.join()
+        return int(accepted) + int(bool(other and other[0]))
+    finally:
+        recorder.session(time.perf_counter() - start)
+
+
+# --- Stages ---
+
+def _percentiles(samples):
+    if not samples:
+        return {"calls": 0, "p50_ms": None, "p99_ms": None}
+    ms = np.asarray(samples) * 1000
+    return {"calls": len(samples), "p50_ms": round(float(np.percentile(ms, 50)), 2),
+            "p99_ms": round(float(np.percentile(ms, 99)), 2)}
+
+
+def run_stage(people, org_id, concurrency, path, candidates, double_rate, inference_s, seed):
+    election_id, _ = create_stage_election(org_id, f"loadtest c={concurrency} {int(time.time())}", candidates)
+    rng = np.random.default_rng(seed)
+    doubles = rng.random(len(people)) < double_rate
+    recorder = Recorder()
+    writer = VoteWriter().start() if path == "writer" else None
+
+    locks_before = lock_counters()
+    metrics.reset()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        # Everyone arrives at once (election opening); `concurrency` sessions at a time
+        futures = [executor.submit(run_voter, path, recorder, person, org_id, bool(double), inference_s,
+                                   np.random.default_rng([seed, i]), writer)
+                   for i, (person, double) in enumerate(zip(people, doubles))]
+        accepted = [f.result() for f in futures]
+    seconds = time.perf_counter() - start
+    locks_after = lock_counters()
+    if writer:
+        writer.close()
+
+    pool_wait = next((row for row in metrics.snapshot() if row["function"] == "db.pool_acquire"), None)
+    anomalies = find_anomalies(election_id) or {}
+    accepted_total = sum(accepted)
+    anomalies["double_submits_both_accepted"] = sum(1 for a in accepted if a > 1)
+    anomalies["accepted_not_stored"] = accepted_total - anomalies.get("stored_votes", accepted_total)
+
+    return {
+        "concurrency": concurrency,
+        "path": path,
+        "election_id": election_id,
+        "voters": len(people),
+        "double_submitters": int(doubles.sum()),
+        "seconds": round(seconds, 3),
+        "votes_per_sec": round(accepted_total / seconds, 1) if seconds else None,
+        "accepted": accepted_total,
+        "not_voted": sum(1 for a in accepted if a == 0),
+        "failures": dict(recorder.failures),
+        "steps": {step: _percentiles(recorder.samples[step]) for step in STEPS if recorder.samples[step]},
+        "session": _percentiles(recorder.sessions),
+        "pool_wait": {"calls": pool_wait["calls"], "p99_ms": pool_wait["p99_ms"], "total_s": pool_wait["total_s"]}
+                     if pool_wait else None,
+        "locks": {key: locks_after[key] - locks_before.get(key, 0) for key in locks_after},
+        "anomalies": anomalies,
+        "writer": writer.stats() if writer else None,
+    }
+
+
+def is_broken(stage, slo_ms):
+    """Why a stage counts as broken, or None."""
+    reasons = []
+    if stage["not_voted"]:
+        reasons.append(f"{stage['not_voted']} voters could not vote")
+    anomalies = {k: v for k, v in stage["anomalies"].items() if k != "stored_votes" and v}
+    if anomalies:
+        reasons.append(f"anomalies {anomalies}")
+    p99 = stage["session"]["p99_ms"]
+    if p99 is not None and p99 > slo_ms:
+        reasons.append(f"session p99 {p99:.0f} ms > {slo_ms} ms")
+    return "; ".join(reasons) or None
+
+
+def print_stage(stage):
+    vote = stage["steps"].get("vote", {})
+    pool = stage["pool_wait"] or {}
+    locks = stage["locks"]
+    print(f"  c={stage['concurrency']:<5} {stage['votes_per_sec'] or 0:>8.1f} votes/s  "
+          f"accepted {stage['accepted']:>6}  not voted {stage['not_voted']:>5}  "
+          f"vote p50/p99 {vote.get('p50_ms')}/{vote.get('p99_ms')} ms  "
+          f"session p50/p99 {stage['session']['p50_ms']}/{stage['session']['p99_ms']} ms  "
+          f"pool wait p99 {pool.get('p99_ms')} ms  "
+          f"row lock waits {locks.get('innodb_row_lock_waits', '-')} ({locks.get('innodb_row_lock_time', '-')} ms)  "
+          f"deadlocks {locks.get('deadlocks', '-')}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Concurrent voter load test against a local database.")
+    parser.add_argument("--voters", type=int, default=1000)
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[10, 50, 100],
+                        help="concurrent voter sessions, one stage (fresh election) per value")
+    parser.add_argument("--path", choices=PATHS, default="cast_vote", help="how votes are written")
+    parser.add_argument("--candidates", type=int, default=4)
+    parser.add_argument("--double-submit", type=float, default=0.05,
+                        help="fraction of voters who submit twice at once (double click / second tab)")
+    parser.add_argument("--inference-ms", type=float, default=0, help="simulated face inference per voter")
+    parser.add_argument("--pool-size", type=int, default=DB_POOL_SIZE, help="connections in this process's pool")
+    parser.add_argument("--dim", type=int, default=VGG_FACE_DIM, help="embedding dimension (VGG-Face: 4096)")
+    parser.add_argument("--slo-ms", type=float, default=2000, help="session p99 above this counts as broken")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--keep", action="store_true", help="keep the load-test organization and its data")
+    parser.add_argument("--out", help="write the JSON report here")
+    args = parser.parse_args(argv)
+
+    target = SQLITE_PATH if DB_BACKEND == "sqlite" else f"{DB_HOST}/{DB_NAME}"
+    get_pool(size=args.pool_size)
+    if not init_db():
+        print(f"Database {target} not available: {connection_diagnostics()['init_error']}")
+        return 1
+
+    print(f"Setting up {args.voters} voters on {DB_BACKEND} {target}...", flush=True)
+    org_id, tag = create_load_org()
+    stages = []
+    try:
+        people = setup(org_id, tag, args.voters, args.dim, args.seed)
+        for concurrency in args.concurrency:
+            print(f"Stage: {concurrency} concurrent sessions, path={args.path}...", flush=True)
+            stage = run_stage(people, org_id, concurrency, args.path, args.candidates,
+                              args.double_submit, args.inference_ms / 1000, args.seed)
+            stage["broken"] = is_broken(stage, args.slo_ms)
+            stages.append(stage)
+            print_stage(stage)
+    finally:
+        if not args.keep:
+            cleanup(org_id)
+
+    broken = next((s for s in stages if s["broken"]), None)
+    if broken:
+        print(f"Breaking point: {broken['concurrency']} concurrent sessions - {broken['broken']}")
+    else:
+        print(f"No stage broke (slo {args.slo_ms} ms).")
+
+    report = {
+        "environment": dict(_environment(), db_backend=DB_BACKEND, db=target),
+        "config": {"voters": args.voters, "concurrency": args.concurrency, "path": args.path,
+                   "candidates": args.candidates, "double_submit": args.double_submit,
+                   "inference_ms": args.inference_ms, "pool_size": args.pool_size, "dim": args.dim,
+                   "slo_ms": args.slo_ms, "seed": args.seed},
+        "stages": stages,
+        "breaking_point": broken["concurrency"] if broken else None,
+    }
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Wrote {args.out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -36,5 +36,95 @@ def load_db_config():
 
 DB_HOST, DB_USER, DB_PASS, DB_NAME, DB_PORT = load_db_config()
 
-# Liveness Config (Legacy param, kept for compatibility if needed)
-EYE_AR_THRESH = 0.30
+# Storage Backend Config (database/backends.py)
+DB_BACKEND = "mysql"               # "mysql" (network server) or "sqlite" (embedded file, single-site kiosks / local tests)
+SQLITE_PATH = "voting_system.db"   # SQLite database file (WAL mode: -wal / -shm files appear next to it)
+SQLITE_BUSY_TIMEOUT = 5            # seconds a writer waits for the write lock before failing
+SQLITE_SYNCHRONOUS = "NORMAL"      # WAL + NORMAL: no fsync per commit; FULL survives power loss with the last commits
+
+# Liveness Config
+EYE_AR_THRESH = 0.30               # EAR ceiling: the adaptive blink threshold never goes above this
+LIVENESS_BACKEND = "haar"          # "haar" (OpenCV cascades) or "landmarks" (MediaPipe Face Mesh EAR)
+BLINK_EAR_RATIO = 0.75             # eyes count as closed below this fraction of the open-eye EAR baseline
+BLINK_SMOOTH_FRAMES = 2            # moving-average length applied to EAR before thresholding
+BLINK_MIN_FRAMES = 2               # shortest closed run that counts as a blink (rejects landmark jitter)
+BLINK_MAX_FRAMES = 12              # longest closed run that counts as a blink (longer = eyes shut / looking away)
+BLINK_WINDOW = 90                  # frames of EAR history used for the adaptive baseline
+
+# Connection Pool Config
+DB_POOL_SIZE = 5             # max open connections per process
+DB_POOL_TIMEOUT = 10         # seconds to wait for a free connection
+DB_POOL_PING_INTERVAL = 30   # ping connections idle longer than this (seconds) before reuse
+
+# Face Gallery Cache Config
+GALLERY_SYNC_INTERVAL = 5    # seconds between incremental syncs with the voters table
+GALLERY_SYNC_OVERLAP = 5     # re-read this many seconds before the high-water mark (late commits)
+
+# Face Verification Config
+VERIFY_IMPOSTOR_K = 0        # >0: also reject if another voter of the same org matches as well (top-k check)
+
+# Embedding Storage Config
+EMBEDDING_DTYPE = "float32"        # "float16" halves blob size (cosine scores barely change)
+EMBEDDING_MIGRATION_BATCH = 500    # rows per transaction when converting legacy pickled embeddings
+
+# Approximate Nearest-Neighbour Gallery (large deployments)
+FACE_ANN_ENABLED = False              # IVF index for duplicate checks instead of an exact scan
+FACE_ANN_NLIST = 1024                 # number of k-means cells
+FACE_ANN_NPROBE = 16                  # cells searched per query (recall/latency knob)
+FACE_ANN_MIN_TRAIN = 10000            # exact scan until the gallery reaches this size
+FACE_ANN_SNAPSHOT_PATH = "face_gallery_ivf.npz"
+FACE_ANN_SNAPSHOT_INTERVAL = 300      # seconds between snapshot saves after changes
+
+# Face Model Config
+FACE_MODEL_NAME = "VGG-Face"       # DeepFace recognition model (changing it requires re-registering faces)
+FACE_DETECTOR_BACKEND = "opencv"   # DeepFace detector: opencv, ssd, mtcnn, retinaface, mediapipe, ...
+FACE_MODEL_WARMUP = True           # run one dummy inference at boot so the first voter doesn't wait
+FACE_EMBED_BATCH_SIZE = 32         # face crops per forward pass in register_batch()
+FACE_MAX_INPUT_SIDE = 640          # frames are downscaled to this longest side before face detection (0 = off)
+
+# Bulk Import Config
+BULK_IMPORT_BATCH_SIZE = 500       # voters per INSERT transaction in database/bulk_import.py
+
+# Vote Tally Config
+VOTE_TALLY_SHARDS = 8              # counter rows per candidate (more = less lock contention on hot candidates)
+
+# Live Results Config
+RESULTS_CACHE_TTL = 2              # seconds a shared per-election results snapshot is reused
+LIVE_RESULTS_REFRESH = 3           # seconds between auto-refreshes of the live results view
+
+# Admin Tables Config
+ADMIN_PAGE_SIZE = 50               # rows per page in the attendance / employees tables
+EXPORT_CHUNK_SIZE = 5000           # rows per fetchmany() when streaming CSV/Parquet exports
+
+# Vote Writer Config (group commit)
+VOTE_WRITER_ENABLED = False        # True: votes are queued and committed in batches by database/vote_writer.py
+VOTE_BATCH_SIZE = 100              # max votes per transaction
+VOTE_BATCH_WAIT = 0.005            # seconds to wait for more votes before committing a partial batch
+VOTE_QUEUE_SIZE = 2000             # max queued votes (bounded memory); beyond this callers get "busy"
+VOTE_ENQUEUE_TIMEOUT = 0.5         # seconds a caller waits for queue space before giving up
+VOTE_RESULT_TIMEOUT = 15           # seconds a caller waits for its batch to commit
+
+# Liveness Tracking Config (vision/liveness.py)
+LIVENESS_DETECT_WIDTH = 320        # frame width for full-frame face detection
+LIVENESS_REDETECT_INTERVAL = 15    # frames between full-frame re-detections while tracking
+LIVENESS_FACE_TIMEOUT = 2.0        # seconds without a face before the session resets
+LIVENESS_MAX_CLOSED = 1.0          # eyes "closed" longer than this is not a blink
+
+# Inference Worker Config (vision/inference.py)
+INFERENCE_WORKERS_ENABLED = False  # True: face detection/embedding runs in worker processes, not the Streamlit thread
+INFERENCE_WORKERS = 2              # worker processes, each holding its own warm model
+INFERENCE_QUEUE_SIZE = 32          # max waiting requests; beyond this callers get "busy, retry" at once
+INFERENCE_DEADLINE = 10            # seconds a request may wait + run before the caller gets "busy"
+INFERENCE_BATCH_DEADLINE = 120     # same, for one register_batch() chunk (FACE_EMBED_BATCH_SIZE images)
+INFERENCE_WORKER_THREADS = 0       # TensorFlow intra-op threads per worker (0 = TF default)
+
+# Verification Cache Config (vision/verify_cache.py)
+VERIFY_CACHE_SIZE = 8              # verification results remembered per session
+VERIFY_CACHE_TTL = 120             # seconds a result is reused for the same captured image
+
+# Metrics Config (metrics.py)
+METRICS_ENABLED = True             # time / count instrumented db and vision calls
+METRICS_HTTP_PORT = 0              # serve Prometheus text at http://<host>:<port>/metrics (0 = off)
+METRICS_HTTP_HOST = "127.0.0.1"    # interface it listens on; no auth, so keep it local (or behind a proxy)
+METRICS_FILE = None                # or write it to this file every METRICS_FILE_INTERVAL seconds
+METRICS_FILE_INTERVAL = 15         # seconds
@@ -0,0 +1,277 @@
+"""
+Storage backends behind database/db.py.
+
+db.py keeps its function names and SQL; the backend picked by DB_BACKEND
+(config.py) supplies connections with the mysql-connector cursor API, the
+engine's exception classes, schema migrations and the few clauses that differ
+between dialects.
+
+  mysql   - MySQL / Aiven over the network (mysql-connector-python).
+  sqlite  - embedded SQLite file in WAL mode, for single-site kiosks (no
+            network round trips or TLS handshakes) and for local tests /
+            benchmarks (no server to run). One writer at a time, concurrent
+            readers; one machine only.
+"""
+import functools
+import os
+import re
+import sqlite3
+from datetime import date, datetime
+
+from config import DB_BACKEND, DB_HOST, DB_USER, DB_PASS, DB_NAME, DB_PORT
+from config import SQLITE_PATH, SQLITE_BUSY_TIMEOUT, SQLITE_SYNCHRONOUS
+
+CA_PATH = os.path.abspath("ca.pem")
+
+
+# --- MySQL ---
+
+class MySQLBackend:
+    name = "mysql"
+
+    def __init__(self):
+        import mysql.connector
+        from mysql.connector import errorcode
+
+        self._mysql = mysql.connector
+        self._errorcode = errorcode
+        self.Error = mysql.connector.Error
+        self.IntegrityError = mysql.connector.IntegrityError
+        # Lost connection / server gone away: the pool must not hand the connection out again
+        self.ConnectionLost = mysql.connector.errors.OperationalError
+
+    def _config(self, with_database=True):
+        config = {
+            "host": DB_HOST,
+            "user": DB_USER,
+            "password": DB_PASS,
+            "port": DB_PORT
+        }
+        if with_database:
+            config["database"] = DB_NAME
+
+        # Check for Aiven CA Certificate (ca.pem)
+        if os.path.exists(CA_PATH):
+            config["ssl_ca"] = CA_PATH
+            config["ssl_disabled"] = False
+            config["ssl_verify_cert"] = True
+        return config
+
+    def connect(self):
+        return self._mysql.connect(**self._config())
+
+    def connect_for_init(self):
+        """Dedicated connection for migrations; creates the database if it doesn't exist yet."""
+        try:
+            return self._mysql.connect(**self._config())
+        except self.Error as err:
+            if err.errno != self._errorcode.ER_BAD_DB_ERROR:
+                raise
+        conn = self._mysql.connect(**self._config(with_database=False))
+        cursor = conn.cursor()
+        cursor.execute(f"CREATE DATABASE IF NOT EXISTS {DB_NAME}")
+        cursor.execute(f"USE {DB_NAME}")
+        cursor.close()
+        return conn
+
+    def migrate(self, conn):
+        from database.migrations import run_migrations
+        return run_migrations(conn)
+
+    def pool_error(self, message):
+        return self._mysql.errors.PoolError(message)
+
+    def is_duplicate(self, err):
+        return err.errno == self._errorcode.ER_DUP_ENTRY
+
+    def add_on_conflict(self, keys, column):
+        """Upsert tail: on a duplicate `keys`, add the last parameter to `column`."""
+        return f"ON DUPLICATE KEY UPDATE {column} = {column} + %s"
+
+    def diagnostics(self):
+        masked_pw = DB_PASS[:3] + "*" * (len(DB_PASS)-6) + DB_PASS[-3:] if len(DB_PASS) > 6 else "***"
+        return {
+            "backend": self.name,
+            "host": DB_HOST,
+            "port": DB_PORT,
+            "user": DB_USER,
+            "masked_password": masked_pw,
+            "password_length": len(DB_PASS),
+            "ssl_ca": CA_PATH if os.path.exists(CA_PATH) else None,
+        }
+
+
+# --- SQLite ---
+
+# Timestamps are stored as local time text with milliseconds, the format of the
+# column defaults below, so values read back compare equal when passed back in
+# (keyset cursors, gallery high-water marks).
+SQLITE_NOW = "strftime('%Y-%m-%d %H:%M:%f', 'now', 'localtime')"
+
+def _adapt_datetime(value):
+    return f"{value:%Y-%m-%d %H:%M:%S}.{value.microsecond // 1000:03d}"
+
+def _convert_timestamp(value):
+    return datetime.fromisoformat(value.decode())
+
+sqlite3.register_adapter(datetime, _adapt_datetime)
+sqlite3.register_adapter(date, date.isoformat)
+sqlite3.register_converter("TIMESTAMP", _convert_timestamp)
+
+_INSERT_IGNORE = re.compile(r"^\s*INSERT\s+IGNORE\b", re.IGNORECASE)
+_READ_ONLY = ("SELECT", "PRAGMA", "EXPLAIN", "BEGIN", "COMMIT", "ROLLBACK", "RELEASE")
+
+@functools.lru_cache(maxsize=512)
+def _translate(query):
+    """MySQL-flavoured SQL -> (SQLite SQL, whether it writes)."""
+    sql = _INSERT_IGNORE.sub("INSERT OR IGNORE", query.replace("%s", "?"), count=1)
+    return sql, not sql.lstrip().upper().startswith(_READ_ONLY)
+
+
+class SQLiteCursor:
+    def __init__(self, connection, dictionary=False):
+        self._connection = connection
+        self._cursor = connection.raw.cursor()
+        self._dictionary = dictionary
+
+    def _prepare(self, query):
+        sql, writes = _translate(query)
+        if writes:
+            self._connection.begin()
+        return sql
+
+    def execute(self, query, params=()):
+        self._cursor.execute(self._prepare(query), tuple(params or ()))
+
+    def executemany(self, query, seq_of_params):
+        self._cursor.executemany(self._prepare(query), [tuple(p) for p in seq_of_params])
+
+    def _row(self, row):
+        if row is None or not self._dictionary:
+            return row
+        return {col[0]: value for col, value in zip(self._cursor.description, row)}
+
+    def fetchone(self):
+        return self._row(self._cursor.fetchone())
+
+    def fetchmany(self, size=1):
+        return [self._row(row) for row in self._cursor.fetchmany(size)]
+
+    def fetchall(self):
+        return [self._row(row) for row in self._cursor.fetchall()]
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    @property
+    def lastrowid(self):
+        return self._cursor.lastrowid
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+    def close(self):
+        self._cursor.close()
+
+
+class SQLiteConnection:
+    """
+    sqlite3 connection with the part of the mysql-connector API db.py uses.
+    Like MySQL with autocommit off, a write opens a transaction that lasts
+    until commit() / rollback(); it is BEGIN IMMEDIATE, so the write lock is
+    taken up front and concurrent writers queue on busy_timeout instead of
+    failing halfway through.
+    """
+
+    def __init__(self, path, timeout=SQLITE_BUSY_TIMEOUT, synchronous=SQLITE_SYNCHRONOUS):
+        self.raw = sqlite3.connect(path, timeout=timeout, isolation_level=None, check_same_thread=False,
+                                   detect_types=sqlite3.PARSE_DECLTYPES)
+        self.raw.execute("PRAGMA journal_mode=WAL")
+        self.raw.execute(f"PRAGMA synchronous={synchronous}")
+        self.raw.execute("PRAGMA foreign_keys=ON")
+
+    @property
+    def in_transaction(self):
+        return self.raw.in_transaction
+
+    def begin(self):
+        if not self.raw.in_transaction:
+            self.raw.execute("BEGIN IMMEDIATE")
+
+    def cursor(self, dictionary=False, buffered=True):
+        return SQLiteCursor(self, dictionary=dictionary)
+
+    def commit(self):
+        self.raw.commit()
+
+    def rollback(self):
+        self.raw.rollback()
+
+    def ping(self, reconnect=False):
+        self.raw.execute("SELECT 1")
+
+    def is_connected(self):
+        try:
+            self.ping()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def close(self):
+        self.raw.close()
+
+
+class SQLiteBackend:
+    name = "sqlite"
+    Error = sqlite3.Error
+    IntegrityError = sqlite3.IntegrityError
+    # Raised when a closed connection is used; an embedded database doesn't drop connections
+    ConnectionLost = sqlite3.ProgrammingError
+
+    def __init__(self, path=SQLITE_PATH):
+        self.path = os.path.abspath(path)
+
+    def connect(self):
+        return SQLiteConnection(self.path)
+
+    def connect_for_init(self):
+        folder = os.path.dirname(self.path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        return SQLiteConnection(self.path)
+
+    def migrate(self, conn):
+        from database.migrations import run_sqlite_migrations
+        return run_sqlite_migrations(conn)
+
+    def pool_error(self, message):
+        return sqlite3.OperationalError(message)
+
+    def is_duplicate(self, err):
+        return (getattr(err, "sqlite_errorname", "") in ("SQLITE_CONSTRAINT_UNIQUE", "SQLITE_CONSTRAINT_PRIMARYKEY")
+                or "UNIQUE constraint failed" in str(err))
+
+    def add_on_conflict(self, keys, column):
+        return f"ON CONFLICT({', '.join(keys)}) DO UPDATE SET {column} = {column} + %s"
+
+    def diagnostics(self):
+        return {
+            "backend": self.name,
+            "host": self.path,
+            "port": None,
+            "user": None,
+            "file_bytes": os.path.getsize(self.path) if os.path.exists(self.path) else 0,
+        }
+
+
+BACKENDS = {
+    "mysql": MySQLBackend,
+    "sqlite": SQLiteBackend,
+}
+
+def get_backend(name=DB_BACKEND):
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown DB_BACKEND {name!r} (expected one of {', '.join(BACKENDS)})")
+    return BACKENDS[name]()
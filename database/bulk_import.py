@@ -0,0 +1,156 @@
+"""
+Bulk voter import from CSV.
+
+    python -m database.bulk_import voters.csv --org-id 3 [--batch-size 500]
+                                   [--image-root photos/] [--report report.csv]
+
+CSV columns: name, email, password, username, role (optional, default Employee),
+image (optional path to an ID photo, relative to --image-root or the CSV folder).
+
+The file is streamed in batches: each batch embeds its photos with
+register_batch() and is inserted in one transaction with add_voters_batch().
+Every row gets a status in the report (added / duplicate / face_error / invalid /
+error); problem rows never abort the import.
+"""
+import argparse
+import csv
+import os
+import sys
+import time
+
+from config import BULK_IMPORT_BATCH_SIZE, FACE_EMBED_BATCH_SIZE, FACE_MODEL_NAME, EMBEDDING_DTYPE
+from database.db import add_voters_batch, get_org_by_id
+
+REQUIRED_COLUMNS = ("name", "email", "password", "username")
+
+
+def _read_batches(reader, batch_size):
+    batch = []
+    # Row numbers match the CSV file lines (header is line 1)
+    for line_no, row in enumerate(reader, start=2):
+        batch.append((line_no, row))
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _load_image(path):
+    import numpy as np
+    from PIL import Image
+    # Same layout as the Streamlit camera flow (np.array of a PIL RGB image)
+    return np.array(Image.open(path).convert("RGB"))
+
+
+def _embed_photos(entries, image_root, embed_batch_size):
+    """Fills entry['voter']['face_embedding'] for rows with a photo; marks failures."""
+    with_photo = [e for e in entries if e["status"] is None and e["row"].get("image")]
+    if not with_photo:
+        return
+
+    from vision.face_recog import register_batch
+    from vision.embedding_codec import encode_embedding
+
+    images, owners = [], []
+    for e in with_photo:
+        path = os.path.join(image_root, e["row"]["image"].strip())
+        try:
+            images.append(_load_image(path))
+            owners.append(e)
+        except Exception as err:
+            e["status"], e["message"] = "face_error", f"Cannot read image {path}: {err}"
+
+    for e, result in zip(owners, register_batch(images, batch_size=embed_batch_size)):
+        if result["embedding"] is None:
+            e["status"], e["message"] = "face_error", result["error"]
+        else:
+            e["voter"]["face_embedding"] = encode_embedding(result["embedding"], model_name=FACE_MODEL_NAME, dtype=EMBEDDING_DTYPE)
+
+
+def import_voters(csv_path, org_id, batch_size=BULK_IMPORT_BATCH_SIZE, image_root=None,
+                  embed_batch_size=FACE_EMBED_BATCH_SIZE, on_row=None):
+    """
+    Streams csv_path into the voters table for org_id.
+    on_row(line_no, row, status, message) is called for every CSV row.
+    Returns a dict of counts per status.
+    """
+    image_root = image_root or os.path.dirname(os.path.abspath(csv_path))
+    counts = {}
+
+    with open(csv_path, newline="", encoding="utf-8-sig") as f:
+        reader = csv.DictReader(f)
+        missing = [c for c in REQUIRED_COLUMNS if c not in (reader.fieldnames or [])]
+        if missing:
+            raise ValueError(f"CSV is missing required columns: {', '.join(missing)}")
+
+        for batch in _read_batches(reader, batch_size):
+            entries = []
+            for line_no, row in batch:
+                row = {k: (v or "").strip() for k, v in row.items() if k}
+                entry = {"line": line_no, "row": row, "status": None, "message": ""}
+                if not all(row.get(c) for c in REQUIRED_COLUMNS):
+                    entry["status"], entry["message"] = "invalid", "Missing name/email/password/username"
+                else:
+                    entry["voter"] = {
+                        "name": row["name"], "email": row["email"], "password": row["password"],
+                        "username": row["username"], "role": row.get("role") or "Employee",
+                        "face_embedding": None,
+                    }
+                entries.append(entry)
+
+            _embed_photos(entries, image_root, embed_batch_size)
+
+            pending = [e for e in entries if e["status"] is None]
+            for e, (status, message) in zip(pending, add_voters_batch([e["voter"] for e in pending], org_id)):
+                e["status"], e["message"] = status, message
+
+            for e in entries:
+                counts[e["status"]] = counts.get(e["status"], 0) + 1
+                if on_row:
+                    on_row(e["line"], e["row"], e["status"], e["message"])
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk import voters from a CSV file.")
+    parser.add_argument("csv_path")
+    parser.add_argument("--org-id", type=int, required=True)
+    parser.add_argument("--batch-size", type=int, default=BULK_IMPORT_BATCH_SIZE, help="rows per INSERT transaction")
+    parser.add_argument("--embed-batch-size", type=int, default=FACE_EMBED_BATCH_SIZE, help="face crops per model forward pass")
+    parser.add_argument("--image-root", help="folder that image paths are relative to (default: the CSV's folder)")
+    parser.add_argument("--report", help="write a per-row CSV report here (default: only problem rows to stdout)")
+    args = parser.parse_args(argv)
+
+    if not get_org_by_id(args.org_id):
+        print(f"Organization {args.org_id} not found.")
+        return 1
+
+    report_file = open(args.report, "w", newline="", encoding="utf-8") if args.report else None
+    writer = csv.writer(report_file) if report_file else None
+    if writer:
+        writer.writerow(["line", "email", "username", "status", "message"])
+
+    def on_row(line_no, row, status, message):
+        if writer:
+            writer.writerow([line_no, row.get("email"), row.get("username"), status, message])
+        elif status != "added":
+            print(f"line {line_no}: {status} - {message}")
+
+    start = time.monotonic()
+    try:
+        counts = import_voters(args.csv_path, args.org_id, batch_size=args.batch_size,
+                               image_root=args.image_root, embed_batch_size=args.embed_batch_size,
+                               on_row=on_row)
+    finally:
+        if report_file:
+            report_file.close()
+
+    total = sum(counts.values())
+    print(f"Processed {total} rows in {time.monotonic() - start:.1f}s: "
+          + ", ".join(f"{k}={v}" for k, v in sorted(counts.items())))
+    return 0 if counts.get("error", 0) == 0 else 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
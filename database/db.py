@@ -1,468 +1,776 @@
-import mysql.connector
 import hashlib
-from config import DB_HOST, DB_USER, DB_PASS, DB_NAME, DB_PORT
+import random
+from contextlib import contextmanager
+import threading
+from config import DB_HOST
+from config import DB_POOL_SIZE, DB_POOL_TIMEOUT, DB_POOL_PING_INTERVAL
+from config import VOTE_TALLY_SHARDS, ADMIN_PAGE_SIZE, EXPORT_CHUNK_SIZE
+from database.pool import ConnectionPool, PoolTimeout
+from database.backends import get_backend
+from metrics import timed, timer, instrument_module
 import streamlit as st
 
 import os
 
-def get_db_connection():
+# Storage engine (DB_BACKEND in config.py): connections, error classes, dialect
+# clauses and migrations. The functions below are the same for every backend.
+_backend = get_backend()
+DBError = _backend.Error
+DBIntegrityError = _backend.IntegrityError
+
+# --- Connection Pool ---
+# One pool per process, shared by all Streamlit sessions/reruns.
+_pool = None
+_pool_lock = threading.Lock()
+_last_connection_error = None
+_last_init_error = None
+
+@timed("db.connect")
+def _connect():
+    global _last_connection_error
     try:
-        config = {
-            "host": DB_HOST,
-            "user": DB_USER,
-            "password": DB_PASS,
-            "database": DB_NAME,
-            "port": DB_PORT
-        }
-        
-        # Check for Aiven CA Certificate (ca.pem)
-        ssl_status = "Not Found"
-        if os.path.exists("ca.pem"):
-            config["ssl_ca"] = os.path.abspath("ca.pem")
-            config["ssl_disabled"] = False
-            config["ssl_verify_cert"] = True
-            ssl_status = f"Found at {os.path.abspath('ca.pem')}"
-        
-        # Debugging Connection Params (safely)
-        masked_pw = DB_PASS[:3] + "*" * (len(DB_PASS)-6) + DB_PASS[-3:] if len(DB_PASS) > 6 else "***"
-        st.write(f"🔌 **Connecting to:** `{DB_HOST}:{DB_PORT}`")
-        st.write(f"👤 **User:** `{DB_USER}` | 🔑 **Pass:** `{masked_pw}` (Len: {len(DB_PASS)})")
-        st.write(f"🔒 **SSL CA Status:** {ssl_status}")
-        st.write(f"📂 **CWD:** `{os.getcwd()}`")
-
-        # Hint for Aiven users
-        if "aiven" in DB_HOST:
-             st.info("💡 **Aiven Tip:** New accounts default to 'Allow all IPs', but if you edited 'Allowed IP Addresses', add `0.0.0.0/0` to allow Streamlit Cloud.")
-             st.info("💡 **Password Check:** Did you click 'Reset Password' recently? If so, update your secrets!")
-
-        conn = mysql.connector.connect(**config)
+        conn = _backend.connect()
+        _last_connection_error = None
         return conn
-    except mysql.connector.Error as err:
-        st.error(f"❌ Connection Failed: {err}")
-        return None
+    except DBError as err:
+        _last_connection_error = str(err)
+        print(f"Connection Failed: {err}")
+        raise
 
-# ... (init_db unchanged for now, handled by app.py try/catch)
+def get_pool(size=None):
+    """
+    The process-wide pool, created on first use with DB_POOL_SIZE connections.
+    Tools that need a different size (benchmarks) pass `size` on their first
+    call, before anything else touches the database.
+    """
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(
+                    _connect,
+                    size=size or DB_POOL_SIZE,
+                    timeout=DB_POOL_TIMEOUT,
+                    ping_interval=DB_POOL_PING_INTERVAL
+                )
+    if size and size != _pool.size:
+        raise RuntimeError(f"Connection pool already created with size {_pool.size}")
+    return _pool
+
+@contextmanager
+def db_connection():
+    """
+    Borrows a connection from the process-wide pool and returns it afterwards.
+    Raises DBError if no connection could be obtained.
+    """
+    pool = get_pool()
+    try:
+        with timer("db.pool_acquire"):
+            conn = pool.acquire()
+    except PoolTimeout as e:
+        raise _backend.pool_error(str(e))
+    broken = False
+    try:
+        yield conn
+    except _backend.ConnectionLost:
+        # Lost connection / server gone away: don't hand it back out
+        broken = True
+        raise
+    finally:
+        pool.release(conn, broken=broken)
+
+@contextmanager
+def db_cursor(dictionary=False, commit=False):
+    """
+    Shared query helper for the functions below:
 
-# --- Organization Functions ---
-def create_org(name, org_type):
-    conn = get_db_connection()
-    if conn:
+        with db_cursor(dictionary=True) as cursor:
+            cursor.execute(...)
+
+    With commit=True the transaction is committed on success; any error rolls it back.
+    Timed as db.cursor (errors counted there, since callers swallow them).
+    """
+    with timer("db.cursor"), db_connection() as conn:
+        cursor = conn.cursor(dictionary=dictionary)
         try:
-            cursor = conn.cursor()
-            cursor.execute("INSERT INTO organizations(name, type) VALUES(%s, %s)", (name, org_type))
-            conn.commit()
-            org_id = cursor.lastrowid
+            yield cursor
+            if commit:
+                with timer("db.commit"):
+                    conn.commit()
+        except Exception:
+            try:
+                conn.rollback()
+            except DBError:
+                pass
+            raise
+        finally:
             cursor.close()
-            conn.close()
-            return org_id
-        except mysql.connector.Error as err:
-            st.error(f"⚠️ Create Org Failed: {err}")
-            return None
-    return None
+
+def get_db_connection():
+    """
+    Opens a dedicated (non-pooled) connection. Caller must close it.
+    Prefer db_cursor()/db_connection() which reuse pooled connections.
+    """
+    try:
+        return _connect()
+    except DBError:
+        return None
+
+def connection_diagnostics():
+    """
+    Connection details for the admin Performance panel (kept off the query path).
+    """
+    diag = _backend.diagnostics()
+    diag.update({
+        "cwd": os.getcwd(),
+        "last_error": _last_connection_error,
+        "init_error": _last_init_error,
+        "pool": get_pool().stats()
+    })
+    return diag
 
 def hash_password(password):
     return hashlib.sha256(password.encode()).hexdigest()
 
+_db_ready = False
+_init_lock = threading.Lock()
+
 def init_db():
-    try:
-        config = {
-            "host": DB_HOST,
-            "user": DB_USER,
-            "password": DB_PASS,
-            "port": DB_PORT
-        }
-        if os.path.exists("ca.pem"):
-            config["ssl_ca"] = "ca.pem"
-            config["ssl_disabled"] = False
-
-        conn = mysql.connector.connect(**config)
-        cursor = conn.cursor()
-        
-        cursor.execute(f"CREATE DATABASE IF NOT EXISTS {DB_NAME}")
-        cursor.execute(f"USE {DB_NAME}")
-        
-        # 1. Organizations Table
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS organizations(
-            id INT AUTO_INCREMENT PRIMARY KEY,
-            name VARCHAR(255) UNIQUE,
-            type VARCHAR(50)
-        )
-        """)
-
-        # 2. Voters/Users Table
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS voters(
-            id INT AUTO_INCREMENT PRIMARY KEY,
-            name VARCHAR(255),
-            email VARCHAR(255) UNIQUE,
-            password VARCHAR(255),
-            username VARCHAR(255) UNIQUE,
-            role VARCHAR(50),
-            org_id INT,
-            face_embedding LONGBLOB,  -- Store pickled numpy array
-            FOREIGN KEY (org_id) REFERENCES organizations(id)
-        )
-        """)
-        
-        # 3. Elections Table (NEW)
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS elections(
-            id INT AUTO_INCREMENT PRIMARY KEY,
-            name VARCHAR(255),
-            org_id INT,
-            status VARCHAR(50) DEFAULT 'Active', -- 'Active', 'Closed'
-            FOREIGN KEY (org_id) REFERENCES organizations(id)
-        )
-        """)
-
-        # 4. Candidates Table (Modified to link to Election)
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS candidates(
-            id INT AUTO_INCREMENT PRIMARY KEY,
-            name VARCHAR(255),
-            org_id INT,
-            election_id INT,
-            FOREIGN KEY (org_id) REFERENCES organizations(id),
-            FOREIGN KEY (election_id) REFERENCES elections(id)
-        )
-        """)
-
-        # 5. Votes Table (Modified to link to Election)
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS votes(
-            voter_email VARCHAR(255),
-            candidate_id INT,
-            org_id INT,
-            election_id INT,
-            FOREIGN KEY (candidate_id) REFERENCES candidates(id),
-            FOREIGN KEY (org_id) REFERENCES organizations(id),
-            FOREIGN KEY (election_id) REFERENCES elections(id)
-        )
-        """)
-
-        # 6. Attendance Table (Modified to link to Election)
-        # attendance is now per election
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS attendance(
-            voter_email VARCHAR(255),
-            org_id INT,
-            election_id INT,
-            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (org_id) REFERENCES organizations(id),
-            FOREIGN KEY (election_id) REFERENCES elections(id)
-        )
-        """)
-        
-        # --- Migration Logic ---
-        cursor.execute("DESCRIBE voters")
-        voter_cols = [c[0] for c in cursor.fetchall()]
-        if 'face_embedding' not in voter_cols:
-            cursor.execute("ALTER TABLE voters ADD COLUMN face_embedding LONGBLOB")
-
-        cursor.execute("DESCRIBE candidates")
-        cand_cols = [c[0] for c in cursor.fetchall()]
-        if 'election_id' not in cand_cols:
-            cursor.execute("ALTER TABLE candidates ADD COLUMN election_id INT")
-            
-        cursor.execute("DESCRIBE votes")
-        vote_cols = [c[0] for c in cursor.fetchall()]
-        if 'election_id' not in vote_cols:
-            cursor.execute("ALTER TABLE votes ADD COLUMN election_id INT")
-
-        cursor.execute("DESCRIBE attendance")
-        att_cols = [c[0] for c in cursor.fetchall()]
-        if 'election_id' not in att_cols:
-            cursor.execute("ALTER TABLE attendance ADD COLUMN election_id INT")
-
-        conn.commit()
-        cursor.close()
-        conn.close()
-        print("Database initialized successfully.")
-    except mysql.connector.Error as err:
-        print(f"Error initializing database: {err}")
+    """
+    Creates the database if needed and applies pending schema migrations
+    (database/migrations.py). Runs once per process: later calls, e.g. on every
+    Streamlit rerun, return immediately. Returns True when the schema is ready.
+    """
+    global _db_ready, _last_init_error
+    if _db_ready:
+        return True
+    with _init_lock:
+        if _db_ready:
+            return True
+        try:
+            # Dedicated connection (DDL doesn't belong on pooled connections)
+            conn = _backend.connect_for_init()
+            try:
+                applied = _backend.migrate(conn)
+            finally:
+                conn.close()
+
+            _db_ready = True
+            _last_init_error = None
+            if applied:
+                print(f"Database initialized successfully (migrations {applied[0]}-{applied[-1]} applied).")
+            return True
+        except (DBError, RuntimeError) as err:
+            _last_init_error = str(err)
+            print(f"Error initializing database: {err}")
+            return False
 
 # --- Organization Functions ---
 def create_org(name, org_type):
-    conn = get_db_connection()
-    if conn:
-        try:
-            cursor = conn.cursor()
+    try:
+        with db_cursor(commit=True) as cursor:
             cursor.execute("INSERT INTO organizations(name, type) VALUES(%s, %s)", (name, org_type))
-            conn.commit()
-            org_id = cursor.lastrowid
-            cursor.close()
-            conn.close()
-            return org_id
-        except mysql.connector.Error as err:
-            return None
-    return None
+            return cursor.lastrowid
+    except DBError:
+        return None
 
 def get_all_orgs():
-    conn = get_db_connection()
-    if conn:
-        try:
-            cursor = conn.cursor(dictionary=True)
+    try:
+        with db_cursor(dictionary=True) as cursor:
             cursor.execute("SELECT id, name, type FROM organizations")
-            orgs = cursor.fetchall()
-            cursor.close()
-            conn.close()
-            return orgs
-        except mysql.connector.Error:
-            return []
-    return []
+            return cursor.fetchall()
+    except DBError:
+        return []
 
 def get_org_by_id(org_id):
-    conn = get_db_connection()
-    if conn:
-        try:
-            cursor = conn.cursor(dictionary=True)
+    try:
+        with db_cursor(dictionary=True) as cursor:
             cursor.execute("SELECT * FROM organizations WHERE id=%s", (org_id,))
-            org = cursor.fetchone()
-            cursor.close()
-            conn.close()
-            return org
-        except mysql.connector.Error:
-            return None
-    return None
+            return cursor.fetchone()
+    except DBError:
+        return None
 
 # --- User/Voter Functions ---
 def add_voter(name, email, password, username, role, org_id, face_embedding=None):
-    conn = get_db_connection()
-    if conn:
-        try:
-            cursor = conn.cursor()
+    try:
+        with db_cursor(commit=True) as cursor:
             hashed_pw = hash_password(password)
-            # face_embedding is expected to be bytes (pickled)
+            # face_embedding is expected to be bytes (vision.embedding_codec.encode_embedding)
             cursor.execute(
-                "INSERT INTO voters(name, email, password, username, role, org_id, face_embedding) VALUES(%s, %s, %s, %s, %s, %s, %s)", 
+                "INSERT INTO voters(name, email, password, username, role, org_id, face_embedding) VALUES(%s, %s, %s, %s, %s, %s, %s)",
                 (name, email, hashed_pw, username, role, org_id, face_embedding)
             )
-            conn.commit()
-            cursor.close()
-            conn.close()
             return True
-        except mysql.connector.Error as err:
-            return False
-    return False
+    except DBError:
+        return False
+
+def add_voters_batch(voters, org_id):
+    """
+    Bulk insert for imports: one transaction and one multi-row executemany for the
+    whole batch instead of a connection + commit per voter.
+    voters: list of dicts {name, email, password, username, role, face_embedding (optional)}
+    Returns one (status, message) per voter, in order. status is 'added',
+    'duplicate' (email/username already taken, or repeated in the batch) or 'error'.
+    Duplicates are reported per row and never fail the rest of the batch.
+    """
+    results = [None] * len(voters)
+    if not voters:
+        return results
+
+    try:
+        with db_cursor(commit=True) as cursor:
+            # 1. Find conflicts with existing voters in one query
+            emails = [v['email'] for v in voters]
+            usernames = [v['username'] for v in voters]
+            cursor.execute(
+                "SELECT email, username FROM voters WHERE email IN ({0}) OR username IN ({1})".format(
+                    ", ".join(["%s"] * len(emails)), ", ".join(["%s"] * len(usernames))
+                ),
+                emails + usernames
+            )
+            taken_emails, taken_usernames = set(), set()
+            for email, username in cursor.fetchall():
+                taken_emails.add(email)
+                taken_usernames.add(username)
+
+            # 2. ...and within the batch itself
+            rows, row_positions = [], []
+            for i, v in enumerate(voters):
+                if v['email'] in taken_emails:
+                    results[i] = ("duplicate", f"Email already registered: {v['email']}")
+                    continue
+                if v['username'] in taken_usernames:
+                    results[i] = ("duplicate", f"Username already taken: {v['username']}")
+                    continue
+                taken_emails.add(v['email'])
+                taken_usernames.add(v['username'])
+                rows.append((v['name'], v['email'], hash_password(v['password']), v['username'],
+                             v.get('role') or "Employee", org_id, v.get('face_embedding')))
+                row_positions.append(i)
+
+            if not rows:
+                return results
+
+            query = "INSERT INTO voters(name, email, password, username, role, org_id, face_embedding) VALUES(%s, %s, %s, %s, %s, %s, %s)"
+            try:
+                cursor.execute("SAVEPOINT bulk_batch")
+                cursor.executemany(query, rows)
+                for i in row_positions:
+                    results[i] = ("added", "")
+            except DBIntegrityError:
+                # Raced with another writer: redo this batch row by row, still in one transaction
+                cursor.execute("ROLLBACK TO SAVEPOINT bulk_batch")
+                for i, row in zip(row_positions, rows):
+                    try:
+                        cursor.execute(query, row)
+                        results[i] = ("added", "")
+                    except DBIntegrityError as err:
+                        results[i] = ("duplicate", str(err))
+            return results
+    except DBError as err:
+        print(f"Error importing voters: {err}")
+        return [r if r and r[0] == "duplicate" else ("error", str(err)) for r in results]
 
 def get_all_voters_with_embeddings():
     """
     Fetches all voters with their face embeddings.
     Returns list of dicts: {username, face_embedding (bytes), ...}
     """
-    conn = get_db_connection()
-    if conn:
-        try:
-            cursor = conn.cursor(dictionary=True)
+    try:
+        with db_cursor(dictionary=True) as cursor:
             cursor.execute("SELECT username, face_embedding FROM voters WHERE face_embedding IS NOT NULL")
-            users = cursor.fetchall()
-            cursor.close()
-            conn.close()
-            return users
-        except mysql.connector.Error:
-            return []
-    return []
+            return cursor.fetchall()
+    except DBError:
+        return []
+
+def get_voter_embeddings_since(since=None):
+    """
+    Incremental gallery fetch for the face cache.
+    since=None: every voter with an embedding (initial load).
+    since=<datetime>: voters added/changed at or after that time, including ones
+    whose embedding was cleared (face_embedding is None -> drop from gallery).
+    Returns list of dicts: {username, org_id, face_embedding, updated_at}, or None on error.
+    """
+    try:
+        with db_cursor(dictionary=True) as cursor:
+            if since is None:
+                cursor.execute(
+                    "SELECT username, org_id, face_embedding, updated_at FROM voters "
+                    "WHERE face_embedding IS NOT NULL"
+                )
+            else:
+                cursor.execute(
+                    "SELECT username, org_id, face_embedding, updated_at FROM voters "
+                    "WHERE updated_at >= %s ORDER BY updated_at",
+                    (since,)
+                )
+            return cursor.fetchall()
+    except DBError as err:
+        print(f"Error fetching voter embeddings: {err}")
+        return None
+
+def get_voter_embedding(username):
+    """
+    Single-row fetch of one voter's face embedding (1:1 verification).
+    Returns dict {username, org_id, face_embedding} or None if there is no such voter.
+    Raises DBError, so verify() can't mistake an outage for a face mismatch.
+    """
+    try:
+        with db_cursor(dictionary=True) as cursor:
+            cursor.execute("SELECT username, org_id, face_embedding FROM voters WHERE username=%s", (username,))
+            return cursor.fetchone()
+    except DBError as err:
+        print(f"Error fetching voter embedding: {err}")
+        raise
 
 def authenticate_voter(email, password, org_id):
-    conn = get_db_connection()
-    if conn:
-        try:
-            cursor = conn.cursor(dictionary=True)
+    try:
+        with db_cursor(dictionary=True) as cursor:
             hashed_pw = hash_password(password)
             cursor.execute(
-                "SELECT * FROM voters WHERE email=%s AND password=%s AND org_id=%s", 
+                "SELECT * FROM voters WHERE email=%s AND password=%s AND org_id=%s",
                 (email, hashed_pw, org_id)
             )
-            user = cursor.fetchone()
-            cursor.close()
-            conn.close()
-            return user
-        except mysql.connector.Error as err:
-            return None
-    return None
+            return cursor.fetchone()
+    except DBError:
+        return None
 
 def get_org_employees(org_id):
-    conn = get_db_connection()
-    if conn:
-        try:
-            cursor = conn.cursor(dictionary=True)
+    try:
+        with db_cursor(dictionary=True) as cursor:
             cursor.execute("SELECT name, email, role, username FROM voters WHERE org_id=%s", (org_id,))
-            users = cursor.fetchall()
-            cursor.close()
-            conn.close()
-            return users
-        except:
-            return []
-    return []
+            return cursor.fetchall()
+    except DBError:
+        return []
 
 # --- Election Functions (NEW) ---
 def create_election(name, org_id):
-    conn = get_db_connection()
-    if conn:
-        try:
-            cursor = conn.cursor()
+    try:
+        with db_cursor(commit=True) as cursor:
             cursor.execute("INSERT INTO elections(name, org_id) VALUES(%s, %s)", (name, org_id))
-            conn.commit()
-            cursor.close()
-            conn.close()
             return True
-        except:
-            return False
-    return False
+    except DBError:
+        return False
 
 def get_org_elections(org_id):
-    conn = get_db_connection()
-    if conn:
-        try:
-            cursor = conn.cursor(dictionary=True)
+    try:
+        with db_cursor(dictionary=True) as cursor:
             cursor.execute("SELECT * FROM elections WHERE org_id=%s", (org_id,))
-            res = cursor.fetchall()
-            cursor.close()
-            conn.close()
-            return res
-        except:
-            return []
-    return []
+            return cursor.fetchall()
+    except DBError:
+        return []
 
 # --- Candidate Functions ---
 
 def add_candidate(name, org_id, election_id):
-    conn = get_db_connection()
-    if conn:
-        try:
-            cursor = conn.cursor()
+    try:
+        with db_cursor(commit=True) as cursor:
             cursor.execute("INSERT INTO candidates(name, org_id, election_id) VALUES(%s, %s, %s)", (name, org_id, election_id))
-            conn.commit()
-            cursor.close()
-            conn.close()
             return True
-        except:
-            return False
-    return False
+    except DBError:
+        return False
 
 def get_election_candidates(election_id):
-    conn = get_db_connection()
-    if conn:
-        try:
-            cursor = conn.cursor(dictionary=True)
+    try:
+        with db_cursor(dictionary=True) as cursor:
             cursor.execute("SELECT id, name FROM candidates WHERE election_id=%s", (election_id,))
-            candidates = cursor.fetchall()
-            cursor.close()
-            conn.close()
-            return candidates
-        except:
-            return []
-    return []
-    
+            return cursor.fetchall()
+    except DBError:
+        return []
+
 # Keep legacy for backward compat if needed, but better to use election specific
 def get_org_candidates(org_id):
-    conn = get_db_connection()
-    if conn:
-        try:
-            cursor = conn.cursor(dictionary=True)
+    try:
+        with db_cursor(dictionary=True) as cursor:
             cursor.execute("SELECT id, name, election_id FROM candidates WHERE org_id=%s", (org_id,))
-            candidates = cursor.fetchall()
-            cursor.close()
-            conn.close()
-            return candidates
-        except:
-            return []
-    return []
+            return cursor.fetchall()
+    except DBError:
+        return []
 
 def delete_candidate(candidate_id, org_id):
-    conn = get_db_connection()
-    if conn:
-        try:
-            cursor = conn.cursor()
+    try:
+        with db_cursor(commit=True) as cursor:
             cursor.execute("DELETE FROM candidates WHERE id=%s AND org_id=%s", (candidate_id, org_id))
-            conn.commit()
-            cursor.close()
-            conn.close()
             return True
-        except:
-            return False
-    return False
+    except DBError:
+        return False
 
 # --- Voting/Attendance Functions ---
 
 def mark_attendance(email, org_id, election_id):
-    conn = get_db_connection()
-    if conn:
-        try:
-            cursor = conn.cursor()
+    try:
+        with db_cursor(commit=True) as cursor:
             # Insert attendance for specific election
             cursor.execute("INSERT IGNORE INTO attendance(voter_email, org_id, election_id) VALUES(%s, %s, %s)", (email, org_id, election_id))
-            conn.commit()
-            cursor.close()
-            conn.close()
-        except mysql.connector.Error as err:
-            print(f"Error marking attendance: {err}")
+    except DBError as err:
+        print(f"Error marking attendance: {err}")
 
 def has_voted(email, org_id, election_id):
-    conn = get_db_connection()
-    if conn:
-        try:
-            cursor = conn.cursor()
-            cursor.execute("SELECT * FROM votes WHERE voter_email=%s AND org_id=%s AND election_id=%s", (email, org_id, election_id))
-            result = cursor.fetchone()
-            cursor.close()
-            conn.close()
-            return result is not None
-        except mysql.connector.Error as err:
-            return False
-    return False
+    try:
+        with db_cursor() as cursor:
+            cursor.execute("SELECT 1 FROM votes WHERE voter_email=%s AND org_id=%s AND election_id=%s LIMIT 1", (email, org_id, election_id))
+            return cursor.fetchone() is not None
+    except DBError:
+        return False
 
 def save_vote(email, candidate_id, org_id, election_id):
-    conn = get_db_connection()
-    if conn:
-        try:
-            print(f"DEBUG: Saving vote for {email}, cand: {candidate_id}, org: {org_id}, elec: {election_id}")
-            cursor = conn.cursor()
-            cursor.execute("INSERT INTO votes(voter_email, candidate_id, org_id, election_id) VALUES(%s, %s, %s, %s)", (email, candidate_id, org_id, election_id))
-            conn.commit()
-            cursor.close()
-            conn.close()
-            return True
-        except mysql.connector.Error as err:
-            print(f"Error saving vote: {err}")
-            return False
-    return False
+    """
+    Boolean form of cast_vote() for older callers: True if the vote was
+    recorded. Goes through cast_vote() so the tally is updated with the vote.
+    """
+    return cast_vote(email, candidate_id, org_id, election_id) == VOTE_ACCEPTED
+
+def _increment_tally(cursor, election_id, candidate_id, count=1):
+    # Random shard: concurrent votes for one candidate mostly hit different rows
+    shard = random.randrange(VOTE_TALLY_SHARDS)
+    cursor.execute(
+        "INSERT INTO vote_tallies(election_id, candidate_id, shard, count) VALUES(%s, %s, %s, %s) "
+        + _backend.add_on_conflict(("election_id", "candidate_id", "shard"), "count"),
+        (election_id, candidate_id, shard, count, count)
+    )
+
+def _record_vote(cursor, email, candidate_id, org_id, election_id):
+    """
+    Per-vote SQL shared by cast_vote() and cast_votes_batch(): the vote, the
+    voter's attendance and the candidate's tally. Raises IntegrityError
+    (ER_DUP_ENTRY) before writing anything if the voter already voted.
+    """
+    cursor.execute("INSERT INTO votes(voter_email, candidate_id, org_id, election_id) VALUES(%s, %s, %s, %s)", (email, candidate_id, org_id, election_id))
+    cursor.execute("INSERT IGNORE INTO attendance(voter_email, org_id, election_id) VALUES(%s, %s, %s)", (email, org_id, election_id))
+    _increment_tally(cursor, election_id, candidate_id)
+
+# In-process vote version per election, bumped on every accepted vote
+# (lets cached results know they are stale without polling the DB)
+_vote_versions = {}
+_vote_versions_lock = threading.Lock()
+
+def get_vote_version(election_id):
+    return _vote_versions.get(election_id, 0)
+
+def _bump_vote_version(election_id):
+    with _vote_versions_lock:
+        _vote_versions[election_id] = _vote_versions.get(election_id, 0) + 1
+
+# cast_vote() results
+VOTE_ACCEPTED = "accepted"
+VOTE_ALREADY_CAST = "already_voted"
+VOTE_FAILED = "error"
+
+def cast_vote(email, candidate_id, org_id, election_id):
+    """
+    Records a vote, the voter's attendance and the candidate's tally in one
+    transaction on one pooled connection. No pre-read: the unique key on votes(election_id, voter_email)
+    rejects a second vote (double click, concurrent tabs) at insert time.
+    Returns VOTE_ACCEPTED, VOTE_ALREADY_CAST or VOTE_FAILED.
+    """
+    try:
+        with db_cursor(commit=True) as cursor:
+            _record_vote(cursor, email, candidate_id, org_id, election_id)
+        _bump_vote_version(election_id)
+        return VOTE_ACCEPTED
+    except DBIntegrityError as err:
+        if _backend.is_duplicate(err):
+            return VOTE_ALREADY_CAST
+        print(f"Error casting vote: {err}")
+        return VOTE_FAILED
+    except DBError as err:
+        print(f"Error casting vote: {err}")
+        return VOTE_FAILED
+
+def cast_votes_batch(votes):
+    """
+    Group commit for the vote writer (database/vote_writer.py): many votes, one
+    transaction and one commit/fsync.
+    votes: list of (email, candidate_id, org_id, election_id)
+    Returns one VOTE_* status per vote, in order. A voter who already voted (or
+    appears twice in the batch) gets VOTE_ALREADY_CAST without failing the rest.
+    """
+    results = [None] * len(votes)
+    if not votes:
+        return results
+
+    try:
+        with db_cursor(commit=True) as cursor:
+            # 1. Voters who already voted, in one query
+            keys = list({(election_id, email) for email, _, _, election_id in votes})
+            cursor.execute(
+                "SELECT election_id, voter_email FROM votes WHERE (election_id, voter_email) IN ({0})".format(
+                    ", ".join(["(%s, %s)"] * len(keys))
+                ),
+                [value for key in keys for value in key]
+            )
+            voted = set(cursor.fetchall())
+
+            # 2. ...and repeats within the batch (first one wins)
+            pending = []
+            for i, (email, candidate_id, org_id, election_id) in enumerate(votes):
+                if (election_id, email) in voted:
+                    results[i] = VOTE_ALREADY_CAST
+                    continue
+                voted.add((election_id, email))
+                pending.append(i)
+
+            if not pending:
+                return results
+
+            try:
+                cursor.execute("SAVEPOINT vote_batch")
+                cursor.executemany(
+                    "INSERT INTO votes(voter_email, candidate_id, org_id, election_id) VALUES(%s, %s, %s, %s)",
+                    [votes[i] for i in pending]
+                )
+                cursor.executemany(
+                    "INSERT IGNORE INTO attendance(voter_email, org_id, election_id) VALUES(%s, %s, %s)",
+                    [(votes[i][0], votes[i][2], votes[i][3]) for i in pending]
+                )
+                # One tally upsert per candidate for the whole batch
+                per_candidate = {}
+                for i in pending:
+                    key = (votes[i][3], votes[i][1])
+                    per_candidate[key] = per_candidate.get(key, 0) + 1
+                for (election_id, candidate_id), count in per_candidate.items():
+                    _increment_tally(cursor, election_id, candidate_id, count)
+                for i in pending:
+                    results[i] = VOTE_ACCEPTED
+            except DBIntegrityError:
+                # Raced with another process (or a bad candidate id): redo vote by vote, same transaction
+                cursor.execute("ROLLBACK TO SAVEPOINT vote_batch")
+                for i in pending:
+                    try:
+                        _record_vote(cursor, *votes[i])
+                        results[i] = VOTE_ACCEPTED
+                    except DBIntegrityError as err:
+                        results[i] = VOTE_ALREADY_CAST if _backend.is_duplicate(err) else VOTE_FAILED
+    except DBError as err:
+        print(f"Error casting vote batch: {err}")
+        return [r if r == VOTE_ALREADY_CAST else VOTE_FAILED for r in results]
+
+    for election_id in {votes[i][3] for i, r in enumerate(results) if r == VOTE_ACCEPTED}:
+        _bump_vote_version(election_id)
+    return results
 
 def get_election_results(election_id):
-    conn = get_db_connection()
-    if conn:
-        try:
-            cursor = conn.cursor(dictionary=True)
+    """
+    Per-candidate vote counts, read from the vote_tallies counters
+    (O(candidates x shards), independent of turnout).
+    """
+    try:
+        with db_cursor(dictionary=True) as cursor:
             query = """
-                SELECT c.name as candidate_name, COUNT(v.voter_email) as count 
-                FROM candidates c 
-                LEFT JOIN votes v ON c.id = v.candidate_id 
-                WHERE c.election_id = %s 
+                SELECT c.name as candidate_name, CAST(COALESCE(SUM(t.count), 0) AS SIGNED) as count
+                FROM candidates c
+                LEFT JOIN vote_tallies t ON t.election_id = c.election_id AND t.candidate_id = c.id
+                WHERE c.election_id = %s
                 GROUP BY c.id
             """
             cursor.execute(query, (election_id,))
-            res = cursor.fetchall()
-            cursor.close()
-            conn.close()
-            return res
-        except mysql.connector.Error as err:
-            return []
-    return []
+            return cursor.fetchall()
+    except DBError:
+        return []
+
+def check_tallies(election_id):
+    """
+    Compares the counters with a full count of the votes table.
+    Returns list of {candidate_id, tally, actual} for candidates that disagree.
+    """
+    try:
+        with db_cursor(dictionary=True) as cursor:
+            cursor.execute("""
+                SELECT c.id as candidate_id,
+                       CAST(COALESCE((SELECT SUM(t.count) FROM vote_tallies t WHERE t.election_id = c.election_id AND t.candidate_id = c.id), 0) AS SIGNED) as tally,
+                       (SELECT COUNT(*) FROM votes v WHERE v.election_id = c.election_id AND v.candidate_id = c.id) as actual
+                FROM candidates c
+                WHERE c.election_id = %s
+            """, (election_id,))
+            return [r for r in cursor.fetchall() if r['tally'] != r['actual']]
+    except DBError as err:
+        print(f"Error checking tallies: {err}")
+        return None
+
+def rebuild_tallies(election_id):
+    """
+    Reconciliation: recomputes one election's counters from the votes table in a
+    single transaction (shards collapse into shard 0). Returns True on success.
+    """
+    try:
+        with db_cursor(commit=True) as cursor:
+            cursor.execute("DELETE FROM vote_tallies WHERE election_id=%s", (election_id,))
+            cursor.execute("""
+                INSERT INTO vote_tallies(election_id, candidate_id, shard, count)
+                SELECT election_id, candidate_id, 0, COUNT(*) FROM votes
+                WHERE election_id = %s AND candidate_id IS NOT NULL
+                GROUP BY election_id, candidate_id
+            """, (election_id,))
+            return True
+    except DBError as err:
+        print(f"Error rebuilding tallies: {err}")
+        return False
+
+def get_all_election_ids():
+    try:
+        with db_cursor() as cursor:
+            cursor.execute("SELECT id FROM elections")
+            return [row[0] for row in cursor.fetchall()]
+    except DBError:
+        return []
 
 def get_election_attendance(election_id):
-    conn = get_db_connection()
-    if conn:
-        try:
-            cursor = conn.cursor(dictionary=True)
+    try:
+        with db_cursor(dictionary=True) as cursor:
             cursor.execute("SELECT voter_email, timestamp FROM attendance WHERE election_id=%s", (election_id,))
-            res = cursor.fetchall()
-            cursor.close()
-            conn.close()
-            return res
-        except:
-            return []
-    return []
+            return cursor.fetchall()
+    except DBError:
+        return []
+
+# --- Admin Tables (keyset pagination + streaming export) ---
+#
+# Pages are fetched with a keyset cursor (WHERE key < last key seen ... LIMIT n)
+# instead of OFFSET, so page 2000 costs the same as page 1. Each *_page()
+# function returns (rows, next_cursor); pass next_cursor back as `after` to get
+# the following page. next_cursor is None on the last page.
+
+def _contains_pattern(text):
+    # LIKE pattern for a literal substring, used with ESCAPE '!' (MySQL and SQLite
+    # disagree on backslashes in string literals, so the escape char is '!')
+    escaped = text.replace("!", "!!").replace("%", "!%").replace("_", "!_")
+    return f"%{escaped}%"
+
+def _attendance_filters(election_id, search=None, since=None, until=None):
+    where = ["a.election_id = %s"]
+    params = [election_id]
+    if search:
+        where.append("(a.voter_email LIKE %s ESCAPE '!' OR v.name LIKE %s ESCAPE '!')")
+        params += [_contains_pattern(search)] * 2
+    if since:
+        where.append("a.timestamp >= %s")
+        params.append(since)
+    if until:
+        where.append("a.timestamp < %s")
+        params.append(until)
+    return " AND ".join(where), params
+
+def _employee_filters(org_id, search=None):
+    where = ["org_id = %s"]
+    params = [org_id]
+    if search:
+        where.append("(email LIKE %s ESCAPE '!' OR name LIKE %s ESCAPE '!' OR username LIKE %s ESCAPE '!')")
+        params += [_contains_pattern(search)] * 3
+    return " AND ".join(where), params
+
+def _split_page(rows, limit, cursor_of):
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, cursor_of(rows[-1])
+    return rows, None
+
+def get_election_attendance_page(election_id, after=None, limit=ADMIN_PAGE_SIZE, search=None, since=None, until=None):
+    """
+    One page of an election's attendance, newest first, filtered by voter
+    email/name substring and [since, until) time range.
+    Returns (rows, next_cursor).
+    """
+    where, params = _attendance_filters(election_id, search, since, until)
+    if after:
+        # (timestamp, id) descending - matches idx_attendance_election_time (election_id, timestamp[, id])
+        where += " AND (a.timestamp < %s OR (a.timestamp = %s AND a.id < %s))"
+        params += [after[0], after[0], after[1]]
+    try:
+        with db_cursor(dictionary=True) as cursor:
+            cursor.execute(f"""
+                SELECT a.id, a.voter_email, v.name, a.timestamp
+                FROM attendance a LEFT JOIN voters v ON v.email = a.voter_email
+                WHERE {where}
+                ORDER BY a.timestamp DESC, a.id DESC
+                LIMIT %s
+            """, params + [limit + 1])
+            rows = cursor.fetchall()
+    except DBError as err:
+        print(f"Error fetching attendance page: {err}")
+        return [], None
+    return _split_page(rows, limit, lambda row: (row['timestamp'], row['id']))
+
+def count_election_attendance(election_id, search=None, since=None, until=None):
+    where, params = _attendance_filters(election_id, search, since, until)
+    join = "LEFT JOIN voters v ON v.email = a.voter_email" if search else ""
+    try:
+        with db_cursor() as cursor:
+            cursor.execute(f"SELECT COUNT(*) FROM attendance a {join} WHERE {where}", params)
+            return cursor.fetchone()[0]
+    except DBError:
+        return None
+
+def get_org_employees_page(org_id, after=None, limit=ADMIN_PAGE_SIZE, search=None):
+    """
+    One page of an organization's voters in registration order, filtered by
+    email/name/username substring. Returns (rows, next_cursor).
+    """
+    where, params = _employee_filters(org_id, search)
+    if after:
+        where += " AND id > %s"
+        params.append(after)
+    try:
+        with db_cursor(dictionary=True) as cursor:
+            cursor.execute(f"""
+                SELECT id, name, email, role, username FROM voters
+                WHERE {where}
+                ORDER BY id
+                LIMIT %s
+            """, params + [limit + 1])
+            rows = cursor.fetchall()
+    except DBError as err:
+        print(f"Error fetching employees page: {err}")
+        return [], None
+    return _split_page(rows, limit, lambda row: row['id'])
+
+def count_org_employees(org_id, search=None):
+    where, params = _employee_filters(org_id, search)
+    try:
+        with db_cursor() as cursor:
+            cursor.execute(f"SELECT COUNT(*) FROM voters WHERE {where}", params)
+            return cursor.fetchone()[0]
+    except DBError:
+        return None
+
+def _stream(query, params, chunk_size):
+    """
+    Yields lists of row dicts read through an unbuffered cursor, so only one
+    chunk is in memory at a time. Uses a dedicated connection (long exports must
+    not hold a pooled one away from voters). Errors are raised to the caller -
+    a silently truncated export would be worse than a failed one.
+    """
+    conn = _connect()
+    try:
+        cursor = conn.cursor(dictionary=True, buffered=False)
+        try:
+            cursor.execute(query, params)
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield rows
+        finally:
+            try:
+                cursor.close()
+            except DBError:
+                pass
+    finally:
+        conn.close()
+
+def iter_election_attendance(election_id, chunk_size=EXPORT_CHUNK_SIZE, search=None, since=None, until=None):
+    where, params = _attendance_filters(election_id, search, since, until)
+    return _stream(f"""
+        SELECT a.voter_email, v.name, a.timestamp
+        FROM attendance a LEFT JOIN voters v ON v.email = a.voter_email
+        WHERE {where}
+        ORDER BY a.timestamp DESC, a.id DESC
+    """, params, chunk_size)
+
+def iter_org_employees(org_id, chunk_size=EXPORT_CHUNK_SIZE, search=None):
+    where, params = _employee_filters(org_id, search)
+    return _stream(f"SELECT id, name, email, role, username FROM voters WHERE {where} ORDER BY id", params, chunk_size)
+
+# Latency / error / row counters for every public function above (see metrics.py)
+instrument_module(globals(), "db")
 
 # Initialize DB on module load
 try:
@@ -0,0 +1,450 @@
+"""
+Versioned schema migrations.
+
+Each migration runs once per database and is recorded in `schema_migrations`.
+init_db() (database/db.py) calls run_migrations() once per process; when the
+schema is current that costs a single SELECT. To migrate explicitly at deploy:
+
+    python -m database.migrations
+
+Migrations are written to be idempotent (they check information_schema first)
+because databases created before this runner already have some of the changes.
+
+The embedded SQLite backend (database/backends.py) has its own, shorter list,
+SQLITE_MIGRATIONS: its databases start at the current schema, so it needs no
+legacy upgrades. Add new schema changes to both lists.
+"""
+from config import EMBEDDING_DTYPE, EMBEDDING_MIGRATION_BATCH, FACE_MODEL_NAME
+
+MIGRATION_LOCK = "voting_system_schema_migrations"
+
+# --- Schema helpers ---
+
+def _columns(cursor, table):
+    cursor.execute(
+        "SELECT COLUMN_NAME FROM information_schema.COLUMNS WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s",
+        (table,)
+    )
+    return {row[0] for row in cursor.fetchall()}
+
+def _has_index(cursor, table, name):
+    cursor.execute(
+        "SELECT 1 FROM information_schema.STATISTICS WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND INDEX_NAME = %s LIMIT 1",
+        (table, name)
+    )
+    return cursor.fetchone() is not None
+
+def _has_index_starting_with(cursor, table, columns):
+    """True if some index on `table` starts with exactly these columns (in order)."""
+    cursor.execute(
+        "SELECT INDEX_NAME, COLUMN_NAME FROM information_schema.STATISTICS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s ORDER BY INDEX_NAME, SEQ_IN_INDEX",
+        (table,)
+    )
+    indexes = {}
+    for index_name, column in cursor.fetchall():
+        indexes.setdefault(index_name, []).append(column)
+    return any(cols[:len(columns)] == list(columns) for cols in indexes.values())
+
+def _add_index(cursor, table, name, columns, unique=False):
+    if _has_index(cursor, table, name) or (not unique and _has_index_starting_with(cursor, table, columns)):
+        return
+    kind = "UNIQUE KEY" if unique else "INDEX"
+    cursor.execute(f"ALTER TABLE {table} ADD {kind} {name} ({', '.join(columns)})")
+
+# --- Migrations ---
+
+def _base_schema(conn, cursor):
+    # 1. Organizations Table
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS organizations(
+        id INT AUTO_INCREMENT PRIMARY KEY,
+        name VARCHAR(255) UNIQUE,
+        type VARCHAR(50)
+    )
+    """)
+
+    # 2. Voters/Users Table
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS voters(
+        id INT AUTO_INCREMENT PRIMARY KEY,
+        name VARCHAR(255),
+        email VARCHAR(255) UNIQUE,
+        password VARCHAR(255),
+        username VARCHAR(255) UNIQUE,
+        role VARCHAR(50),
+        org_id INT,
+        face_embedding LONGBLOB,  -- vision.embedding_codec format (legacy rows: pickled list)
+        FOREIGN KEY (org_id) REFERENCES organizations(id)
+    )
+    """)
+
+    # 3. Elections Table
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS elections(
+        id INT AUTO_INCREMENT PRIMARY KEY,
+        name VARCHAR(255),
+        org_id INT,
+        status VARCHAR(50) DEFAULT 'Active', -- 'Active', 'Closed'
+        FOREIGN KEY (org_id) REFERENCES organizations(id)
+    )
+    """)
+
+    # 4. Candidates Table (linked to Election)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS candidates(
+        id INT AUTO_INCREMENT PRIMARY KEY,
+        name VARCHAR(255),
+        org_id INT,
+        election_id INT,
+        FOREIGN KEY (org_id) REFERENCES organizations(id),
+        FOREIGN KEY (election_id) REFERENCES elections(id)
+    )
+    """)
+
+    # 5. Votes Table (linked to Election)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS votes(
+        voter_email VARCHAR(255),
+        candidate_id INT,
+        org_id INT,
+        election_id INT,
+        FOREIGN KEY (candidate_id) REFERENCES candidates(id),
+        FOREIGN KEY (org_id) REFERENCES organizations(id),
+        FOREIGN KEY (election_id) REFERENCES elections(id)
+    )
+    """)
+
+    # 6. Attendance Table (per election)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS attendance(
+        voter_email VARCHAR(255),
+        org_id INT,
+        election_id INT,
+        timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (org_id) REFERENCES organizations(id),
+        FOREIGN KEY (election_id) REFERENCES elections(id)
+    )
+    """)
+
+def _legacy_columns(conn, cursor):
+    # Databases from before elections / face embeddings existed
+    if 'face_embedding' not in _columns(cursor, "voters"):
+        cursor.execute("ALTER TABLE voters ADD COLUMN face_embedding LONGBLOB")
+    for table in ("candidates", "votes", "attendance"):
+        if 'election_id' not in _columns(cursor, table):
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN election_id INT")
+
+def _voters_updated_at(conn, cursor):
+    # High-water mark for incremental gallery sync (vision/gallery.py)
+    if 'updated_at' not in _columns(cursor, "voters"):
+        cursor.execute(
+            "ALTER TABLE voters ADD COLUMN updated_at TIMESTAMP(6) "
+            "DEFAULT CURRENT_TIMESTAMP(6) ON UPDATE CURRENT_TIMESTAMP(6)"
+        )
+    _add_index(cursor, "voters", "idx_voters_updated_at", ["updated_at"])
+
+def _one_vote_per_voter(conn, cursor):
+    if 'id' not in _columns(cursor, "votes"):
+        cursor.execute("ALTER TABLE votes ADD COLUMN id INT AUTO_INCREMENT PRIMARY KEY FIRST")
+    if not _has_index(cursor, "votes", "uq_votes_election_voter"):
+        # Keep the first vote of any voter who managed to vote twice, then enforce uniqueness
+        cursor.execute("""
+            DELETE v1 FROM votes v1
+            JOIN votes v2 ON v1.election_id = v2.election_id AND v1.voter_email = v2.voter_email AND v1.id > v2.id
+        """)
+        if cursor.rowcount:
+            print(f"Removed {cursor.rowcount} duplicate votes before adding the one-vote-per-voter key.")
+        _add_index(cursor, "votes", "uq_votes_election_voter", ["election_id", "voter_email"], unique=True)
+
+def _one_attendance_per_voter(conn, cursor):
+    # Gives INSERT IGNORE INTO attendance something to ignore
+    if 'id' not in _columns(cursor, "attendance"):
+        cursor.execute("ALTER TABLE attendance ADD COLUMN id INT AUTO_INCREMENT PRIMARY KEY FIRST")
+    if not _has_index(cursor, "attendance", "uq_attendance_election_voter"):
+        # Keep the first attendance row of each voter, then enforce uniqueness
+        cursor.execute("""
+            DELETE a1 FROM attendance a1
+            JOIN attendance a2 ON a1.election_id = a2.election_id AND a1.voter_email = a2.voter_email AND a1.id > a2.id
+        """)
+        if cursor.rowcount:
+            print(f"Removed {cursor.rowcount} duplicate attendance rows before adding the one-row-per-voter key.")
+        _add_index(cursor, "attendance", "uq_attendance_election_voter", ["election_id", "voter_email"], unique=True)
+
+def _hot_path_indexes(conn, cursor):
+    # get_election_candidates / results: candidates by election (legacy ALTER-added column had no index)
+    _add_index(cursor, "candidates", "idx_candidates_election", ["election_id"])
+    # get_election_results: votes grouped per candidate within an election
+    _add_index(cursor, "votes", "idx_votes_election_candidate", ["election_id", "candidate_id"])
+    # get_org_elections / get_org_employees
+    _add_index(cursor, "elections", "idx_elections_org", ["org_id"])
+    _add_index(cursor, "voters", "idx_voters_org", ["org_id"])
+
+def migrate_embedding_blobs(conn, cursor, batch_size=EMBEDDING_MIGRATION_BATCH):
+    """
+    Rewrites legacy pickled voters.face_embedding values into the binary codec
+    format, batch by batch (one commit per batch). Rows already in the new format
+    are left alone, so it is safe to re-run. updated_at is preserved so gallery
+    caches don't resync every voter.
+    """
+    from vision.embedding_codec import is_encoded, decode_embedding, encode_embedding
+
+    migrated = 0
+    last_id = 0
+    while True:
+        cursor.execute(
+            "SELECT id, face_embedding FROM voters WHERE id > %s AND face_embedding IS NOT NULL ORDER BY id LIMIT %s",
+            (last_id, batch_size)
+        )
+        rows = cursor.fetchall()
+        if not rows:
+            break
+        last_id = rows[-1][0]
+
+        updates = []
+        for voter_id, blob in rows:
+            if is_encoded(blob):
+                continue
+            try:
+                updates.append((encode_embedding(decode_embedding(blob), model_name=FACE_MODEL_NAME, dtype=EMBEDDING_DTYPE), voter_id))
+            except Exception as e:
+                print(f"Skipping unreadable embedding for voter {voter_id}: {e}")
+        if updates:
+            cursor.executemany(
+                "UPDATE voters SET face_embedding=%s, updated_at=updated_at WHERE id=%s",
+                updates
+            )
+            conn.commit()
+            migrated += len(updates)
+
+    if migrated:
+        print(f"Migrated {migrated} face embeddings to the binary format.")
+
+def _vote_tallies(conn, cursor):
+    # Incrementally maintained per-candidate counters (sharded to spread row locks)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS vote_tallies(
+        election_id INT NOT NULL,
+        candidate_id INT NOT NULL,
+        shard SMALLINT NOT NULL DEFAULT 0,
+        count BIGINT NOT NULL DEFAULT 0,
+        PRIMARY KEY (election_id, candidate_id, shard),
+        FOREIGN KEY (election_id) REFERENCES elections(id),
+        FOREIGN KEY (candidate_id) REFERENCES candidates(id)
+    )
+    """)
+    # Backfill from existing votes
+    cursor.execute("DELETE FROM vote_tallies")
+    cursor.execute("""
+        INSERT INTO vote_tallies(election_id, candidate_id, shard, count)
+        SELECT election_id, candidate_id, 0, COUNT(*) FROM votes
+        WHERE election_id IS NOT NULL AND candidate_id IS NOT NULL
+        GROUP BY election_id, candidate_id
+    """)
+
+def _admin_table_indexes(conn, cursor):
+    # Keyset pages of attendance: newest first within an election (InnoDB appends id)
+    _add_index(cursor, "attendance", "idx_attendance_election_time", ["election_id", "timestamp"])
+
+# Ordered: (version, description, apply(conn, cursor)). Append only - never renumber.
+MIGRATIONS = [
+    (1, "Base schema", _base_schema),
+    (2, "Legacy face_embedding / election_id columns", _legacy_columns),
+    (3, "voters.updated_at gallery high-water mark", _voters_updated_at),
+    (4, "votes primary key + one vote per voter per election", _one_vote_per_voter),
+    (5, "attendance primary key + one row per voter per election", _one_attendance_per_voter),
+    (6, "Hot-path indexes", _hot_path_indexes),
+    (7, "Binary face embedding format", migrate_embedding_blobs),
+    (8, "vote_tallies counters", _vote_tallies),
+    (9, "Attendance keyset pagination index", _admin_table_indexes),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+# --- Runner ---
+
+def current_version(cursor):
+    """Highest applied migration, 0 for a fresh database."""
+    cursor.execute(
+        "SELECT 1 FROM information_schema.TABLES WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'schema_migrations'"
+    )
+    if cursor.fetchone() is None:
+        return 0
+    cursor.execute("SELECT COALESCE(MAX(version), 0) FROM schema_migrations")
+    return cursor.fetchone()[0]
+
+def _apply_pending(conn, cursor, migrations, version):
+    applied = []
+    for number, description, apply in migrations:
+        if number <= version:
+            continue
+        print(f"Applying migration {number}: {description}")
+        apply(conn, cursor)
+        cursor.execute(
+            "INSERT INTO schema_migrations(version, description) VALUES(%s, %s)",
+            (number, description)
+        )
+        conn.commit()
+        applied.append(number)
+    return applied
+
+def run_migrations(conn):
+    """
+    Applies pending migrations in order on `conn` (connected to the app database).
+    Returns the list of versions applied (empty when already up to date).
+    """
+    cursor = conn.cursor()
+    try:
+        if current_version(cursor) >= LATEST_VERSION:
+            return []
+
+        # Serialize concurrent deploys/workers on a server-side advisory lock
+        cursor.execute("SELECT GET_LOCK(%s, 120)", (MIGRATION_LOCK,))
+        if cursor.fetchone()[0] != 1:
+            raise RuntimeError("Timed out waiting for the schema migration lock")
+        try:
+            cursor.execute("""
+            CREATE TABLE IF NOT EXISTS schema_migrations(
+                version INT PRIMARY KEY,
+                description VARCHAR(255),
+                applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+            """)
+            return _apply_pending(conn, cursor, MIGRATIONS, current_version(cursor))
+        finally:
+            cursor.execute("SELECT RELEASE_LOCK(%s)", (MIGRATION_LOCK,))
+            cursor.fetchall()
+    finally:
+        cursor.close()
+
+
+# --- SQLite ---
+
+def _sqlite_schema(conn, cursor):
+    # MySQL schema as of migration 9, in SQLite types. AUTOINCREMENT keeps ids
+    # increasing (never reused), like AUTO_INCREMENT, for keyset pagination.
+    from database.backends import SQLITE_NOW
+
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS organizations(
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name VARCHAR(255) UNIQUE,
+        type VARCHAR(50)
+    )
+    """)
+    cursor.execute(f"""
+    CREATE TABLE IF NOT EXISTS voters(
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name VARCHAR(255),
+        email VARCHAR(255) UNIQUE,
+        password VARCHAR(255),
+        username VARCHAR(255) UNIQUE,
+        role VARCHAR(50),
+        org_id INT REFERENCES organizations(id),
+        face_embedding BLOB,
+        updated_at TIMESTAMP DEFAULT ({SQLITE_NOW})
+    )
+    """)
+    # ON UPDATE CURRENT_TIMESTAMP equivalent for the gallery high-water mark
+    cursor.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS trg_voters_updated_at
+    AFTER UPDATE OF name, email, password, username, role, org_id, face_embedding ON voters
+    BEGIN
+        UPDATE voters SET updated_at = {SQLITE_NOW} WHERE id = NEW.id;
+    END
+    """)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS elections(
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name VARCHAR(255),
+        org_id INT REFERENCES organizations(id),
+        status VARCHAR(50) DEFAULT 'Active'
+    )
+    """)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS candidates(
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name VARCHAR(255),
+        org_id INT REFERENCES organizations(id),
+        election_id INT REFERENCES elections(id)
+    )
+    """)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS votes(
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        voter_email VARCHAR(255),
+        candidate_id INT REFERENCES candidates(id),
+        org_id INT REFERENCES organizations(id),
+        election_id INT REFERENCES elections(id)
+    )
+    """)
+    cursor.execute(f"""
+    CREATE TABLE IF NOT EXISTS attendance(
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        voter_email VARCHAR(255),
+        org_id INT REFERENCES organizations(id),
+        election_id INT REFERENCES elections(id),
+        timestamp TIMESTAMP DEFAULT ({SQLITE_NOW})
+    )
+    """)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS vote_tallies(
+        election_id INT NOT NULL REFERENCES elections(id),
+        candidate_id INT NOT NULL REFERENCES candidates(id),
+        shard SMALLINT NOT NULL DEFAULT 0,
+        count BIGINT NOT NULL DEFAULT 0,
+        PRIMARY KEY (election_id, candidate_id, shard)
+    )
+    """)
+    for statement in (
+        "CREATE INDEX IF NOT EXISTS idx_voters_updated_at ON voters(updated_at)",
+        "CREATE INDEX IF NOT EXISTS idx_voters_org ON voters(org_id)",
+        "CREATE INDEX IF NOT EXISTS idx_elections_org ON elections(org_id)",
+        "CREATE INDEX IF NOT EXISTS idx_candidates_election ON candidates(election_id)",
+        "CREATE UNIQUE INDEX IF NOT EXISTS uq_votes_election_voter ON votes(election_id, voter_email)",
+        "CREATE INDEX IF NOT EXISTS idx_votes_election_candidate ON votes(election_id, candidate_id)",
+        "CREATE UNIQUE INDEX IF NOT EXISTS uq_attendance_election_voter ON attendance(election_id, voter_email)",
+        # SQLite doesn't append the primary key to secondary indexes the way InnoDB does
+        "CREATE INDEX IF NOT EXISTS idx_attendance_election_time ON attendance(election_id, timestamp, id)",
+    ):
+        cursor.execute(statement)
+
+SQLITE_MIGRATIONS = [
+    (1, "Base schema (MySQL schema version 9)", _sqlite_schema),
+]
+
+SQLITE_LATEST_VERSION = SQLITE_MIGRATIONS[-1][0]
+
+def sqlite_current_version(cursor):
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'schema_migrations'")
+    if cursor.fetchone() is None:
+        return 0
+    cursor.execute("SELECT COALESCE(MAX(version), 0) FROM schema_migrations")
+    return cursor.fetchone()[0]
+
+def run_sqlite_migrations(conn):
+    """run_migrations() for the SQLite backend; the write lock serializes concurrent processes."""
+    cursor = conn.cursor()
+    try:
+        if sqlite_current_version(cursor) >= SQLITE_LATEST_VERSION:
+            return []
+        conn.begin()
+        try:
+            cursor.execute("""
+            CREATE TABLE IF NOT EXISTS schema_migrations(
+                version INTEGER PRIMARY KEY,
+                description VARCHAR(255),
+                applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+            """)
+            return _apply_pending(conn, cursor, SQLITE_MIGRATIONS, sqlite_current_version(cursor))
+        except Exception:
+            conn.rollback()
+            raise
+    finally:
+        cursor.close()
+
+
+if __name__ == "__main__":
+    from database.db import init_db
+    init_db()
@@ -0,0 +1,123 @@
+import threading
+import time
+from collections import deque
+
+
+class PoolTimeout(Exception):
+    """Raised when no connection becomes free within the pool timeout."""
+
+
+class ConnectionPool:
+    """
+    Small thread-safe connection pool shared by every Streamlit session in the process.
+
+    - Connections are created lazily by `factory` (up to `size` of them) and reused.
+    - Idle connections are health-checked with a ping before reuse once they have
+      been idle longer than `ping_interval` seconds; dead ones are replaced.
+    - When all connections are busy, callers wait up to `timeout` seconds.
+    """
+
+    def __init__(self, factory, size=5, timeout=10, ping_interval=30):
+        self.factory = factory
+        self.size = size
+        self.timeout = timeout
+        self.ping_interval = ping_interval
+
+        self._idle = deque()  # (conn, last_used) - LIFO so hot connections stay hot
+        self._open = 0
+        self._cond = threading.Condition()
+
+        # Counters, handy for diagnostics
+        self.created = 0
+        self.reused = 0
+        self.discarded = 0
+
+    def acquire(self):
+        deadline = time.monotonic() + self.timeout
+        with self._cond:
+            while True:
+                if self._idle:
+                    conn, last_used = self._idle.pop()
+                    break
+                if self._open < self.size:
+                    self._open += 1
+                    conn, last_used = None, None
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise PoolTimeout(f"No free database connection after {self.timeout}s (pool size {self.size})")
+                self._cond.wait(remaining)
+
+        # Connect / health-check outside the lock so slow handshakes don't block the pool
+        if conn is not None:
+            if time.monotonic() - last_used < self.ping_interval or self._is_alive(conn):
+                with self._cond:
+                    self.reused += 1
+                return conn
+            self._close_quietly(conn)
+            with self._cond:
+                self.discarded += 1
+
+        try:
+            conn = self.factory()
+        except Exception:
+            with self._cond:
+                self._open -= 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            self.created += 1
+        return conn
+
+    def release(self, conn, broken=False):
+        if not broken:
+            try:
+                if conn.in_transaction:
+                    conn.rollback()
+            except Exception:
+                broken = True
+
+        with self._cond:
+            if broken:
+                self._open -= 1
+                self.discarded += 1
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+        if broken:
+            self._close_quietly(conn)
+
+    def close_all(self):
+        with self._cond:
+            idle = list(self._idle)
+            self._idle.clear()
+            self._open -= len(idle)
+        for conn, _ in idle:
+            self._close_quietly(conn)
+
+    def stats(self):
+        with self._cond:
+            return {
+                "size": self.size,
+                "open": self._open,
+                "idle": len(self._idle),
+                "created": self.created,
+                "reused": self.reused,
+                "discarded": self.discarded,
+            }
+
+    @staticmethod
+    def _is_alive(conn):
+        try:
+            conn.ping(reconnect=False)
+            return True
+        except Exception:
+            return False
+
+    @staticmethod
+    def _close_quietly(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
@@ -0,0 +1,49 @@
+"""
+Reconciliation job for the vote_tallies counters.
+
+    python -m database.reconcile_tallies [--election ID] [--check-only]
+
+Compares each election's counters with a full count of the votes table and
+rebuilds the ones that drifted (or all of them with --force).
+"""
+import argparse
+import sys
+
+from database.db import check_tallies, rebuild_tallies, get_all_election_ids
+
+
+def reconcile(election_ids, check_only=False, force=False):
+    """Returns the number of elections whose tallies were (or would be) rebuilt."""
+    fixed = 0
+    for election_id in election_ids:
+        drift = check_tallies(election_id)
+        if drift is None:
+            print(f"election {election_id}: check failed")
+            continue
+        for row in drift:
+            print(f"election {election_id}: candidate {row['candidate_id']} tally={row['tally']} votes={row['actual']}")
+        if not drift and not force:
+            continue
+        if check_only:
+            fixed += 1
+        elif rebuild_tallies(election_id):
+            print(f"election {election_id}: rebuilt")
+            fixed += 1
+    return fixed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check / rebuild vote tallies from the votes table.")
+    parser.add_argument("--election", type=int, help="only this election (default: all)")
+    parser.add_argument("--check-only", action="store_true", help="report drift without rewriting")
+    parser.add_argument("--force", action="store_true", help="rebuild even when counters agree")
+    args = parser.parse_args(argv)
+
+    election_ids = [args.election] if args.election else get_all_election_ids()
+    fixed = reconcile(election_ids, check_only=args.check_only, force=args.force)
+    print(f"{len(election_ids)} elections checked, {fixed} {'drifted' if args.check_only else 'rebuilt'}.")
+    return 1 if args.check_only and fixed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
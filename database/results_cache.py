@@ -0,0 +1,60 @@
+import threading
+import time
+
+from metrics import timed
+
+
+class ResultsCache:
+    """
+    One shared results snapshot per election for all admin sessions in the process.
+
+    A snapshot is re-queried only when it is older than `ttl` seconds or when the
+    election's vote version (bumped by cast_vote in this process) has changed.
+    Refreshes are single-flight per election: concurrent viewers wait for one
+    query instead of each running their own.
+
+    fetch(election_id) -> results rows
+    version_of(election_id) -> int, changes whenever a vote is recorded
+    """
+
+    def __init__(self, fetch, ttl=2.0, version_of=None):
+        self.fetch = fetch
+        self.ttl = ttl
+        self.version_of = version_of or (lambda election_id: 0)
+        self._entries = {}   # election_id -> (results, fetched_at, version)
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+        self.queries = 0
+
+    def _lock_for(self, election_id):
+        with self._locks_lock:
+            return self._locks.setdefault(election_id, threading.Lock())
+
+    def _is_fresh(self, entry, election_id):
+        if entry is None:
+            return False
+        _, fetched_at, version = entry
+        return time.monotonic() - fetched_at < self.ttl and version == self.version_of(election_id)
+
+    @timed("results_cache.get")
+    def get(self, election_id):
+        """Returns (results, age_seconds)."""
+        entry = self._entries.get(election_id)
+        if not self._is_fresh(entry, election_id):
+            with self._lock_for(election_id):
+                entry = self._entries.get(election_id)
+                if not self._is_fresh(entry, election_id):
+                    # Read the version first so a vote landing mid-query triggers another refresh
+                    version = self.version_of(election_id)
+                    results = self.fetch(election_id)
+                    self.queries += 1
+                    entry = (results, time.monotonic(), version)
+                    self._entries[election_id] = entry
+        results, fetched_at, _ = entry
+        return results, time.monotonic() - fetched_at
+
+    def invalidate(self, election_id=None):
+        if election_id is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(election_id, None)
@@ -0,0 +1,162 @@
+"""
+Group-commit vote writer.
+
+With VOTE_WRITER_ENABLED, sessions don't commit their own vote: they queue it
+and a single background thread writes whatever has queued up as one
+transaction (cast_votes_batch), then hands each caller its own result. During
+an opening-minute burst hundreds of votes share one commit/fsync instead of
+paying for one each.
+
+The queue is bounded: when it is full, callers get VOTE_BUSY after
+VOTE_ENQUEUE_TIMEOUT instead of growing memory without limit.
+"""
+import atexit
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+
+from config import VOTE_BATCH_SIZE, VOTE_BATCH_WAIT, VOTE_QUEUE_SIZE, VOTE_ENQUEUE_TIMEOUT, VOTE_RESULT_TIMEOUT
+from database.db import cast_votes_batch, VOTE_FAILED
+from metrics import timed
+
+# Queue full / no answer in time: the voter should retry
+VOTE_BUSY = "busy"
+
+_STOP = object()
+
+
+class VoteWriter:
+    """
+    write_batch(votes) -> list of statuses, one per (email, candidate_id, org_id, election_id).
+    """
+
+    def __init__(self, write_batch=cast_votes_batch, max_batch=VOTE_BATCH_SIZE, max_wait=VOTE_BATCH_WAIT,
+                 queue_size=VOTE_QUEUE_SIZE):
+        self.write_batch = write_batch
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = None
+        self._lock = threading.Lock()
+        self._abandon = False          # set by close() when the stop marker doesn't fit in time
+        self.batches = 0
+        self.votes = 0
+        self.largest_batch = 0
+        self.rejected = 0
+
+    # --- Callers ---
+
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._abandon = False
+                self._thread = threading.Thread(target=self._run, name="vote-writer", daemon=True)
+                self._thread.start()
+        return self
+
+    def submit(self, email, candidate_id, org_id, election_id, timeout=VOTE_ENQUEUE_TIMEOUT):
+        """Queues a vote. Returns a Future resolving to a VOTE_* status (VOTE_BUSY if the queue stayed full)."""
+        future = Future()
+        try:
+            self._queue.put(((email, candidate_id, org_id, election_id), future), timeout=timeout)
+        except queue.Full:
+            self.rejected += 1
+            future.set_result(VOTE_BUSY)
+        return future
+
+    @timed("vote_writer.cast")
+    def cast(self, email, candidate_id, org_id, election_id, timeout=VOTE_RESULT_TIMEOUT):
+        """Drop-in for cast_vote(): queues the vote and waits for its batch to commit."""
+        future = self.submit(email, candidate_id, org_id, election_id)
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeout:
+            # Still queued or committing - the vote may yet be recorded
+            return VOTE_BUSY
+
+    def close(self, timeout=5):
+        """
+        Writes out everything already queued, then stops the thread - waiting at
+        most `timeout` seconds in total. If the writer is stuck (e.g. on the
+        database) with a full queue, it is told to stop after its current batch
+        and whatever is still queued is left unwritten (those callers get VOTE_BUSY).
+        """
+        with self._lock:
+            thread = self._thread
+        if thread is None or not thread.is_alive():
+            return
+        deadline = time.monotonic() + timeout
+        try:
+            self._queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            self._abandon = True
+            print(f"Vote writer still busy after {timeout}s; {self._queue.qsize()} queued votes not written")
+            return
+        thread.join(max(0.0, deadline - time.monotonic()))
+
+    def stats(self):
+        return {
+            "queued": self._queue.qsize(),
+            "batches": self.batches,
+            "votes": self.votes,
+            "avg_batch": round(self.votes / self.batches, 1) if self.batches else 0,
+            "largest_batch": self.largest_batch,
+            "rejected": self.rejected,
+        }
+
+    # --- Writer thread ---
+
+    def _run(self):
+        stopping = False
+        while not stopping and not self._abandon:
+            item = self._queue.get()
+            if item is _STOP:
+                break
+            batch = [item]
+            # Whatever queued while the last batch was committing goes in now;
+            # then wait up to max_wait for more before committing a partial batch
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    try:
+                        item = self._queue.get(timeout=remaining)
+                    except queue.Empty:
+                        break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            self._flush(batch)
+
+    def _flush(self, batch):
+        votes = [vote for vote, _ in batch]
+        try:
+            statuses = self.write_batch(votes)
+        except Exception as e:
+            print(f"Vote writer batch failed: {e}")
+            statuses = [VOTE_FAILED] * len(batch)
+        self.batches += 1
+        self.votes += len(batch)
+        self.largest_batch = max(self.largest_batch, len(batch))
+        for (_, future), status in zip(batch, statuses):
+            future.set_result(status)
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+def get_vote_writer():
+    """Process-wide VoteWriter, started on first use and drained at exit."""
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = VoteWriter().start()
+                atexit.register(_writer.close)
+    return _writer
@@ -0,0 +1,353 @@
+"""
+Lightweight in-process instrumentation for the db / vision hot paths.
+
+    @timed("db.cast_vote")              # one function
+    instrument_module(globals(), "db")  # every public function of a module
+    with timer("db.commit"): ...        # a block
+
+Each instrumented call records its latency in a histogram, plus errors, rows
+(list results) and blob bytes (bytes in the result). The registry is per
+process and can be read three ways:
+  - snapshot() for the admin performance panel,
+  - render_prometheus() text, served over HTTP (METRICS_HTTP_PORT, local only
+    by default: METRICS_HTTP_HOST) and/or written to a file (METRICS_FILE) by
+    start_exporter(),
+  - profile captures: profile_next(n) arms cProfile + tracemalloc for the next
+    n capture() blocks (e.g. one vote verification) and keeps the reports.
+"""
+import bisect
+import cProfile
+import functools
+import inspect
+import io
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+from collections import deque
+from contextlib import contextmanager
+
+from config import METRICS_ENABLED, METRICS_HTTP_PORT, METRICS_HTTP_HOST, METRICS_FILE, METRICS_FILE_INTERVAL
+
+# Latency buckets, seconds
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class _Stat:
+    __slots__ = ("count", "total", "errors", "rows", "bytes", "buckets")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.errors = 0
+        self.rows = 0
+        self.bytes = 0
+        self.buckets = [0] * (len(BUCKETS) + 1)    # last one is +Inf
+
+    def quantile(self, q):
+        """Upper bucket bound containing quantile q (histogram estimate)."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, n in zip(BUCKETS + (float("inf"),), self.buckets):
+            seen += n
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+
+_stats = {}
+_collectors = {}
+_lock = threading.Lock()
+
+
+def observe(name, seconds, error=False, rows=0, nbytes=0):
+    with _lock:
+        stat = _stats.get(name)
+        if stat is None:
+            stat = _stats[name] = _Stat()
+        stat.count += 1
+        stat.total += seconds
+        stat.buckets[bisect.bisect_left(BUCKETS, seconds)] += 1
+        stat.errors += error
+        stat.rows += rows
+        stat.bytes += nbytes
+
+
+def _payload(result):
+    """(rows, bytes) of a return value: list length, and bytes blobs at top level / in row dicts."""
+    if isinstance(result, (bytes, bytearray, memoryview)):
+        return 0, len(result)
+    if isinstance(result, dict):
+        return 0, sum(len(v) for v in result.values() if isinstance(v, (bytes, bytearray)))
+    if isinstance(result, list):
+        rows = len(result)
+        if rows and isinstance(result[0], dict) and any(isinstance(v, (bytes, bytearray)) for v in result[0].values()):
+            return rows, sum(len(v) for row in result for v in row.values() if isinstance(v, (bytes, bytearray)))
+        return rows, 0
+    return 0, 0
+
+
+@contextmanager
+def timer(name):
+    """Times a block (errors counted when it raises)."""
+    if not METRICS_ENABLED:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        observe(name, time.perf_counter() - start, error=True)
+        raise
+    observe(name, time.perf_counter() - start)
+
+
+def timed(name=None):
+    """Decorator: latency / errors / rows / bytes of every call."""
+    def decorate(fn):
+        if not METRICS_ENABLED or inspect.isgeneratorfunction(inspect.unwrap(fn)):
+            # Generators / context managers would only be timed up to their first yield
+            return fn
+        label = name or f"{fn.__module__}.{fn.__qualname__}"
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                result = fn(*args, **kwargs)
+            except Exception:
+                observe(label, time.perf_counter() - start, error=True)
+                raise
+            rows, nbytes = _payload(result)
+            observe(label, time.perf_counter() - start, rows=rows, nbytes=nbytes)
+            return result
+
+        wrapper.__wrapped_by_metrics__ = True
+        return wrapper
+    return decorate
+
+
+def instrument_module(namespace, prefix, exclude=()):
+    """
+    Wraps every public function defined in a module (call at the bottom of the
+    module with globals()). Imported names and private helpers are left alone,
+    as are the names in `exclude` (tiny per-frame helpers, where the timing and
+    lock would cost more than the call).
+    """
+    module = namespace.get("__name__")
+    for attr, value in list(namespace.items()):
+        if (attr.startswith("_") or attr in exclude or not inspect.isfunction(value) or value.__module__ != module
+                or getattr(value, "__wrapped_by_metrics__", False)):
+            continue
+        namespace[attr] = timed(f"{prefix}.{attr}")(value)
+
+
+def register_collector(name, fn):
+    """fn() -> {metric: number}; sampled as gauges at export time (pool / queue sizes ...)."""
+    _collectors[name] = fn
+
+
+# --- Reading ---
+
+def snapshot():
+    """Per-function summary rows, slowest total time first."""
+    with _lock:
+        items = list(_stats.items())
+        rows = []
+        for name, s in items:
+            rows.append({
+                "function": name,
+                "calls": s.count,
+                "errors": s.errors,
+                "avg_ms": round(1000 * s.total / s.count, 2) if s.count else None,
+                "p50_ms": _ms(s.quantile(0.50)),
+                "p95_ms": _ms(s.quantile(0.95)),
+                "p99_ms": _ms(s.quantile(0.99)),
+                "total_s": round(s.total, 3),
+                "rows": s.rows,
+                "bytes": s.bytes,
+            })
+    rows.sort(key=lambda r: r["total_s"], reverse=True)
+    return rows
+
+
+def _ms(bound):
+    if bound is None:
+        return None
+    return "inf" if bound == float("inf") else round(1000 * bound, 1)
+
+
+def _gauges():
+    gauges = {}
+    for source, fn in list(_collectors.items()):
+        try:
+            values = fn() or {}
+        except Exception:
+            continue
+        for key, value in values.items():
+            if isinstance(value, bool):
+                value = int(value)
+            if isinstance(value, (int, float)):
+                gauges[f"{source}_{key}"] = value
+    return gauges
+
+
+def render_prometheus():
+    """Prometheus text exposition format (v0.0.4)."""
+    def label(name):
+        return name.replace("\\", "\\\\").replace('"', '\\"')
+
+    lines = [
+        "# HELP app_call_duration_seconds Latency of instrumented db / vision calls.",
+        "# TYPE app_call_duration_seconds histogram",
+    ]
+    with _lock:
+        items = sorted((name, s.count, s.total, s.errors, s.rows, s.bytes, list(s.buckets)) for name, s in _stats.items())
+    for name, count, total, errors, rows, nbytes, buckets in items:
+        cumulative = 0
+        for bound, n in zip(BUCKETS + (float("inf"),), buckets):
+            cumulative += n
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            lines.append(f'app_call_duration_seconds_bucket{{fn="{label(name)}",le="{le}"}} {cumulative}')
+        lines.append(f'app_call_duration_seconds_sum{{fn="{label(name)}"}} {total:.6f}')
+        lines.append(f'app_call_duration_seconds_count{{fn="{label(name)}"}} {count}')
+    for metric, index, help_text in (("app_call_errors_total", 3, "Calls that raised."),
+                                     ("app_call_rows_total", 4, "Rows returned (list results)."),
+                                     ("app_call_bytes_total", 5, "Blob bytes returned.")):
+        lines.append(f"# HELP {metric} {help_text}")
+        lines.append(f"# TYPE {metric} counter")
+        for item in items:
+            lines.append(f'{metric}{{fn="{label(item[0])}"}} {item[index]}')
+    gauges = _gauges()
+    if gauges:
+        lines.append("# HELP app_gauge Sampled component stats (connection pool, queues, gallery).")
+        lines.append("# TYPE app_gauge gauge")
+        for key, value in sorted(gauges.items()):
+            lines.append(f'app_gauge{{name="{label(key)}"}} {value}')
+    return "\n".join(lines) + "\n"
+
+
+def reset():
+    with _lock:
+        _stats.clear()
+
+
+# --- Export ---
+
+_exporter_started = False
+
+def _serve_http(host, port):
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = render_prometheus().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True, name="metrics-http").start()
+    return server
+
+
+def _write_file_loop(path, interval):
+    while True:
+        time.sleep(interval)
+        try:
+            tmp = f"{path}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                f.write(render_prometheus())
+            os.replace(tmp, path)
+        except OSError as e:
+            print(f"Error writing metrics file: {e}")
+
+
+def start_exporter(http_port=METRICS_HTTP_PORT, path=METRICS_FILE, interval=METRICS_FILE_INTERVAL,
+                   http_host=METRICS_HTTP_HOST):
+    """Starts the configured exporters once per process (HTTP /metrics and/or a text file)."""
+    global _exporter_started
+    with _lock:
+        if _exporter_started or not METRICS_ENABLED:
+            return
+        _exporter_started = True
+    if http_port:
+        try:
+            _serve_http(http_host, http_port)
+        except OSError as e:
+            print(f"Metrics HTTP endpoint not started on {http_host}:{http_port}: {e}")
+    if path:
+        threading.Thread(target=_write_file_loop, args=(path, interval), daemon=True, name="metrics-file").start()
+
+
+# --- Opt-in profiling ---
+
+_profile_budget = 0
+profiles = deque(maxlen=10)     # most recent capture reports
+
+
+def profile_next(count=1):
+    """Arms cProfile + tracemalloc for the next `count` capture() blocks (any session)."""
+    global _profile_budget
+    with _lock:
+        _profile_budget = count
+
+
+def _take_profile_slot():
+    global _profile_budget
+    with _lock:
+        if _profile_budget <= 0:
+            return False
+        _profile_budget -= 1
+        return True
+
+
+@contextmanager
+def capture(label, top=25):
+    """
+    Profiles the block if profile_next() armed it; otherwise costs one lock check.
+    cProfile covers this thread only; tracemalloc is process-wide, so allocations
+    of concurrent requests show up in the memory report too.
+    """
+    if not _take_profile_slot():
+        yield
+        return
+    profiler = cProfile.Profile()
+    started_tracemalloc = not tracemalloc.is_tracing()
+    if started_tracemalloc:
+        tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    start = time.perf_counter()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        elapsed = time.perf_counter() - start
+        after = tracemalloc.take_snapshot()
+        peak = tracemalloc.get_traced_memory()[1]
+        if started_tracemalloc:
+            tracemalloc.stop()
+
+        out = io.StringIO()
+        pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(top)
+        allocations = [str(stat) for stat in after.compare_to(before, "lineno")[:top]]
+        profiles.appendleft({
+            "label": label,
+            "at": time.strftime("%H:%M:%S"),
+            "seconds": round(elapsed, 3),
+            "peak_bytes": peak,
+            "cprofile": out.getvalue(),
+            "allocations": allocations,
+        })
@@ -0,0 +1,344 @@
+import json
+import os
+import threading
+
+import numpy as np
+
+from metrics import timed
+from vision.face_index import FaceIndex, MATCH_THRESHOLD, _normalize
+
+
+def _spherical_kmeans(vectors, k, iters=10, seed=0, chunk=8192):
+    """
+    k-means on L2-normalized rows using cosine similarity (coarse quantizer).
+    Returns a (k, dim) float32 matrix of normalized centroids.
+    """
+    rng = np.random.default_rng(seed)
+    n = vectors.shape[0]
+    centroids = vectors[rng.choice(n, size=k, replace=False)].copy()
+
+    for _ in range(iters):
+        sums = np.zeros_like(centroids)
+        counts = np.zeros(k, dtype=np.int64)
+        for start in range(0, n, chunk):
+            block = vectors[start:start + chunk]
+            assign = np.argmax(block @ centroids.T, axis=1)
+            np.add.at(sums, assign, block)
+            counts += np.bincount(assign, minlength=k)
+
+        empty = counts == 0
+        if empty.any():
+            # Re-seed empty clusters with random points
+            sums[empty] = vectors[rng.choice(n, size=int(empty.sum()), replace=False)]
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        centroids = (sums / norms).astype(np.float32)
+    return centroids
+
+
+class IVFIndex:
+    """
+    Approximate nearest-neighbour gallery (IVF-flat), a drop-in for FaceIndex.
+
+    Embeddings are partitioned into `nlist` inverted lists by a spherical k-means
+    coarse quantizer. A query scores the centroids, then searches only the `nprobe`
+    closest lists exactly (each list is a FaceIndex with full vectors), so
+    distances of returned candidates are exact and the 0.40 cosine threshold keeps
+    its meaning; only recall depends on nprobe (higher = slower, more accurate).
+
+    Until the gallery reaches `min_train` faces everything lives in one list,
+    i.e. an exact scan. Inserts after training go to the nearest list; the
+    quantizer is retrained when the gallery has grown `retrain_factor` times.
+
+    That (re)training runs on a background thread rather than inside add(),
+    which the gallery calls under its sync lock. Searches keep using the old
+    centroids and lists until the new ones are swapped in; faces added or
+    removed meanwhile are replayed onto the new lists first. background=False
+    trains inside add() instead (offline builds, benchmarks).
+    """
+
+    def __init__(self, nlist=1024, nprobe=16, min_train=10000, retrain_factor=4, seed=0, background=True):
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.min_train = min_train
+        self.retrain_factor = retrain_factor
+        self.seed = seed
+        self.background = background
+
+        self.dim = None
+        self.trained_size = 0
+        self._view = (None, [FaceIndex()])   # (centroids, lists), swapped as one by a retrain
+        self._list_of = {}             # face_id -> list number
+        self._size = 0
+        self._lock = threading.RLock()
+        self._training = None          # background retrain thread
+        self._changes = None           # face_id -> vector (None: removed) while a retrain runs
+
+    @property
+    def centroids(self):
+        """(nlist, dim) once trained, else None."""
+        return self._view[0]
+
+    @centroids.setter
+    def centroids(self, value):
+        self._view = (value, self._view[1])
+
+    @property
+    def _lists(self):
+        return self._view[1]
+
+    @_lists.setter
+    def _lists(self, value):
+        self._view = (self._view[0], value)
+
+    def __len__(self):
+        return self._size
+
+    def __contains__(self, face_id):
+        return face_id in self._list_of
+
+    @property
+    def is_trained(self):
+        return self.centroids is not None
+
+    @property
+    def is_training(self):
+        return self._training is not None
+
+    def _nearest_list(self, vec):
+        if self.centroids is None:
+            return 0
+        return int(np.argmax(self.centroids @ vec))
+
+    def add(self, face_id, embedding):
+        vec = _normalize(embedding)
+        if vec is None or (self.dim is not None and vec.shape[0] != self.dim):
+            return False
+        with self._lock:
+            self.dim = vec.shape[0]
+
+            target = self._nearest_list(vec)
+            current = self._list_of.get(face_id)
+            if current is not None and current != target:
+                self._lists[current].remove(face_id)
+            if not self._lists[target].add(face_id, vec):
+                return False
+            if current is None:
+                self._size += 1
+            self._list_of[face_id] = target
+            if self._changes is not None:
+                self._changes[face_id] = vec
+
+            if self._needs_training():
+                self._retrain()
+        return True
+
+    def _needs_training(self):
+        if self._training is not None or self._size < self.min_train:
+            return False
+        if not self.is_trained:
+            return True
+        # Grown retrain_factor times, or trained with a different nlist (e.g. restored snapshot)
+        return (self._size >= self.trained_size * self.retrain_factor
+                or len(self._lists) != min(self.nlist, self.trained_size))
+
+    def _retrain(self):
+        if self.background:
+            self.train_async()
+        else:
+            self.train()
+
+    def remove(self, face_id):
+        with self._lock:
+            current = self._list_of.pop(face_id, None)
+            if current is None:
+                return False
+            self._lists[current].remove(face_id)
+            self._size -= 1
+            if self._changes is not None:
+                self._changes[face_id] = None
+            return True
+
+    @timed("ivf_index.train")
+    def train(self, sample_size=None):
+        """
+        (Re)builds the coarse quantizer and redistributes every stored face.
+        Only copying the current vectors and swapping in the result hold the
+        lock; k-means and the redistribution run on the copy.
+        """
+        with self._lock:
+            job = self._begin_training(sample_size)
+        if job is None:
+            return
+        try:
+            built = self._build(*job)
+        except Exception:
+            with self._lock:
+                self._changes = None
+            raise
+        with self._lock:
+            self._install(*built)
+
+    def train_async(self, sample_size=None):
+        """Starts train() on a background thread unless one is already running."""
+        with self._lock:
+            if self._training is not None:
+                return
+            self._training = threading.Thread(target=self._train_in_background, args=(sample_size,),
+                                              daemon=True, name="ivf-train")
+            self._training.start()
+
+    def _train_in_background(self, sample_size):
+        try:
+            self.train(sample_size)
+        except Exception as e:
+            print(f"Error retraining gallery index: {e}")
+        finally:
+            self._training = None
+
+    def _begin_training(self, sample_size):
+        """Under the lock: training sample + a copy of every list; starts recording changes."""
+        nlist = min(self.nlist, self._size)
+        if nlist == 0 or self._changes is not None:
+            # Empty, or another retrain is already in progress
+            return None
+        sample_size = sample_size or min(self._size, nlist * 64)
+
+        # Sample training rows across the existing lists
+        rng = np.random.default_rng(self.seed)
+        matrices = [lst.matrix for lst in self._lists if len(lst)]
+        offsets = np.cumsum([0] + [m.shape[0] for m in matrices])
+        picks = np.sort(rng.choice(self._size, size=sample_size, replace=False))
+        sample = np.empty((sample_size, self.dim), dtype=np.float32)
+        for j, m in enumerate(matrices):
+            sel = picks[(picks >= offsets[j]) & (picks < offsets[j + 1])] - offsets[j]
+            start = np.searchsorted(picks, offsets[j])
+            sample[start:start + len(sel)] = m[sel]
+
+        # Copies: the live lists keep changing (and compacting on remove) while we build
+        stored = [(list(lst.ids), lst.matrix.copy()) for lst in self._lists if len(lst)]
+        self._changes = {}
+        return sample, stored, nlist, self._size
+
+    def _build(self, sample, stored, nlist, size):
+        """Off the lock: new centroids and lists for the copied faces."""
+        centroids = _spherical_kmeans(sample, nlist, seed=self.seed)
+        lists = [FaceIndex(dim=self.dim) for _ in range(nlist)]
+        list_of = {}
+        for ids, matrix in stored:
+            assign = np.argmax(matrix @ centroids.T, axis=1)
+            for face_id, row, target in zip(ids, matrix, assign):
+                lists[target].add(face_id, row)
+                list_of[face_id] = int(target)
+        return centroids, lists, list_of, size
+
+    def _install(self, centroids, lists, list_of, size):
+        """Under the lock: replays changes made during training, then swaps the new lists in."""
+        for face_id, vec in self._changes.items():
+            current = list_of.pop(face_id, None)
+            if current is not None:
+                lists[current].remove(face_id)
+            if vec is not None:
+                target = int(np.argmax(centroids @ vec))
+                lists[target].add(face_id, vec)
+                list_of[face_id] = target
+        self._changes = None
+        self._view = (centroids, lists)
+        self._list_of = list_of
+        self._size = len(list_of)
+        self.trained_size = size
+
+    @staticmethod
+    def _probe_lists(vec, nprobe, centroids, lists):
+        if centroids is None:
+            return [0]
+        nprobe = min(nprobe, len(lists))
+        scores = centroids @ vec
+        return np.argpartition(-scores, nprobe - 1)[:nprobe]
+
+    @timed("ivf_index.search")
+    def search(self, embedding, k=1, nprobe=None):
+        """Top-k over the probed lists, exact distances: [(face_id, distance), ...]."""
+        vec = _normalize(embedding)
+        if vec is None or self._size == 0 or vec.shape[0] != self.dim:
+            return []
+        # One read of the view: a retrain swapping in new lists can't mix old and new
+        centroids, lists = self._view
+        hits = []
+        for i in self._probe_lists(vec, nprobe or self.nprobe, centroids, lists):
+            hits.extend(lists[i].search(vec, k))
+        hits.sort(key=lambda hit: hit[1])
+        return hits[:k]
+
+    @timed("ivf_index.best_match")
+    def best_match(self, embedding, threshold=MATCH_THRESHOLD, nprobe=None):
+        hits = self.search(embedding, k=1, nprobe=nprobe)
+        if not hits:
+            return None, None
+        face_id, dist = hits[0]
+        if dist < threshold:
+            return face_id, dist
+        return None, dist
+
+    # --- Persistence ---
+
+    def save(self, path, meta=None):
+        """Writes the index (and optional JSON-able meta) to one .npz file, atomically."""
+        arrays = {}
+        with self._lock:
+            centroids, lists = self._view
+            for i, lst in enumerate(lists):
+                arrays[f"ids_{i}"] = np.array([str(x) for x in lst.ids], dtype=str)
+                arrays[f"vec_{i}"] = lst.matrix.copy()
+        if centroids is not None:
+            arrays["centroids"] = centroids
+        header = {
+            "nlist": self.nlist, "nprobe": self.nprobe, "min_train": self.min_train,
+            "retrain_factor": self.retrain_factor, "seed": self.seed,
+            "trained_size": self.trained_size, "lists": len(lists),
+            "meta": meta or {},
+        }
+        arrays["header"] = np.array(json.dumps(header, default=str))
+
+        tmp = f"{path}.tmp"
+        with open(tmp, "wb") as f:
+            np.savez(f, **arrays)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path, nprobe=None, background=True, like=None):
+        """
+        Returns (index, meta). like: an index whose settings (nlist, nprobe,
+        min_train, retrain_factor, background) replace the saved ones, e.g. a
+        fresh one built from the current config; if its nlist differs from the
+        snapshot's, the restored index is retrained (in the background).
+        """
+        with np.load(path, allow_pickle=False) as data:
+            header = json.loads(str(data["header"]))
+            if like is not None:
+                settings = {"nlist": like.nlist, "nprobe": like.nprobe, "min_train": like.min_train,
+                            "retrain_factor": like.retrain_factor, "seed": like.seed,
+                            "background": like.background}
+            else:
+                settings = {"nlist": header["nlist"], "nprobe": nprobe or header["nprobe"],
+                            "min_train": header["min_train"], "retrain_factor": header["retrain_factor"],
+                            "seed": header["seed"], "background": background}
+            index = cls(**settings)
+            index.trained_size = header["trained_size"]
+            if "centroids" in data:
+                index.centroids = data["centroids"]
+                index.dim = index.centroids.shape[1]
+            index._lists = []
+            for i in range(header["lists"]):
+                ids, vectors = data[f"ids_{i}"], data[f"vec_{i}"]
+                lst = FaceIndex(dim=vectors.shape[1] if vectors.size else index.dim, capacity=max(len(ids), 1))
+                for face_id, vec in zip(ids.tolist(), vectors):
+                    lst.add(face_id, vec)
+                    index._list_of[face_id] = i
+                    index.dim = vec.shape[0]
+                index._lists.append(lst)
+            index._size = len(index._list_of)
+        with index._lock:
+            if index._needs_training():
+                index._retrain()
+        return index, header["meta"]
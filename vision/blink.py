@@ -1,17 +1,120 @@
-from scipy.spatial import distance
+from collections import deque
+
+import numpy as np
+
+from metrics import instrument_module
+from config import EYE_AR_THRESH, BLINK_EAR_RATIO, BLINK_SMOOTH_FRAMES, BLINK_MIN_FRAMES, BLINK_MAX_FRAMES, BLINK_WINDOW
+
+# MediaPipe Face Mesh landmark ids per eye, in EAR order:
+# p1 (outer corner), p2, p3 (upper lid), p4 (inner corner), p5, p6 (lower lid)
+LEFT_EYE = (362, 385, 387, 263, 373, 380)
+RIGHT_EYE = (33, 160, 158, 133, 153, 144)
+EYE_LANDMARKS = LEFT_EYE + RIGHT_EYE
+
+
+def eye_aspect_ratios(eyes):
+    """
+    Vectorized EAR. eyes: array (..., 6, 2) of (x, y) points in p1..p6 order -
+    one eye, both eyes of a frame, or a whole window (frames, 2, 6, 2).
+    Returns an array of shape (...).
+    """
+    eyes = np.asarray(eyes, dtype=np.float64)
+    # vertical distances p2-p6, p3-p5 and horizontal p1-p4
+    A = np.linalg.norm(eyes[..., 1, :] - eyes[..., 5, :], axis=-1)
+    B = np.linalg.norm(eyes[..., 2, :] - eyes[..., 4, :], axis=-1)
+    C = np.linalg.norm(eyes[..., 0, :] - eyes[..., 3, :], axis=-1)
+    return (A + B) / (2.0 * np.maximum(C, 1e-9))
 
 def eye_aspect_ratio(eye):
-    # compute the euclidean distances between the two sets of
-    # vertical eye landmarks (x, y)-coordinates
-    A = distance.euclidean(eye[1], eye[5])
-    B = distance.euclidean(eye[2], eye[4])
+    # Single eye (6 points), kept for compatibility
+    return float(eye_aspect_ratios(eye))
+
+
+def eyes_from_landmarks(landmarks, width, height):
+    """Face Mesh landmarks (normalized) -> (2, 6, 2) pixel points for left/right eye."""
+    pts = np.array([(landmarks[i].x * width, landmarks[i].y * height) for i in EYE_LANDMARKS])
+    return pts.reshape(2, 6, 2)
+
+
+def blink_threshold(ears, ratio=BLINK_EAR_RATIO, ceiling=EYE_AR_THRESH):
+    """
+    Per-person threshold: a fraction of the open-eye baseline (median EAR - eyes
+    are open most of the time), never above the absolute EYE_AR_THRESH.
+    """
+    ears = np.asarray(ears, dtype=np.float64)
+    if ears.size == 0:
+        return ceiling
+    return min(ceiling, ratio * float(np.median(ears)))
+
+
+def smooth(ears, frames=BLINK_SMOOTH_FRAMES):
+    """Trailing moving average (same length; the first values average what exists)."""
+    ears = np.asarray(ears, dtype=np.float64)
+    if frames <= 1 or ears.size == 0:
+        return ears
+    csum = np.cumsum(np.insert(ears, 0, 0.0))
+    idx = np.arange(1, ears.size + 1)
+    start = np.maximum(idx - frames, 0)
+    return (csum[idx] - csum[start]) / (idx - start)
+
+
+def detect_blinks(ears, threshold=None, smooth_frames=BLINK_SMOOTH_FRAMES,
+                  min_frames=BLINK_MIN_FRAMES, max_frames=BLINK_MAX_FRAMES):
+    """
+    Offline blink detection over a window of per-frame EAR values (mean of both eyes).
+    A blink is a run of smoothed EAR below threshold lasting min_frames..max_frames
+    that ends with the eyes open again. Returns [(start, end)] frame ranges (end exclusive).
+    """
+    ears = np.asarray(ears, dtype=np.float64)
+    if ears.size == 0:
+        return []
+    if threshold is None:
+        threshold = blink_threshold(ears)
+    closed = smooth(ears, smooth_frames) < threshold
+
+    # Run boundaries of `closed`
+    edges = np.diff(np.concatenate(([0], closed.astype(np.int8), [0])))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+    lengths = ends - starts
+    keep = (lengths >= min_frames) & (lengths <= max_frames) & (ends < ears.size)
+    return list(zip(starts[keep].tolist(), ends[keep].tolist()))
+
+
+class BlinkDetector:
+    """
+    Streaming version of detect_blinks() for live frames: push one EAR per frame,
+    get True on the frame a blink completes. The threshold adapts to the last
+    `window` frames.
+    """
+
+    def __init__(self, window=BLINK_WINDOW, smooth_frames=BLINK_SMOOTH_FRAMES,
+                 min_frames=BLINK_MIN_FRAMES, max_frames=BLINK_MAX_FRAMES):
+        self.window = window
+        self.smooth_frames = smooth_frames
+        self.min_frames = min_frames
+        self.max_frames = max_frames
+        self.reset()
+
+    def reset(self):
+        self._ears = deque(maxlen=self.window)
+        self._closed_frames = 0
+        self.threshold = EYE_AR_THRESH
+
+    def push(self, ear):
+        self._ears.append(ear)
+        recent = list(self._ears)[-self.smooth_frames:]
+        value = sum(recent) / len(recent)
+        self.threshold = blink_threshold(self._ears)
 
-    # compute the euclidean distance between the horizontal
-    # eye landmark (x, y)-coordinates
-    C = distance.euclidean(eye[0], eye[3])
+        if value < self.threshold:
+            self._closed_frames += 1
+            return False
+        closed_for, self._closed_frames = self._closed_frames, 0
+        return self.min_frames <= closed_for <= self.max_frames
 
-    # compute the eye aspect ratio
-    ear = (A + B) / (2.0 * C)
 
-    # return the eye aspect ratio
-    return ear
+# Latency / error counters for the public functions above (see metrics.py),
+# except the per-frame helpers the live liveness loop calls on every frame
+instrument_module(globals(), "blink",
+                  exclude=("eye_aspect_ratios", "eye_aspect_ratio", "eyes_from_landmarks", "blink_threshold"))
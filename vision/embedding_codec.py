@@ -0,0 +1,97 @@
+import io
+import pickle
+import struct
+
+import numpy as np
+
+from metrics import instrument_module
+
+# Binary layout of voters.face_embedding (all little-endian):
+#   magic    4s   b"FEMB"
+#   version  u8   format version (1)
+#   dtype    u8   1 = float32, 2 = float16
+#   name_len u8   length of the model name
+#   dim      u32  number of values
+#   model    name_len bytes (utf-8), then zero padding to a 4-byte boundary
+#   data     dim * itemsize bytes
+MAGIC = b"FEMB"
+FORMAT_VERSION = 1
+_HEADER = struct.Struct("<4sBBBI")
+
+_DTYPES = {1: np.dtype("<f4"), 2: np.dtype("<f2")}
+_DTYPE_CODES = {"float32": 1, "float16": 2}
+
+
+def is_encoded(blob):
+    return blob is not None and bytes(blob[:4]) == MAGIC
+
+
+def encode_embedding(embedding, model_name="VGG-Face", dtype="float32"):
+    """Serializes an embedding (list or array) into the compact binary format."""
+    code = _DTYPE_CODES[dtype]
+    values = np.asarray(embedding, dtype=_DTYPES[code]).ravel()
+    model = model_name.encode("utf-8")
+    header = _HEADER.pack(MAGIC, FORMAT_VERSION, code, len(model), values.shape[0]) + model
+    header += b"\0" * (-len(header) % 4)
+    return header + values.tobytes()
+
+
+def read_header(blob):
+    """Returns {version, dtype, model_name, dim, offset} of an encoded blob."""
+    magic, version, code, name_len, dim = _HEADER.unpack_from(blob, 0)
+    if magic != MAGIC:
+        raise ValueError("Not an encoded embedding")
+    if version != FORMAT_VERSION or code not in _DTYPES:
+        raise ValueError(f"Unsupported embedding format (version {version}, dtype {code})")
+    offset = _HEADER.size + name_len
+    offset += -offset % 4
+    return {
+        "version": version,
+        "dtype": _DTYPES[code],
+        "model_name": bytes(blob[_HEADER.size:_HEADER.size + name_len]).decode("utf-8"),
+        "dim": dim,
+        "offset": offset,
+    }
+
+
+def decode_embedding(blob, expected_model=None):
+    """
+    Decodes voters.face_embedding into a 1-D numpy array.
+    Encoded blobs decode zero-copy (read-only view over the bytes); legacy pickled
+    lists are still accepted, through a restricted unpickler.
+    """
+    if not is_encoded(blob):
+        return np.asarray(_safe_unpickle(blob), dtype=np.float32)
+
+    header = read_header(blob)
+    if expected_model and header["model_name"] != expected_model:
+        raise ValueError(f"Embedding was made with {header['model_name']}, expected {expected_model}")
+    return np.frombuffer(blob, dtype=header["dtype"], count=header["dim"], offset=header["offset"])
+
+
+# --- Legacy pickle support ---
+
+# Only what a pickled list of floats / numpy array can reference.
+_ALLOWED_GLOBALS = {
+    ("numpy", "ndarray"),
+    ("numpy", "dtype"),
+    ("numpy.core.multiarray", "_reconstruct"),
+    ("numpy._core.multiarray", "_reconstruct"),
+    ("numpy.core.multiarray", "scalar"),
+    ("numpy._core.multiarray", "scalar"),
+}
+
+
+class _RestrictedUnpickler(pickle.Unpickler):
+    def find_class(self, module, name):
+        if (module, name) in _ALLOWED_GLOBALS:
+            return super().find_class(module, name)
+        raise pickle.UnpicklingError(f"Refusing to load {module}.{name} from an embedding blob")
+
+
+def _safe_unpickle(blob):
+    return _RestrictedUnpickler(io.BytesIO(blob)).load()
+
+
+# Latency / error counters for the public functions above (see metrics.py)
+instrument_module(globals(), "embedding_codec")
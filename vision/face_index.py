@@ -0,0 +1,145 @@
+import numpy as np
+
+from metrics import timed
+
+# VGG-Face + Cosine usually has a threshold around 0.40
+MATCH_THRESHOLD = 0.40
+
+
+def _normalize(vec):
+    vec = np.asarray(vec, dtype=np.float32).ravel()
+    norm = np.linalg.norm(vec)
+    if norm == 0 or not np.isfinite(norm):
+        return None
+    return vec / norm
+
+
+class FaceIndex:
+    """
+    In-memory gallery of face embeddings for fast 1:N matching.
+
+    All embeddings live in one contiguous float32 matrix (one L2-normalized row per
+    identity) with a parallel array of ids, so a lookup is a single matrix-vector
+    product instead of a Python loop over scipy cosine calls.
+
+    Cosine distance is 1 - dot(a, b) on normalized vectors, matching
+    scipy.spatial.distance.cosine.
+    """
+
+    def __init__(self, dim=None, capacity=64):
+        self.dim = dim
+        self._capacity = capacity
+        self._matrix = None if dim is None else np.zeros((capacity, dim), dtype=np.float32)
+        self._ids = np.empty(capacity, dtype=object)
+        self._rows = {}  # id -> row
+        self._size = 0
+
+    @classmethod
+    def from_dict(cls, known_faces_dict):
+        """Builds an index from { 'username': embedding, ... }."""
+        index = cls(capacity=max(len(known_faces_dict), 1))
+        for name, embedding in known_faces_dict.items():
+            index.add(name, embedding)
+        return index
+
+    def __len__(self):
+        return self._size
+
+    def __contains__(self, face_id):
+        return face_id in self._rows
+
+    @property
+    def ids(self):
+        return self._ids[:self._size]
+
+    @property
+    def matrix(self):
+        if self._matrix is None:
+            return np.zeros((0, 0), dtype=np.float32)
+        return self._matrix[:self._size]
+
+    def _grow(self, needed):
+        new_capacity = max(needed, self._capacity * 2)
+        matrix = np.zeros((new_capacity, self.dim), dtype=np.float32)
+        matrix[:self._size] = self._matrix[:self._size]
+        ids = np.empty(new_capacity, dtype=object)
+        ids[:self._size] = self._ids[:self._size]
+        self._matrix, self._ids, self._capacity = matrix, ids, new_capacity
+
+    def add(self, face_id, embedding):
+        """
+        Adds or replaces the embedding for face_id (amortized O(1), no rebuild).
+        Returns False if the embedding is unusable (zero / NaN / wrong size).
+        """
+        vec = _normalize(embedding)
+        if vec is None:
+            return False
+        if self.dim is None:
+            self.dim = vec.shape[0]
+            self._matrix = np.zeros((self._capacity, self.dim), dtype=np.float32)
+        elif vec.shape[0] != self.dim:
+            return False
+
+        row = self._rows.get(face_id)
+        if row is None:
+            if self._size == self._capacity:
+                self._grow(self._size + 1)
+            row = self._size
+            self._size += 1
+            self._rows[face_id] = row
+            self._ids[row] = face_id
+        self._matrix[row] = vec
+        return True
+
+    def remove(self, face_id):
+        """Removes face_id by moving the last row into its slot. Returns True if it was present."""
+        row = self._rows.pop(face_id, None)
+        if row is None:
+            return False
+        last = self._size - 1
+        if row != last:
+            moved_id = self._ids[last]
+            self._matrix[row] = self._matrix[last]
+            self._ids[row] = moved_id
+            self._rows[moved_id] = row
+        self._ids[last] = None
+        self._size -= 1
+        return True
+
+    def distances(self, embedding):
+        """Cosine distance from embedding to every row, in row order."""
+        vec = _normalize(embedding)
+        if vec is None or self._size == 0 or vec.shape[0] != self.dim:
+            return None
+        return 1.0 - self.matrix @ vec
+
+    @timed("face_index.search")
+    def search(self, embedding, k=1):
+        """
+        Returns the k nearest identities as [(face_id, distance), ...], closest first.
+        """
+        dists = self.distances(embedding)
+        if dists is None:
+            return []
+        k = min(k, self._size)
+        if k < self._size:
+            top = np.argpartition(dists, k - 1)[:k]
+        else:
+            top = np.arange(self._size)
+        top = top[np.argsort(dists[top])]
+        return [(self._ids[i], float(dists[i])) for i in top]
+
+    @timed("face_index.best_match")
+    def best_match(self, embedding, threshold=MATCH_THRESHOLD):
+        """
+        Returns (face_id, distance) of the closest identity if it is under threshold,
+        else (None, distance) - distance is None for an empty index.
+        """
+        dists = self.distances(embedding)
+        if dists is None:
+            return None, None
+        i = int(np.argmin(dists))
+        dist = float(dists[i])
+        if dist < threshold:
+            return self._ids[i], dist
+        return None, dist
@@ -1,68 +1,316 @@
 from deepface import DeepFace
+import cv2
 import numpy as np
-import pickle
-from scipy.spatial.distance import cosine
+from collections import deque
+from vision.embedding_codec import decode_embedding
+from vision.face_index import FaceIndex, MATCH_THRESHOLD, _normalize
+from vision.models import get_model_manager
+from vision.inference import InferenceBusy, ModelUnavailable, PRIORITY_VERIFY, PRIORITY_REGISTER
+from metrics import timed, instrument_module
+from config import FACE_EMBED_BATCH_SIZE, FACE_MAX_INPUT_SIDE, INFERENCE_WORKERS_ENABLED
 
 # Note: We no longer load/save from local pickle file.
-# Embeddings are stored in MySQL.
+# Embeddings are stored in MySQL (see vision/embedding_codec.py for the format).
 
-def register(img):
+class VerificationError(Exception):
+    """verify() could not run (database / model error): not a mismatch, the voter should retry."""
+
+def _downscale(img, max_side=FACE_MAX_INPUT_SIDE):
+    """
+    Shrinks img so its longer side is at most max_side (detectors gain nothing
+    from full camera resolution). Returns (img, scale) with scale <= 1.
+    """
+    if not max_side or not hasattr(img, "shape"):
+        return img, 1.0
+    h, w = img.shape[:2]
+    scale = max_side / float(max(h, w))
+    if scale >= 1.0:
+        return img, 1.0
+    return cv2.resize(img, (int(round(w * scale)), int(round(h * scale))), interpolation=cv2.INTER_AREA), scale
+
+def _rescale_area(area, scale):
+    """Maps a facial_area found on the downscaled image back to original pixels."""
+    if not area or scale == 1.0:
+        return area
+    rescaled = {}
+    for key, value in area.items():
+        if key in ("x", "y", "w", "h") and isinstance(value, (int, float)):
+            rescaled[key] = int(round(value / scale))
+        elif isinstance(value, (tuple, list)) and len(value) == 2:
+            # eye coordinates
+            rescaled[key] = tuple(int(round(v / scale)) for v in value)
+        else:
+            rescaled[key] = value
+    return rescaled
+
+def _represent(img, aligned=False, priority=PRIORITY_VERIFY):
+    """
+    Face detection + embedding for one image: in a worker process of the
+    inference pool when INFERENCE_WORKERS_ENABLED (raises InferenceBusy when it
+    is saturated), otherwise inline. See _represent_local() for the result.
+    """
+    if INFERENCE_WORKERS_ENABLED:
+        from vision.inference import get_inference_pool, InferenceError
+        try:
+            return get_inference_pool().represent(img, aligned=aligned, priority=priority)
+        except InferenceError as e:
+            # Same as the inline path: no face / bad image
+            raise ValueError(str(e))
+    return _represent_local(img, aligned=aligned)
+
+@timed("face_recog.inference")
+def _represent_local(img, aligned=False):
+    """
+    Runs face detection + embedding (VGG-Face by default) once, in this process.
+    aligned=True: img is already a face crop (e.g. from the liveness stage), so
+    detection is skipped. Otherwise img is downscaled to FACE_MAX_INPUT_SIDE first.
+    Returns DeepFace's first result {embedding, facial_area, face_confidence} or None;
+    facial_area is in the coordinates of the img passed in.
     """
-    Generates embedding for the face.
+    # Model + detector are loaded once per process (blocks only while a load is in progress)
+    manager = get_model_manager()
+    manager.load()
+
+    if aligned:
+        embedding_objs = DeepFace.represent(img_path = img, model_name = manager.model_name,
+                                            detector_backend = "skip", enforce_detection = False)
+        return embedding_objs[0] if embedding_objs else None
+
+    small, scale = _downscale(img)
+    # DeepFace expects BGR or RGB.
+    embedding_objs = DeepFace.represent(img_path = small, model_name = manager.model_name,
+                                        detector_backend = manager.detector_backend, enforce_detection = True)
+    if embedding_objs:
+        face = embedding_objs[0]
+        face["facial_area"] = _rescale_area(face.get("facial_area"), scale)
+        return face
+    return None
+
+def register(img, aligned=False):
+    """
+    Generates embedding for the face (aligned=True: img is already a face crop).
     Returns: embedding list/array if successful, else None.
     """
     try:
-        # DeepFace expects BGR or RGB.
-        embedding_objs = DeepFace.represent(img_path = img, model_name = "VGG-Face", enforce_detection = True)
-        
-        if embedding_objs:
-            embedding = embedding_objs[0]["embedding"]
-            return embedding
+        face = _represent(img, aligned=aligned, priority=PRIORITY_REGISTER)
+        if face:
+            return face["embedding"]
         return None
+    except (InferenceBusy, ModelUnavailable):
+        raise
     except Exception as e:
         print(f"Error registering face: {e}")
         return None
 
-def recognize(img, known_faces_dict):
+def register_batch(images, batch_size=FACE_EMBED_BATCH_SIZE):
+    """
+    Bulk enrollment: detects a face in each image, then embeds the face crops in
+    stacked batches of `batch_size` (one model forward pass per batch instead of
+    one per person). Images are arrays in the same layout register() gets
+    (np.array of a PIL image).
+
+    Never raises for a single bad image. Returns one dict per input image, in order:
+    {embedding, facial_area, error} - embedding is None and error set on failure.
+
+    With INFERENCE_WORKERS_ENABLED each chunk of `batch_size` images is one
+    inference pool request (registration priority, so vote verification still
+    goes first), with up to one chunk per worker in flight.
+    """
+    if INFERENCE_WORKERS_ENABLED:
+        return _register_batch_pooled(images, batch_size)
+    return _register_batch_local(images, batch_size)
+
+def _register_batch_pooled(images, batch_size):
+    from vision.inference import get_inference_pool, InferenceError
+
+    pool = get_inference_pool()
+    results = [None] * len(images)
+    starts = deque(range(0, len(images), batch_size))
+    inflight = deque()
+
+    def fail(start, error):
+        for i in range(start, min(start + batch_size, len(images))):
+            results[i] = {"embedding": None, "facial_area": None, "error": error}
+
+    while starts or inflight:
+        while starts and len(inflight) < pool.size:
+            start = starts.popleft()
+            try:
+                inflight.append((start, pool.submit_register_batch(images[start:start + batch_size], batch_size)))
+            except InferenceBusy as e:
+                fail(start, f"Face recognition busy: {e}")
+            except ModelUnavailable as e:
+                fail(start, str(e))
+        if not inflight:
+            continue
+        start, future = inflight.popleft()
+        try:
+            results[start:start + batch_size] = pool.wait(future)
+        except (InferenceBusy, InferenceError, ModelUnavailable) as e:
+            fail(start, f"Face recognition failed: {e}")
+    return results
+
+def _register_batch_local(images, batch_size=FACE_EMBED_BATCH_SIZE):
+    """register_batch() in this process (also what an inference worker runs per chunk)."""
+    manager = get_model_manager()
+    manager.load()
+
+    results = [None] * len(images)
+    crops, owners = [], []
+
+    # 1. Detection, per image (a failure only affects that image)
+    for i, img in enumerate(images):
+        try:
+            small, scale = _downscale(img)
+            faces = DeepFace.extract_faces(img_path = small, detector_backend = manager.detector_backend,
+                                           enforce_detection = True, align = True,
+                                           color_face = "bgr", normalize_face = True)
+            crops.append(faces[0]["face"])
+            owners.append((i, _rescale_area(faces[0]["facial_area"], scale)))
+        except Exception as e:
+            results[i] = {"embedding": None, "facial_area": None, "error": f"Face detection failed: {e}"}
+
+    # 2. Embedding, on stacked crops (detector skipped - crops are already aligned)
+    for start in range(0, len(crops), batch_size):
+        chunk = crops[start:start + batch_size]
+        chunk_owners = owners[start:start + batch_size]
+        try:
+            objs = DeepFace.represent(img_path = chunk, model_name = manager.model_name,
+                                      detector_backend = "skip", enforce_detection = False)
+            if len(chunk) == 1:
+                objs = [objs]
+            for (i, area), face_objs in zip(chunk_owners, objs):
+                results[i] = {"embedding": face_objs[0]["embedding"], "facial_area": area, "error": None}
+        except Exception as e:
+            for i, area in chunk_owners:
+                results[i] = {"embedding": None, "facial_area": area, "error": f"Embedding failed: {e}"}
+
+    return results
+
+def analyze(img, known_faces=None, threshold=MATCH_THRESHOLD, aligned=False):
+    """
+    Single-pass pipeline for registration: detects and embeds the face once and
+    matches it against the gallery in the same call.
+    Returns dict {embedding, facial_area, match, distance}, or None if no face was found.
+    match is the username of an existing voter within threshold (else None).
+    """
+    try:
+        face = _represent(img, aligned=aligned, priority=PRIORITY_REGISTER)
+    except (InferenceBusy, ModelUnavailable):
+        raise
+    except Exception as e:
+        print(f"Error analyzing face: {e}")
+        return None
+    if not face:
+        return None
+
+    match, distance = None, None
+    if known_faces:
+        match, distance = _as_index(known_faces).best_match(face["embedding"], threshold=threshold)
+    return {
+        "embedding": face["embedding"],
+        "facial_area": face.get("facial_area"),
+        "match": match,
+        "distance": distance,
+    }
+
+def _as_index(known_faces):
+    """Accepts a gallery index (FaceIndex / IVFIndex) or the legacy { 'username': embedding } dict."""
+    if hasattr(known_faces, "best_match"):
+        return known_faces
+    return FaceIndex.from_dict(known_faces)
+
+def recognize(img, known_faces_dict, aligned=False, priority=PRIORITY_VERIFY):
     """
-    Recognizes face/identity from the image using the provided known_faces_dict.
-    known_faces_dict format: { 'username': embedding_array, ... }
+    Recognizes face/identity from the image using the provided gallery.
+    known_faces_dict: FaceIndex/IVFIndex, or legacy format { 'username': embedding_array, ... }
+    priority: inference pool priority (registration's duplicate check passes PRIORITY_REGISTER)
     """
     try:
         if not known_faces_dict: return None
+        index = _as_index(known_faces_dict)
 
         # Get embedding for the input image
-        embedding_objs = DeepFace.represent(img_path = img, model_name = "VGG-Face", enforce_detection = True)
-        
-        if not embedding_objs:
+        face = _represent(img, aligned=aligned, priority=priority)
+        if not face:
             return None
-        
-        target_embedding = embedding_objs[0]["embedding"]
-        
-        min_dist = 100
-        identity = None
-        
-        # VGG-Face + Cosine usually has a threshold around 0.40
-        threshold = 0.40
-
-        for name, db_embedding in known_faces_dict.items():
-            dist = cosine(target_embedding, db_embedding)
-            if dist < min_dist:
-                min_dist = dist
-                identity = name
-        
-        if min_dist < threshold:
-            return identity
-        
-        return None
+        target_embedding = face["embedding"]
+
+        # Single matrix-vector product over the whole gallery
+        identity, _ = index.best_match(target_embedding, threshold=MATCH_THRESHOLD)
+        return identity
+    except (InferenceBusy, ModelUnavailable):
+        raise
     except Exception as e:
         # print(f"Error recognizing face: {e}")
         return None
 
-def check_face_exists(img, known_faces_dict):
+def check_face_exists(img, known_faces_dict, aligned=False):
     """
-    Checks if the face in 'img' already exists in the provided known_faces_dict.
+    Checks if the face in 'img' already exists in the provided gallery (index or dict).
     Returns the username if it exists, otherwise None.
     """
     # Reuse recognize logic as it does exactly this: finds best match in known list
-    return recognize(img, known_faces_dict)
+    return recognize(img, known_faces_dict, aligned=aligned, priority=PRIORITY_REGISTER)
+
+def verify(img, username, org_index=None, impostor_k=0, threshold=MATCH_THRESHOLD, aligned=False, voter_row=None):
+    """
+    1:1 verification: does the face in 'img' belong to 'username'?
+    Compares the probe against that one voter's stored embedding (single-row DB fetch)
+    instead of searching the whole gallery. aligned=True: img is already a face
+    crop (e.g. LivenessSession.face_crop()), so detection is skipped.
+
+    Optional impostor check: with impostor_k > 0 and the voter's org FaceIndex,
+    the probe's top-k neighbours in that org are inspected and verification fails if
+    another voter matches at least as closely as the claimed one.
+
+    voter_row: get_voter_embedding(username), if the caller already fetched it.
+
+    Returns True if verified, False if the face doesn't match (or no face was
+    found in img). Raises InferenceBusy when the inference pool is saturated and
+    VerificationError when the check itself failed; in both cases the voter
+    should retry, and the result must not be cached as a mismatch.
+    """
+    from database.db import get_voter_embedding, DBError
+
+    row = voter_row
+    if row is None:
+        try:
+            row = get_voter_embedding(username)
+        except DBError as e:
+            raise VerificationError(f"Could not load the registered face: {e}")
+    if not row or not row['face_embedding']:
+        return False
+    try:
+        reference = _normalize(decode_embedding(row['face_embedding']))
+    except Exception as e:
+        raise VerificationError(f"Stored face embedding is unreadable: {e}")
+
+    try:
+        face = _represent(img, aligned=aligned)
+    except InferenceBusy:
+        raise
+    except ValueError:
+        # No face detected / unreadable capture
+        return False
+    except Exception as e:
+        raise VerificationError(f"Face inference failed: {e}")
+    if not face:
+        return False
+    probe = _normalize(face["embedding"])
+    if reference is None or probe is None or reference.shape != probe.shape:
+        return False
+
+    dist = 1.0 - float(reference @ probe)
+    if dist >= threshold:
+        return False
+
+    if impostor_k and org_index is not None:
+        for other, other_dist in org_index.search(probe, k=impostor_k):
+            if other != username and other_dist <= dist:
+                return False
+    return True
+
+
+# Latency / error counters for the public functions above (see metrics.py)
+instrument_module(globals(), "face_recog")
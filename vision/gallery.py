@@ -0,0 +1,193 @@
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+from metrics import timed
+from vision.face_index import FaceIndex
+
+
+class GalleryCache:
+    """
+    Process-level cache of the registered-face gallery, shared by all sessions.
+
+    - The first get() loads every voter embedding once into a FaceIndex.
+    - Later calls sync incrementally (at most every `sync_interval` seconds): only
+      rows whose updated_at is at/after the last high-water mark are fetched.
+    - Loads and syncs are single-flight: concurrent callers wait on one lock and
+      reuse the result instead of each hitting the database.
+
+    fetch_since(since) -> list of {username, org_id, face_embedding, updated_at}, or None on error
+    decode(blob) -> embedding
+    index_factory() -> empty gallery index (FaceIndex, or vision.ann_index.IVFIndex)
+    track_orgs: also keep one FaceIndex per org (needed for verify() impostor checks)
+    snapshot_path: if the index supports save()/load(), it is restored from this file
+        at startup (then synced from its high-water mark) and re-saved at most every
+        `snapshot_interval` seconds after changes. Only used when track_orgs is False,
+        since per-org indexes are not part of the snapshot. The index keeps the
+        settings index_factory() gives it, not the saved ones.
+    model_name: recorded in the snapshot with the embedding dim; a snapshot made
+        with another model, or whose dim differs from the embeddings coming from
+        the database, is discarded and the gallery reloaded in full.
+    """
+
+    def __init__(self, fetch_since, decode, sync_interval=5, overlap=5,
+                 index_factory=FaceIndex, track_orgs=True, snapshot_path=None, snapshot_interval=300,
+                 model_name=None):
+        self.fetch_since = fetch_since
+        self.decode = decode
+        self.sync_interval = sync_interval
+        self.overlap = timedelta(seconds=overlap)
+        self.track_orgs = track_orgs
+        self.snapshot_path = snapshot_path if not track_orgs else None
+        self.snapshot_interval = snapshot_interval
+        self.model_name = model_name
+        self._last_snapshot = time.monotonic()
+        self._snapshot_dim = None  # embedding dim of a restored snapshot, until checked against the DB
+        self._snapshot_rejected = False
+
+        self.index_factory = index_factory
+        self.index = index_factory()
+        self.org_indexes = {}      # org_id -> FaceIndex (impostor checks within one org)
+        self._org_of = {}          # username -> org_id
+        self.version = 0           # bumped whenever the gallery contents change
+        self.high_water = None     # max updated_at seen so far
+        self._seen = {}            # username -> updated_at already applied (overlap re-reads)
+        self.loaded = False
+        self._last_sync = 0.0
+        self._stale = True
+        self._lock = threading.Lock()
+
+    def _is_fresh(self):
+        return self.loaded and not self._stale and time.monotonic() - self._last_sync < self.sync_interval
+
+    @timed("gallery.get")
+    def get(self):
+        """Returns the (synced) FaceIndex."""
+        if self._is_fresh():
+            return self.index
+        with self._lock:
+            # Another session may have synced while we waited
+            if not self._is_fresh():
+                self._sync()
+        return self.index
+
+    def org_index(self, org_id):
+        """Returns the (synced) FaceIndex of one organization's voters."""
+        self.get()
+        return self.org_indexes.get(org_id) or FaceIndex()
+
+    def invalidate(self):
+        """Forces a sync on the next get(), e.g. right after registering a voter."""
+        self._stale = True
+
+    def _restore_snapshot(self):
+        try:
+            index, meta = type(self.index).load(self.snapshot_path, like=self.index)
+        except Exception as e:
+            print(f"Ignoring unreadable gallery snapshot: {e}")
+            return
+        if meta.get("model_name") != self.model_name:
+            print(f"Ignoring gallery snapshot made with {meta.get('model_name')} (current model: {self.model_name})")
+            return
+        self.index = index
+        self._snapshot_dim = meta.get("dim")
+        if meta.get("high_water"):
+            self.high_water = datetime.fromisoformat(meta["high_water"])
+        self.loaded = True
+        self.version += 1
+
+    def _discard_snapshot(self):
+        """Back to an empty gallery, so the next sync is a full load."""
+        self.index = self.index_factory()
+        self.org_indexes, self._org_of, self._seen = {}, {}, {}
+        self.high_water = None
+        self.loaded = False
+        self._snapshot_dim = None
+        self._snapshot_rejected = True   # overwritten by the full load's snapshot
+
+    def _save_snapshot(self):
+        try:
+            meta = {"high_water": self.high_water.isoformat() if self.high_water else None,
+                    "model_name": self.model_name, "dim": getattr(self.index, "dim", None)}
+            self.index.save(self.snapshot_path, meta=meta)
+            self._last_snapshot = time.monotonic()
+        except Exception as e:
+            print(f"Error saving gallery snapshot: {e}")
+
+    @timed("gallery.sync")
+    def _sync(self):
+        if (not self.loaded and self.snapshot_path and not self._snapshot_rejected
+                and os.path.exists(self.snapshot_path)):
+            self._restore_snapshot()
+
+        since = None
+        if self.loaded and self.high_water is not None:
+            since = self.high_water - self.overlap
+
+        # Cleared before fetching so an invalidate() during the fetch is not lost
+        self._stale = False
+        rows = self.fetch_since(since)
+        self._last_sync = time.monotonic()
+        if rows is None:
+            # DB error: keep serving the last good gallery, retry next interval
+            return
+
+        changed = False
+        for row in rows:
+            username = row['username']
+            updated_at = row.get('updated_at')
+            if updated_at is not None and self._seen.get(username) == updated_at:
+                continue
+            self._seen[username] = updated_at
+
+            embedding = None
+            if row['face_embedding']:
+                try:
+                    embedding = self.decode(row['face_embedding'])
+                except Exception:
+                    pass
+
+            if embedding is not None and self._snapshot_dim is not None:
+                if len(embedding) != self._snapshot_dim:
+                    # Every row would be rejected by the restored index and, being
+                    # below the high-water mark later, never re-read: start over
+                    print(f"Gallery snapshot holds {self._snapshot_dim}-d embeddings, database has "
+                          f"{len(embedding)}-d; discarding the snapshot and reloading")
+                    self._discard_snapshot()
+                    return self._sync()
+                self._snapshot_dim = None
+
+            # Drop from the old org first (covers org moves and removals)
+            old_org = self._org_of.pop(username, None)
+            if old_org is not None and old_org != row.get('org_id'):
+                self.org_indexes[old_org].remove(username)
+
+            if embedding is not None and self.index.add(username, embedding):
+                if self.track_orgs:
+                    org_id = row.get('org_id')
+                    self.org_indexes.setdefault(org_id, FaceIndex()).add(username, embedding)
+                    self._org_of[username] = org_id
+                changed = True
+            else:
+                changed |= self.index.remove(username)
+                if old_org is not None and old_org in self.org_indexes:
+                    self.org_indexes[old_org].remove(username)
+
+            if updated_at is not None and (self.high_water is None or updated_at > self.high_water):
+                self.high_water = updated_at
+
+        first_load = not self.loaded
+        if changed or first_load:
+            self.version += 1
+        self.loaded = True
+
+        if self.snapshot_path and (first_load or (changed and time.monotonic() - self._last_snapshot >= self.snapshot_interval)):
+            self._save_snapshot()
+
+    def stats(self):
+        return {
+            "voters": len(self.index),
+            "version": self.version,
+            "high_water": self.high_water,
+        }
@@ -0,0 +1,332 @@
+"""
+Local inference service: face detection + embedding in worker processes.
+
+With INFERENCE_WORKERS_ENABLED, vision.face_recog sends each represent() call
+and each register_batch() chunk here instead of running DeepFace in the
+Streamlit script thread. Every worker is a separate (spawned) process holding
+its own warm model, so a burst of verifications no longer stalls pages that do
+no vision work.
+
+Admission control:
+  - requests wait in a bounded priority queue in this process (vote
+    verification before registration, FIFO within a priority);
+  - a full queue fails fast with InferenceBusy instead of piling up;
+  - every request has a deadline; one that expires while queued is dropped
+    without using a worker, and the caller gets InferenceBusy (a full queue
+    drops its expired entries before turning a new request away);
+  - if no worker could load its model, callers get ModelUnavailable with the
+    load error instead of waiting out their deadline.
+Each worker runs one request at a time, so a crashed worker fails exactly one
+request and is replaced.
+"""
+import atexit
+import heapq
+import itertools
+import multiprocessing as mp
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+
+from config import INFERENCE_WORKERS, INFERENCE_QUEUE_SIZE, INFERENCE_DEADLINE, INFERENCE_WORKER_THREADS
+from config import INFERENCE_BATCH_DEADLINE
+from config import FACE_MODEL_NAME, FACE_DETECTOR_BACKEND, FACE_MODEL_WARMUP
+from metrics import timed, instrument_module
+
+# Lower runs first
+PRIORITY_VERIFY = 0
+PRIORITY_REGISTER = 1
+
+
+class InferenceBusy(Exception):
+    """Saturated or past deadline: the caller should ask the user to retry."""
+
+
+class InferenceError(Exception):
+    """The worker ran the request and it failed (e.g. no face found)."""
+
+
+class ModelUnavailable(Exception):
+    """No worker could load the face model; retrying won't help until it is fixed."""
+
+
+# --- Worker process ---
+
+def _worker_main(worker_id, tasks, results, model_name, detector_backend, threads):
+    if threads:
+        try:
+            import tensorflow as tf
+            tf.config.threading.set_intra_op_parallelism_threads(threads)
+            tf.config.threading.set_inter_op_parallelism_threads(1)
+        except Exception:
+            pass
+
+    from vision.models import ModelManager
+    import vision.models
+    import vision.face_recog as face_recog
+
+    # The worker's own process-wide manager: face_recog's inline path uses it
+    manager = ModelManager(model_name, detector_backend)
+    vision.models._manager = manager
+    if not manager.load(warm_up=FACE_MODEL_WARMUP):
+        results.put(("failed", worker_id, None, manager.error))
+        return
+    results.put(("ready", worker_id, None, None))
+
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        request_id, kind, args = task
+        try:
+            if kind == "represent":
+                face = face_recog._represent_local(*args)
+                if face is not None:
+                    face = {"embedding": list(face["embedding"]), "facial_area": face.get("facial_area"),
+                            "face_confidence": face.get("face_confidence")}
+                results.put(("ok", worker_id, request_id, face))
+            elif kind == "register_batch":
+                results.put(("ok", worker_id, request_id, face_recog._register_batch_local(*args)))
+            else:
+                results.put(("error", worker_id, request_id, f"Unknown request kind: {kind}"))
+        except Exception as e:
+            results.put(("error", worker_id, request_id, str(e)))
+
+
+# --- Pool (lives in the Streamlit process) ---
+
+class InferencePool:
+    def __init__(self, workers=INFERENCE_WORKERS, queue_size=INFERENCE_QUEUE_SIZE,
+                 model_name=FACE_MODEL_NAME, detector_backend=FACE_DETECTOR_BACKEND,
+                 threads=INFERENCE_WORKER_THREADS):
+        self.size = workers
+        self.queue_size = queue_size
+        self.model_name = model_name
+        self.detector_backend = detector_backend
+        self.threads = threads
+        self._ctx = mp.get_context("spawn")
+        self._results = self._ctx.Queue()
+        self._procs = {}
+        self._tasks = {}
+        self._inflight = {}             # worker_id -> (request_id, future)
+        self._idle = queue.Queue()      # worker ids ready for a request
+        self._failed = set()            # workers whose models would not load (not restarted)
+        self._pending = []              # heap of (priority, seq, deadline, request_id, kind, args, future)
+        self._cond = threading.Condition()
+        self._seq = itertools.count()
+        self._closed = False
+        self._threads = []
+        self.completed = 0
+        self.rejected = 0
+        self.expired = 0
+        self.restarts = 0
+        self.last_error = None
+
+    def start(self):
+        for worker_id in range(self.size):
+            self._spawn(worker_id)
+        for target in (self._dispatch, self._collect):
+            thread = threading.Thread(target=target, daemon=True, name=f"inference-{target.__name__.strip('_')}")
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def _spawn(self, worker_id):
+        tasks = self._ctx.Queue()
+        proc = self._ctx.Process(
+            target=_worker_main, name=f"face-worker-{worker_id}", daemon=True,
+            args=(worker_id, tasks, self._results, self.model_name, self.detector_backend, self.threads),
+        )
+        proc.start()
+        self._procs[worker_id] = proc
+        self._tasks[worker_id] = tasks
+
+    # --- Callers ---
+
+    def submit(self, kind, args, priority=PRIORITY_VERIFY, timeout=INFERENCE_DEADLINE):
+        """Queues a request. Returns a Future; raises InferenceBusy at once if the queue is full."""
+        future = Future()
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            if self._closed:
+                raise InferenceBusy("Inference service is shut down")
+            if self._all_failed():
+                raise ModelUnavailable(f"Face model failed to load: {self.last_error}")
+            if len(self._pending) >= self.queue_size:
+                self._drop_expired()
+            if len(self._pending) >= self.queue_size:
+                self.rejected += 1
+                raise InferenceBusy("Face recognition is busy, please retry")
+            heapq.heappush(self._pending, (priority, next(self._seq), deadline, id(future), kind, args, future))
+            self._cond.notify()
+        future.deadline = deadline
+        return future
+
+    @staticmethod
+    def wait(future):
+        """Result of a submit()ted request. Raises InferenceBusy (deadline) or InferenceError."""
+        try:
+            return future.result(timeout=max(0.0, future.deadline - time.monotonic()))
+        except FutureTimeout:
+            raise InferenceBusy("Face recognition timed out, please retry")
+
+    @timed("inference.call")
+    def call(self, kind, args, priority=PRIORITY_VERIFY, timeout=INFERENCE_DEADLINE):
+        """submit() and wait. Raises InferenceBusy (saturated / deadline) or InferenceError."""
+        return self.wait(self.submit(kind, args, priority=priority, timeout=timeout))
+
+    def represent(self, img, aligned=False, priority=PRIORITY_VERIFY, timeout=INFERENCE_DEADLINE):
+        return self.call("represent", (img, aligned), priority=priority, timeout=timeout)
+
+    def submit_register_batch(self, images, batch_size, timeout=INFERENCE_BATCH_DEADLINE):
+        """One register_batch() chunk on one worker, at registration priority. Returns a Future."""
+        return self.submit("register_batch", (images, batch_size), priority=PRIORITY_REGISTER, timeout=timeout)
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            pending, self._pending = self._pending, []
+            self._cond.notify_all()
+        for item in pending:
+            item[-1].set_exception(InferenceBusy("Inference service is shut down"))
+        for worker_id, tasks in self._tasks.items():
+            try:
+                tasks.put(None)
+            except Exception:
+                pass
+        for proc in self._procs.values():
+            proc.join(timeout=2)
+            if proc.is_alive():
+                proc.terminate()
+
+    def stats(self):
+        with self._cond:
+            queued = len(self._pending)
+        return {
+            "workers": self.size,
+            "alive": sum(p.is_alive() for p in self._procs.values()),
+            "idle": self._idle.qsize(),
+            "busy": len(self._inflight),
+            "queued": queued,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "expired": self.expired,
+            "restarts": self.restarts,
+            "last_error": self.last_error,
+        }
+
+    def _all_failed(self):
+        return len(self._failed) >= self.size
+
+    def _drop_expired(self):
+        """Under the lock: frees the queue slots of requests whose deadline has passed."""
+        now = time.monotonic()
+        live = []
+        for item in self._pending:
+            future = item[-1]
+            if now < item[2] and not future.done():
+                live.append(item)
+                continue
+            self.expired += 1
+            if not future.done():
+                future.set_exception(InferenceBusy("Face recognition timed out in queue, please retry"))
+        if len(live) != len(self._pending):
+            heapq.heapify(live)
+            self._pending = live
+
+    # --- Background threads ---
+
+    def _next_request(self):
+        """Blocks for the highest-priority live request; expired ones fail without using a worker."""
+        with self._cond:
+            while True:
+                while not self._pending and not self._closed:
+                    self._cond.wait()
+                if self._closed:
+                    return None
+                priority, _, deadline, request_id, kind, args, future = heapq.heappop(self._pending)
+                if time.monotonic() >= deadline or future.done():
+                    self.expired += 1
+                    if not future.done():
+                        future.set_exception(InferenceBusy("Face recognition timed out in queue, please retry"))
+                    continue
+                return request_id, kind, args, future
+
+    def _dispatch(self):
+        while not self._closed:
+            worker_id = self._idle.get()
+            # Skip stale entries (worker replaced after a crash, or already handed a request)
+            if worker_id in self._inflight or not self._procs[worker_id].is_alive():
+                continue
+            request = self._next_request()
+            if request is None:
+                return
+            request_id, kind, args, future = request
+            self._inflight[worker_id] = (request_id, future)
+            self._tasks[worker_id].put((request_id, kind, args))
+
+    def _collect(self):
+        while not self._closed:
+            # Every iteration, not only when idle: under steady load results never stop arriving
+            self._reap()
+            try:
+                status, worker_id, request_id, payload = self._results.get(timeout=1.0)
+            except queue.Empty:
+                continue
+            if status == "ready":
+                self._idle.put(worker_id)
+                continue
+            if status == "failed":
+                print(f"Face worker {worker_id} failed to load models: {payload}")
+                with self._cond:
+                    self._failed.add(worker_id)
+                    self.last_error = payload
+                    if self._all_failed():
+                        # Nothing will ever serve the queue: fail it now with the load error
+                        pending, self._pending = self._pending, []
+                    else:
+                        pending = []
+                for item in pending:
+                    if not item[-1].done():
+                        item[-1].set_exception(ModelUnavailable(f"Face model failed to load: {payload}"))
+                continue
+            inflight = self._inflight.pop(worker_id, None)
+            self._idle.put(worker_id)
+            if inflight is None or inflight[0] != request_id or inflight[1].done():
+                continue
+            future = inflight[1]
+            self.completed += 1
+            if status == "ok":
+                future.set_result(payload)
+            else:
+                future.set_exception(InferenceError(payload))
+
+    def _reap(self):
+        """Replaces dead workers; their in-flight request fails with InferenceBusy."""
+        for worker_id, proc in list(self._procs.items()):
+            if proc.is_alive() or self._closed or worker_id in self._failed:
+                continue
+            inflight = self._inflight.pop(worker_id, None)
+            if inflight and not inflight[1].done():
+                inflight[1].set_exception(InferenceBusy("Face worker crashed, please retry"))
+            self.restarts += 1
+            print(f"Face worker {worker_id} exited ({proc.exitcode}); restarting")
+            self._spawn(worker_id)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_inference_pool():
+    """Process-wide InferencePool, started (workers warming up) on first use."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = InferencePool().start()
+                atexit.register(_pool.close)
+    return _pool
+
+
+# Latency / error counters for the public functions above (see metrics.py)
+instrument_module(globals(), "inference")
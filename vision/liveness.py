@@ -1,6 +1,11 @@
 import cv2
 import time
 
+from config import LIVENESS_DETECT_WIDTH, LIVENESS_REDETECT_INTERVAL, LIVENESS_FACE_TIMEOUT, LIVENESS_MAX_CLOSED
+from config import LIVENESS_BACKEND
+from metrics import timed, instrument_module
+from vision.blink import BlinkDetector, eyes_from_landmarks, eye_aspect_ratios
+
 # Load Haar Cascades
 # cv2.data.haarcascades gives the path to xml files
 face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
@@ -9,54 +14,265 @@ eye_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_eye.xml
 # Blink State Machine
 STATE_EYES_OPEN = 0
 STATE_EYES_CLOSED = 1
-current_state = STATE_EYES_OPEN
-blink_counter = 0
-
-last_blink_time = 0
-
-def check_liveness(frame):
-    global current_state, blink_counter, last_blink_time
-    
-    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-    
-    # Detect faces
-    faces = face_cascade.detectMultiScale(gray, 1.3, 5)
-    
-    eyes_detected = False
-    
-    for (x, y, w, h) in faces:
-        roi_gray = gray[y:y+h, x:x+w]
-        
-        # Detect eyes within the face
-        eyes = eye_cascade.detectMultiScale(roi_gray, 1.1, 4)
-        
-        if len(eyes) >= 1:
-            eyes_detected = True
-            break # Found eyes in at least one face
-
-    # Blink Logic
-    # Transition: OPEN -> CLOSED -> OPEN = BLINK
-    
-    timestamp = time.time()
-    
-    if current_state == STATE_EYES_OPEN:
-        if not eyes_detected:
-            # Maybe blinking?
-            current_state = STATE_EYES_CLOSED
-            
-    elif current_state == STATE_EYES_CLOSED:
-        if eyes_detected:
-            # Eyes re-opened! Blink confirmed.
-            current_state = STATE_EYES_OPEN
-            blink_counter += 1
-            last_blink_time = timestamp
-            return True # Return true on the frame the blink finishes
-        
-    # Reset if closed for too long (might be lost tracking)
-    # But for now, simple is fine.
-    
-    return False
-
-def reset_liveness():
-    global blink_counter
-    blink_counter = 0
+
+# Tracked face box is searched again inside this margin (fraction of its size)
+TRACK_MARGIN = 0.3
+# Face box size the local search / eye search works at
+TRACK_WIDTH = 160
+
+
+def _detect_faces(gray, width):
+    """Face cascade on a copy downscaled to `width`; boxes in `gray` coordinates."""
+    h, w = gray.shape[:2]
+    scale = min(1.0, width / float(w))
+    small = cv2.resize(gray, (int(w * scale), int(h * scale)), interpolation=cv2.INTER_AREA) if scale < 1.0 else gray
+    faces = face_cascade.detectMultiScale(small, 1.3, 5)
+    return [tuple(int(v / scale) for v in face) for face in faces]
+
+
+def _largest(faces):
+    return max(faces, key=lambda f: f[2] * f[3]) if len(faces) else None
+
+
+def crop_face(frame, box, margin=0.2):
+    """Face box (x, y, w, h) plus a margin, clipped to the frame. None without a box."""
+    if box is None:
+        return None
+    x, y, w, h = box
+    mx, my = int(w * margin), int(h * margin)
+    x0, y0 = max(0, x - mx), max(0, y - my)
+    x1, y1 = min(frame.shape[1], x + w + mx), min(frame.shape[0], y + h + my)
+    if x1 <= x0 or y1 <= y0:
+        return None
+    return frame[y0:y1, x0:x1]
+
+
+class LivenessSession:
+    """
+    Blink-based liveness state for ONE user (keep one per Streamlit session).
+
+    The face is found once with a full-frame (downscaled) cascade and then
+    tracked: each later frame only searches a small window around the last box,
+    and the eye cascade only runs on the upper half of the face. The full frame
+    is searched again every `redetect_interval` frames or when tracking is lost.
+
+    A blink is eyes visible -> not visible -> visible again, with the face
+    present throughout. Eyes "closed" for longer than `max_closed` seconds is not
+    a blink (looking away, tracking drift); no face for `face_timeout` seconds
+    resets the session.
+    """
+
+    def __init__(self, detect_width=LIVENESS_DETECT_WIDTH, redetect_interval=LIVENESS_REDETECT_INTERVAL,
+                 face_timeout=LIVENESS_FACE_TIMEOUT, max_closed=LIVENESS_MAX_CLOSED):
+        self.detect_width = detect_width
+        self.redetect_interval = redetect_interval
+        self.face_timeout = face_timeout
+        self.max_closed = max_closed
+        self.reset()
+
+    def reset(self):
+        self.state = STATE_EYES_OPEN
+        self.blink_counter = 0
+        self.last_blink_time = 0
+        self.face = None            # (x, y, w, h) in frame coordinates
+        self.frames_since_detect = 0
+        self.last_face_time = None
+        self.closed_since = None
+
+    def close(self):
+        # Nothing to release (same interface as LandmarkLivenessSession)
+        pass
+
+    # --- Face tracking ---
+
+    def _track(self, gray):
+        """Looks for the face near its last position. Returns the new box or None."""
+        x, y, w, h = self.face
+        mx, my = int(w * TRACK_MARGIN), int(h * TRACK_MARGIN)
+        x0, y0 = max(0, x - mx), max(0, y - my)
+        x1, y1 = min(gray.shape[1], x + w + mx), min(gray.shape[0], y + h + my)
+        window = gray[y0:y1, x0:x1]
+        if window.size == 0:
+            return None
+        # Scale so the window is about TRACK_WIDTH * (1 + 2 * margin) wide
+        found = _detect_faces(window, int(TRACK_WIDTH * (1 + 2 * TRACK_MARGIN)))
+        box = _largest(found)
+        if box is None:
+            return None
+        return (box[0] + x0, box[1] + y0, box[2], box[3])
+
+    def _locate_face(self, gray):
+        face = None
+        if self.face is not None and self.frames_since_detect < self.redetect_interval:
+            face = self._track(gray)
+        if face is None:
+            face = _largest(_detect_faces(gray, self.detect_width))
+            self.frames_since_detect = 0
+        else:
+            self.frames_since_detect += 1
+        return face
+
+    def _eyes_visible(self, gray, face):
+        x, y, w, h = face
+        # Eyes sit in the upper half of the face box
+        roi = gray[y:y + h // 2, x:x + w]
+        if roi.size == 0:
+            return False
+        if w > TRACK_WIDTH:
+            scale = TRACK_WIDTH / float(w)
+            roi = cv2.resize(roi, (TRACK_WIDTH, max(1, int(roi.shape[0] * scale))), interpolation=cv2.INTER_AREA)
+        eyes = eye_cascade.detectMultiScale(roi, 1.1, 4)
+        return len(eyes) >= 1
+
+    def face_crop(self, frame):
+        """
+        Crop of the tracked face in `frame` (the last frame processed), for
+        face_recog's aligned=True path so recognition skips its own detection.
+        """
+        return crop_face(frame, self.face)
+
+    # --- Per frame ---
+
+    @timed("liveness.haar.process")
+    def process(self, frame, timestamp=None):
+        """Feeds one BGR frame. Returns True on the frame a blink completes."""
+        timestamp = time.monotonic() if timestamp is None else timestamp
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+
+        face = self._locate_face(gray)
+        if face is None:
+            self.face = None
+            if self.last_face_time is not None and timestamp - self.last_face_time > self.face_timeout:
+                # Face gone: start over rather than count a blink across it
+                self.state = STATE_EYES_OPEN
+                self.closed_since = None
+                self.last_face_time = None
+            return False
+        self.face = face
+        self.last_face_time = timestamp
+
+        eyes_detected = self._eyes_visible(gray, face)
+
+        # Transition: OPEN -> CLOSED -> OPEN = BLINK
+        if self.state == STATE_EYES_OPEN:
+            if not eyes_detected:
+                self.state = STATE_EYES_CLOSED
+                self.closed_since = timestamp
+        elif self.state == STATE_EYES_CLOSED:
+            if eyes_detected:
+                closed_for = timestamp - self.closed_since
+                self.state = STATE_EYES_OPEN
+                self.closed_since = None
+                if closed_for <= self.max_closed:
+                    self.blink_counter += 1
+                    self.last_blink_time = timestamp
+                    return True
+        return False
+
+
+class LandmarkLivenessSession:
+    """
+    Blink liveness from MediaPipe Face Mesh eye landmarks (EAR) instead of the
+    Haar eye cascade. Same interface as LivenessSession; one per user, since the
+    Face Mesh graph tracks the face across that user's frames.
+    """
+
+    def __init__(self, detect_width=LIVENESS_DETECT_WIDTH, face_timeout=LIVENESS_FACE_TIMEOUT):
+        import mediapipe as mp
+        self.detect_width = detect_width
+        self.face_timeout = face_timeout
+        self._mesh = mp.solutions.face_mesh.FaceMesh(
+            static_image_mode=False, max_num_faces=1, refine_landmarks=False,
+            min_detection_confidence=0.5, min_tracking_confidence=0.5,
+        )
+        self._detector = BlinkDetector()
+        self.reset()
+
+    def reset(self):
+        self._detector.reset()
+        self.blink_counter = 0
+        self.last_blink_time = 0
+        self.last_face_time = None
+        self.last_ear = None
+        self.face = None            # (x, y, w, h) in frame coordinates
+
+    def face_crop(self, frame):
+        """Crop of the face found in `frame` (the last frame processed); see LivenessSession.face_crop."""
+        return crop_face(frame, self.face)
+
+    @timed("liveness.landmarks.process")
+    def process(self, frame, timestamp=None):
+        """Feeds one BGR frame. Returns True on the frame a blink completes."""
+        timestamp = time.monotonic() if timestamp is None else timestamp
+        full_h, full_w = frame.shape[:2]
+        h, w = full_h, full_w
+        if w > self.detect_width:
+            scale = self.detect_width / float(w)
+            frame = cv2.resize(frame, (self.detect_width, int(h * scale)), interpolation=cv2.INTER_AREA)
+            h, w = frame.shape[:2]
+
+        result = self._mesh.process(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+        if not result.multi_face_landmarks:
+            self.face = None
+            if self.last_face_time is not None and timestamp - self.last_face_time > self.face_timeout:
+                self._detector.reset()
+                self.last_face_time = None
+            return False
+        self.last_face_time = timestamp
+
+        landmarks = result.multi_face_landmarks[0].landmark
+        # Landmarks are normalized, so the box maps straight onto the full-size frame
+        xs = [p.x for p in landmarks]
+        ys = [p.y for p in landmarks]
+        x0, y0 = int(min(xs) * full_w), int(min(ys) * full_h)
+        self.face = (x0, y0, int(max(xs) * full_w) - x0, int(max(ys) * full_h) - y0)
+
+        eyes = eyes_from_landmarks(landmarks, w, h)
+        self.last_ear = float(eye_aspect_ratios(eyes).mean())
+        if self._detector.push(self.last_ear):
+            self.blink_counter += 1
+            self.last_blink_time = timestamp
+            return True
+        return False
+
+    def close(self):
+        self._mesh.close()
+
+
+LIVENESS_BACKENDS = {
+    "haar": LivenessSession,
+    "landmarks": LandmarkLivenessSession,
+}
+
+def create_liveness_session(backend=LIVENESS_BACKEND):
+    """New per-user session for the configured backend (falls back to Haar without mediapipe)."""
+    if backend not in LIVENESS_BACKENDS:
+        raise ValueError(f"Unknown liveness backend: {backend}")
+    try:
+        return LIVENESS_BACKENDS[backend]()
+    except ImportError as e:
+        print(f"Liveness backend '{backend}' unavailable ({e}); using Haar cascades.")
+        return LivenessSession()
+
+
+# --- Per-user session helpers ---
+
+def get_liveness_session(state, key="liveness_session"):
+    """
+    The user's LivenessSession, kept in `state` (st.session_state) so every
+    browser session has its own blink state. Created on first use.
+    """
+    session = state.get(key)
+    if session is None:
+        session = state[key] = create_liveness_session()
+    return session
+
+def check_liveness(frame, session):
+    return session.process(frame)
+
+def reset_liveness(session):
+    session.reset()
+
+
+# Latency / error counters for the public functions above (see metrics.py)
+instrument_module(globals(), "liveness", exclude=("crop_face",))
@@ -0,0 +1,101 @@
+import threading
+import time
+
+import numpy as np
+from deepface import DeepFace
+
+from config import FACE_MODEL_NAME, FACE_DETECTOR_BACKEND
+from metrics import timed, instrument_module
+
+# Readiness states
+STATE_COLD = "cold"
+STATE_LOADING = "loading"
+STATE_READY = "ready"
+STATE_FAILED = "failed"
+
+
+class ModelManager:
+    """
+    Keeps the face embedding model and detector resident: loaded exactly once per
+    process and shared by every Streamlit session.
+
+    DeepFace builds models lazily inside the first represent() call (and without a
+    lock, so a burst of first requests can build them several times). load() does
+    it once, up front, under a lock; later represent() calls hit DeepFace's model
+    cache. An optional dummy inference warms up the TensorFlow graph as well.
+    """
+
+    def __init__(self, model_name=FACE_MODEL_NAME, detector_backend=FACE_DETECTOR_BACKEND):
+        self.model_name = model_name
+        self.detector_backend = detector_backend
+        self.state = STATE_COLD
+        self.error = None
+        self.load_seconds = None
+        self.model = None
+        self._lock = threading.Lock()
+
+    @property
+    def ready(self):
+        return self.state == STATE_READY
+
+    @timed("models.load")
+    def load(self, warm_up=True):
+        """Loads model + detector (idempotent, thread-safe). Returns True when ready."""
+        if self.ready:
+            return True
+        with self._lock:
+            if self.ready:
+                return True
+            self.state = STATE_LOADING
+            start = time.monotonic()
+            try:
+                self.model = DeepFace.build_model(self.model_name)
+                if self.detector_backend != "skip":
+                    DeepFace.build_model(self.detector_backend, task="face_detector")
+                if warm_up:
+                    self._warm_up()
+                self.load_seconds = time.monotonic() - start
+                self.error = None
+                self.state = STATE_READY
+            except Exception as e:
+                self.error = str(e)
+                self.state = STATE_FAILED
+                print(f"Error loading face models: {e}")
+        return self.ready
+
+    def load_in_background(self, warm_up=True):
+        """Starts load() on a daemon thread so the first page renders immediately."""
+        if self.state in (STATE_COLD, STATE_FAILED):
+            threading.Thread(target=self.load, kwargs={"warm_up": warm_up}, daemon=True).start()
+
+    def _warm_up(self):
+        # Dummy inference: runs detector + model once so the first voter doesn't pay graph setup
+        dummy = np.zeros((224, 224, 3), dtype=np.uint8)
+        DeepFace.represent(img_path = dummy, model_name = self.model_name,
+                           detector_backend = self.detector_backend, enforce_detection = False)
+
+    def status(self):
+        return {
+            "state": self.state,
+            "model_name": self.model_name,
+            "detector_backend": self.detector_backend,
+            "load_seconds": self.load_seconds,
+            "error": self.error,
+        }
+
+
+_manager = None
+_manager_lock = threading.Lock()
+
+def get_model_manager():
+    """Process-wide ModelManager configured from config.py."""
+    global _manager
+    if _manager is None:
+        with _manager_lock:
+            if _manager is None:
+                _manager = ModelManager()
+    return _manager
+
+
+# Latency / error counters for the public functions above (see metrics.py)
+instrument_module(globals(), "models")
@@ -0,0 +1,63 @@
+import hashlib
+import time
+from collections import OrderedDict
+
+from config import VERIFY_CACHE_SIZE, VERIFY_CACHE_TTL
+from metrics import instrument_module
+
+
+def image_key(image_bytes, *parts):
+    """
+    Cache key for a captured image plus whatever else the result depends on
+    (username, the voter's stored embedding, threshold, ...). bytes parts are
+    hashed as they are.
+    """
+    h = hashlib.blake2b(image_bytes, digest_size=16)
+    for part in parts:
+        h.update(b"\0" + (part if isinstance(part, bytes) else repr(part).encode()))
+    return h.hexdigest()
+
+
+class VerificationCache:
+    """
+    Small LRU + TTL memo of face verification results, meant to live in one
+    user's st.session_state.
+
+    st.camera_input keeps returning the same capture on every rerun (choosing a
+    candidate, pressing Submit Vote), so without this each rerun re-runs the full
+    DeepFace inference on an image that was already verified.
+    """
+
+    def __init__(self, max_entries=VERIFY_CACHE_SIZE, ttl=VERIFY_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()   # key -> (result, stored_at)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        entry = self._entries.get(key)
+        if entry is None or time.monotonic() - entry[1] > self.ttl:
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return default
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def put(self, key, result):
+        self._entries[key] = (result, time.monotonic())
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+# Latency / error counters for the public functions above (see metrics.py)
+instrument_module(globals(), "verify_cache")